@@ -2,248 +2,494 @@ import atexit
 import os
 import re
 import signal
-import subprocess
 import threading
 import time
 from pathlib import Path
 
 from functions.command_runner import run_terminal_command
 from functions.compressor import encode_video
-from functions.config import PROJECT_ROOT, load_config
-from functions.file_handler import load_json, save_json
+from functions.autotune import Autotuner
+from functions.cluster import LeaseCoordinator
+from functions.copier import encode_path, partial_path, use_scratch
+from functions.config import (
+    PROJECT_ROOT, DATA_FILE_PATH, JOBS_DB_PATH, AUTOTUNE_FILE_PATH,
+    STORAGE_FILE_PATH, load_config
+)
+from functions.disk_stats import gib_to_bytes
+from functions.encoders import check_encoders
+from functions.file_handler import load_json
+from functions.job_store import JobStore
+from functions.prefetch import PrefetchCache
+from functions.priority import check_priorities
+from functions.segment_encoder import segment_dir, remove_segments
+from functions.space_ledger import SpaceLedger
+from functions.storage_metrics import StorageMetrics, storage_paths
+from functions.supervisor import Supervisor
+from functions.remux import set_remux_decision
+from functions.throughput import record_encode
+from functions.verifier import next_status
+from functions.async_supervisor import AsyncSupervisor
+from functions.watcher import Watcher
 import functions.logger  # Needed for logging
 import functions.job_creation as jc
 from functions.flags import (
     ALL_FLAGS, get_flag_creation_time, remove_flag, get_active_flags
 )
 
-# Set working directory to script directory
-script_path = os.path.abspath(__file__)
-script_directory = os.path.dirname(script_path)
-os.chdir(script_directory)
-
-# == Import configuration ==
-CONFIG = load_config()
-maxencodejobs = CONFIG.max_encode_jobs
-maxframecountjobs = CONFIG.max_frame_count_jobs
-qualitypresets = CONFIG.quality_presets
-
-DATA_FILE_PATH = PROJECT_ROOT / "data.json"
-
-# Synchronization Lock: Protects the 'data' dictionary from concurrent access
-data_lock = threading.Lock()
-
-stopping_flag = False
-
-current_jobs = []
-
-current_flags = []
-
-
-def signal_handler(sig, frame):
-    global stopping_flag
-    # Use the lock when modifying a shared global variable
-    with data_lock:
-        if stopping_flag:
-            print("\nForce Exiting...")
-            cleanup_subprocess()
-            os._exit(1)
-
-
-signal.signal(signal.SIGINT, signal_handler)
-
-
-@atexit.register
-def cleanup_subprocess():
-    for curjob in current_jobs:
-        process = curjob.get('process')
-        if process and process.poll() is None:  # Check if process is running
-            print("Terminating subprocess...")
-            process.terminate()
-            try:
-                process.wait(timeout=5)  # Give it some time to terminate
-            except subprocess.TimeoutExpired:
-                print("Subprocess did not terminate gracefully, killing...")
-                process.kill()
-
-
-@atexit.register
-def print_all_errors():
-    for uid, job in data.items():
-        if job.get("status") == 'error':
-            print(f'Job {uid} failed due to :')
-            print(f'  {job.get("error", "Unknown")}')
-
-
-data = load_json(DATA_FILE_PATH)
-
-# == REMOVE FLAGS ==
-flags = ALL_FLAGS
-print(f"Removing ALL flags: {ALL_FLAGS}")
-for flag in flags:
-    remove_flag(flag)
-
-print("Cleaning up data.json")
-jobs_to_delete = []
-# Ensure safe access to shared data structure using the lock
-with data_lock:
-    for uid, job in data.items():
-        status = job.get("status")
-
-        # 1. Remove finished jobs
-        if status in ["encoded", "copied"]:
-            jobs_to_delete.append(uid)
-
-        # 2. Reset jobs interrupted to 'not_started'
-        elif status == "getting_frames":
-            print(f"Resetting interrupted job {
-                  uid} ({job.get('name', 'N/A')}) to 'not_started'.")
-            job["status"] = "not_started"
-        elif status == "encoding":
-            print(f"Resetting interrupted job {
-                  uid} ({job.get('name', 'N/A')}) to 'ready_to_encode'.")
-            job["status"] = "ready_to_encode"
-            try:
-                os.remove(job['encoded_file'])
-            except Exception as e:
-                print(f'Failed to remove due to error: {e}')
-                pass
-
-        # 3. Keep jobs that are ready to encode (frame count is already done)
-        elif status == "ready_to_encode":
-            print(f"Job {uid} is 'ready_to_encode' and will be prioritized.")
-
-        # 4. Report error jobs
-        elif status == "error":
-            joberror = job.get('error', 'Unknown')
-            print(f"Job {uid} is in 'error' state. Error: {joberror}")
-            jobaction = input(
-                'Reset/delete/ignore job? (R/d/i): ').strip().lower()
-            if jobaction in ['r', '']:
-                if job.get('frames', None):
-                    job['status'] = 'ready_to_encode'
-                    try:
-                        os.remove(job['encoded_file'])
-                    except Exception as e:
-                        print(f'Failed to remove due to error: {e}')
-                        pass
-                else:
-                    job['status'] = 'not_started'
-                    job['error'] = ''
-            elif jobaction == 'd':
-                jobs_to_delete.append(uid)
-            elif jobaction != 'i':
-                print('Unknown action. Ignoring.')
-
-    # Perform the deletion outside the iteration
-    for uid in jobs_to_delete:
-        del data[uid]
-        print(f"Removed completed job {uid}.")
-
-print("Data cleanup complete.")
-
-
-try:
-    while not stopping_flag or current_jobs:
-        # == Flag handling ==
-        # -- Print new flags --
-        new_current_flags = get_active_flags()
-
-        new_flags = set(new_current_flags) - set(current_flags)
-        removed_flags = set(current_flags) - set(new_current_flags)
-
-        if new_flags:
-            print("Flag(s) enabled:", new_flags)
-        if removed_flags:
-            print("Flags(s) disabled:", removed_flags)
-
-        current_flags = new_current_flags
-
-        # -- Act on flags --
+# How often the loop wakes up while encodes are running (seconds)
+WAKE_INTERVAL = 1.0
+
+# How often the loop wakes up otherwise, to measure the disks for the TUI
+# and retry jobs waiting for disk space (seconds)
+IDLE_INTERVAL = 15
+
+
+def main():
+    """
+    Runs the daemon until it is stopped.
+    """
+    # Set working directory to script directory
+    script_path = os.path.abspath(__file__)
+    script_directory = os.path.dirname(script_path)
+    os.chdir(script_directory)
+
+    # == Import configuration ==
+    CONFIG = load_config()
+    maxencodejobs = CONFIG.max_encode_jobs
+    maxframecountjobs = CONFIG.max_frame_count_jobs
+    qualitypresets = CONFIG.quality_presets
+    # Every preset's encoder must be in this ffmpeg build
+    if not check_encoders(qualitypresets):
+        print("Fix quality_presets in config.json and start the daemon again.")
+        raise SystemExit(1)
+    if CONFIG.cluster_enabled and not CONFIG.cluster_secret:
+        print("Set CLUSTER_SECRET in .env to use cluster.")
+        raise SystemExit(1)
+    check_priorities(CONFIG.priority)
+    scheduler = jc.EncodeScheduler(
+        CONFIG.scheduler_policy,
+        CONFIG.scheduler_aging_per_hour,
+        CONFIG.scheduler_fair_share
+    )
+    # Replaces job_limits.encode with a measured value per quality preset
+    autotuner = Autotuner(
+        AUTOTUNE_FILE_PATH,
+        CONFIG.autotune_max_encode_jobs,
+        CONFIG.autotune_window
+    ) if CONFIG.autotune_enabled else None
+
+    # Measures every disk in use and shares the results with the TUI
+    storage = StorageMetrics(
+        storage_paths(CONFIG), snapshot_path=STORAGE_FILE_PATH)
+
+    # Reserves the expected output size of each encode on its filesystem
+    ledger = SpaceLedger(
+        gib_to_bytes(CONFIG.buffer),
+        storage,
+        CONFIG.segment_encode_enabled,
+        CONFIG.segment_min_duration
+    )
+
+    # Copies the inputs of the next jobs in line to local disk
+    prefetch = PrefetchCache(
+        CONFIG.prefetch_cache_dir,
+        gib_to_bytes(CONFIG.prefetch_max_size),
+        CONFIG.prefetch_parallel,
+        gib_to_bytes(CONFIG.buffer)
+    ) if CONFIG.prefetch_enabled else None
+
+    # Synchronization Lock: Protects the 'data' dictionary from concurrent
+    # access
+    data_lock = threading.Lock()
+
+    stopping_flag = False
+
+    # Runs every frame count and encode in its own worker process, or as
+    # tasks on one asyncio event loop
+    if CONFIG.worker_backend == "asyncio":
+        supervisor = AsyncSupervisor(CONFIG.worker_restarts)
+    else:
+        supervisor = Supervisor(CONFIG.worker_restarts)
+
+    # Hands encodes to remote workers (worker.py)
+    coordinator = LeaseCoordinator(
+        CONFIG.cluster_bind,
+        CONFIG.cluster_port,
+        CONFIG.cluster_secret,
+        CONFIG.cluster_lease_timeout
+    ) if CONFIG.cluster_enabled else None
+
+    current_flags = []
+
+
+    def signal_handler(sig, frame):
+        nonlocal stopping_flag
+        # Use the lock when modifying a shared variable
         with data_lock:
-            stopping_flag = 'safe_stop_daemon' in current_flags
-            if 'quick_stop_daemon' in current_flags:
-                stopping_flag = True
-                current_jobs = []
-
-        if 'start_daemon' in current_flags:
-            remove_flag('start_daemon')
-
-        # == Load/Save Data ==
-        for item in os.listdir('.'):
-            if os.path.isfile(item) and re.fullmatch(r"input-\d+\.json", item):
-                inputdata = load_json(Path(item))
+            if stopping_flag:
+                print("\nForce Exiting...")
+                cleanup_subprocess()
+                os._exit(1)
+
+
+    signal.signal(signal.SIGINT, signal_handler)
+
+
+    @atexit.register
+    def cleanup_subprocess():
+        if supervisor.workers:
+            print("Terminating workers...")
+            supervisor.stop_all()
+        if coordinator:
+            coordinator.stop_all()
+            coordinator.close()
+        if prefetch:
+            prefetch.stop()
+
+
+    @atexit.register
+    def print_all_errors():
+        for uid, job in data.items():
+            if job.get("status") == 'error':
+                print(f'Job {uid} failed due to :')
+                print(f'  {job.get("error", "Unknown")}')
+
+
+    data = JobStore(JOBS_DB_PATH)
+    migrated_jobs = data.migrate_json(DATA_FILE_PATH)
+    if migrated_jobs:
+        print(f"Migrated {migrated_jobs} job(s) from {DATA_FILE_PATH}")
+
+
+    def reserve_encode(uid: str, remote: bool) -> bool:
+        '''
+        Plans an encode that is about to start and reserves its space.
+        The plan is only stored on the job once the space is reserved. Jobs
+        without space stay ready_to_encode and go back to their place in
+        line, without being charged for the turn, until enough is free.
+        '''
+        planned = dict(data[uid])
+        # Efficient inputs are remuxed, which also changes how much space
+        # they need
+        set_remux_decision(uid, planned, CONFIG.quality_presets, ledger.model)
+        # Files must be where a remote worker can see them
+        use_scratch(uid, planned, None if remote else CONFIG.scratch_dir)
+        if remote:
+            planned["cached_input"] = ""
+
+        if not ledger.reserve(uid, data, planned):
+            with data_lock:
+                scheduler.unpop(uid)
+            return False
+        with data[uid].lock:
+            for key in ("remux", "scratch_file", "cached_input"):
+                data[uid][key] = planned[key]
+        return True
+
+
+    # == REMOVE FLAGS ==
+    flags = ALL_FLAGS
+    print(f"Removing ALL flags: {ALL_FLAGS}")
+    for flag in flags:
+        remove_flag(flag)
+
+    print("Cleaning up job database")
+    jobs_to_delete = []
+    # Ensure safe access to shared data structure using the lock
+    with data_lock:
+        for uid, job in list(data.items()):
+            status = job.get("status")
 
-                with data_lock:
-                    nextuid = max((int(i) for i in data.keys()), default=0) + 1
-                    for newjob in inputdata:
-                        data[str(nextuid)] = newjob
-                        nextuid += 1
+            # 1. Remove finished jobs
+            if status in ["encoded", "copied"]:
+                jobs_to_delete.append(uid)
 
+            # 2. Reset jobs interrupted to 'not_started'
+            elif status == "getting_frames":
+                print(f"Resetting interrupted job {
+                      uid} ({job.get('name', 'N/A')}) to 'not_started'.")
+                job["status"] = "not_started"
+            elif status == "encoding":
+                print(f"Resetting interrupted job {
+                      uid} ({job.get('name', 'N/A')}) to 'ready_to_encode'.")
+                job["status"] = "ready_to_encode"
+                # Only the output is removed, finished segments are reused
+                if segment_dir(encode_path(job)).exists():
+                    print("  Finished segments will be reused.")
                 try:
-                    print(f"REMOVING {item}")
-                    os.remove(item)
+                    os.remove(encode_path(job))
                 except Exception as e:
-                    print(f'Failed to remove {item} due to {e}')
-
-        # -- Save Main Data --
-        with data_lock:
-            save_json(DATA_FILE_PATH, data)
-
-        # == Current Job Counts ==
-        currentencodejobs = 0
-        currentframecountjobs = 0
-        for currentjob in current_jobs:
-            if currentjob['type'] == 'encode':
-                currentencodejobs += 1
-            elif currentjob['type'] == 'framecount':
-                currentframecountjobs += 1
-
-        # == Look at current jobs (Cleanup) ==
-        jobs_to_remove = [
-            t for t in current_jobs
-            if t["type"] == "encode"
-            and not t["thread"].is_alive()
-        ]
-        for job in jobs_to_remove:
-            job_uid = job["uid"]
+                    print(f'Failed to remove due to error: {e}')
+                    pass
+            elif status == "verifying":
+                print(f"Resetting interrupted job {
+                      uid} ({job.get('name', 'N/A')}) to 'ready_to_verify'.")
+                job["status"] = "ready_to_verify"
+            elif status == "copying":
+                print(f"Resetting interrupted job {
+                      uid} ({job.get('name', 'N/A')}) to 'ready_to_copy'.")
+                job["status"] = "ready_to_copy"
+                partial_path(job['encoded_file']).unlink(missing_ok=True)
+
+            # 3. Keep jobs that are ready to encode (frame count is done)
+            elif status == "ready_to_encode":
+                print(
+                    f"Job {uid} is 'ready_to_encode' and will be prioritized.")
+            elif status == "ready_to_verify":
+                print(f"Job {uid} is encoded and will be verified.")
+            elif status == "ready_to_copy":
+                print(
+                    f"Job {uid} is encoded and will be copied to the library.")
+
+            # 4. Report error jobs
+            elif status == "error":
+                joberror = job.get('error', 'Unknown')
+                print(f"Job {uid} is in 'error' state. Error: {joberror}")
+                jobaction = input(
+                    'Reset/delete/ignore job? (R/d/i): ').strip().lower()
+                if jobaction in ['r', '']:
+                    # Failed copies are tried again, the encode is kept
+                    if (job['scratch_file'] and job['copy_start_time']
+                            and os.path.exists(job['scratch_file'])):
+                        job['status'] = 'ready_to_copy'
+                        job['error'] = ''
+                        partial_path(job['encoded_file']).unlink(
+                            missing_ok=True)
+                    elif job.get('frames', None):
+                        job['status'] = 'ready_to_encode'
+                        try:
+                            os.remove(encode_path(job))
+                        except Exception as e:
+                            print(f'Failed to remove due to error: {e}')
+                            pass
+                    else:
+                        job['status'] = 'not_started'
+                        job['error'] = ''
+                elif jobaction == 'd':
+                    jobs_to_delete.append(uid)
+                    remove_segments(encode_path(job))
+                elif jobaction != 'i':
+                    print('Unknown action. Ignoring.')
+
+        # Perform the deletion outside the iteration
+        for uid in jobs_to_delete:
+            del data[uid]
+            print(f"Removed completed job {uid}.")
+        # Copies left by the last run are kept if their job still needs them
+        if prefetch:
+            prefetch.load(data)
+        data.commit()
+
+    print("Data cleanup complete.")
+
+
+    # == Event watcher ==
+    # Wakes the loop when input/flag files change or a worker reports back.
+    watcher = Watcher(PROJECT_ROOT, ["input-*.json", "*.flag"])
+    if not watcher.uses_inotify:
+        print("inotify is not available, polling for input and flag files.")
+
+    # None means every flag and input file is checked (used on the first loop).
+    changed_files = None
+
+    try:
+        while (not stopping_flag or supervisor.workers
+               or (coordinator and coordinator.leases)):
+            # == Flag handling ==
+            if changed_files is None or any(
+                    f.endswith(".flag") for f in changed_files):
+                # -- Print new flags --
+                new_current_flags = get_active_flags()
+
+                new_flags = set(new_current_flags) - set(current_flags)
+                removed_flags = set(current_flags) - set(new_current_flags)
+
+                if new_flags:
+                    print("Flag(s) enabled:", new_flags)
+                if removed_flags:
+                    print("Flags(s) disabled:", removed_flags)
+
+                current_flags = new_current_flags
+
+            # -- Act on flags --
             with data_lock:
-                cur_status = data[job_uid]["status"]
-                if cur_status.lower() != "error":
-                    data[job_uid]["status"] = "encoded"
-            current_jobs.remove(job)
-
-        # == Create Jobs ==
-        with data_lock:
-            can_create_new_jobs = not stopping_flag
-
-        if can_create_new_jobs:
-            free_frame_count_jobs = max(
-                0, maxframecountjobs - currentframecountjobs)
-            available_frame_count_job_uids = jc.get_frame_count_jobs(
-                data, data_lock, free_frame_count_jobs)
-            for fc_job_uid in available_frame_count_job_uids:
-                jc.create_frame_count_job(
-                    fc_job_uid, data, data_lock, current_jobs
+                stopping_flag = 'safe_stop_daemon' in current_flags
+                if 'quick_stop_daemon' in current_flags:
+                    stopping_flag = True
+                    supervisor.stop_all()
+                    if coordinator:
+                        coordinator.stop_all()
+
+            if 'start_daemon' in current_flags:
+                remove_flag('start_daemon')
+
+            # == Load Data ==
+            if changed_files is None or any(
+                    f.startswith("input-") for f in changed_files):
+                for item in os.listdir('.'):
+                    if (os.path.isfile(item)
+                            and re.fullmatch(r"input-\d+\.json", item)):
+                        inputdata = load_json(Path(item))
+
+                        with data_lock:
+                            for newjob in inputdata:
+                                newjob.setdefault("priority", 0)
+                                newjob["queued_time"] = int(time.time())
+                                data.add(newjob)
+
+                        try:
+                            print(f"REMOVING {item}")
+                            os.remove(item)
+                        except Exception as e:
+                            print(f'Failed to remove {item} due to {e}')
+
+            # == Look at current jobs (Apply updates and cleanup) ==
+            # Updates only touch single jobs so they use each job's own lock.
+            finished_jobs = supervisor.poll(data)
+            if coordinator:
+                finished_jobs += coordinator.poll(data)
+            for job_type, job_uid in finished_jobs:
+                if job_type == "verify":
+                    # Only encodes that passed feed the forecasts of plan.py
+                    # and the ledger
+                    with data[job_uid].lock:
+                        passed = data[job_uid]["status"] != "error"
+                        recorded = passed and record_encode(data[job_uid])
+                    if recorded:
+                        ledger.refresh()
+                if job_type != "encode":
+                    continue
+                with data[job_uid].lock:
+                    cur_status = data[job_uid]["status"]
+                    if cur_status.lower() != "error":
+                        # Encodes are checked before they go into the library,
+                        # encodes in the scratch folder still need copying
+                        data[job_uid]["status"] = (
+                            "ready_to_verify" if CONFIG.verify_enabled
+                            else next_status(data[job_uid]))
+                        data[job_uid]["encode_end_time"] = int(time.time())
+                        try:
+                            data[job_uid]["after_size"] = os.path.getsize(
+                                encode_path(data[job_uid]))
+                        except OSError as e:
+                            print('Failed to get output size due to '
+                                  f'error: {e}')
+                        # The encode counted every frame, replace the estimate
+                        if data[job_uid]["frames_estimated"]:
+                            data[job_uid]["frames"] = data[job_uid][
+                                "current_frame"]
+                            data[job_uid]["frames_estimated"] = False
+                        # Recorded once verified, if encodes are verified
+                        if (not CONFIG.verify_enabled
+                                and record_encode(data[job_uid])):
+                            ledger.refresh()
+
+            # Encodes that stopped no longer need their reserved space
+            ledger.sync(data)
+            storage.refresh()
+
+            # == Current Job Counts ==
+            currentencodejobs = supervisor.count("encode")
+            currentframecountjobs = supervisor.count("framecount")
+            currentcopyjobs = supervisor.count("copy")
+            currentverifyjobs = supervisor.count("verify")
+
+            # == Autotune encode concurrency ==
+            if autotuner:
+                encode_uids = supervisor.uids("encode")
+                # Progress counters are read without locking
+                autotuner.sample(data, encode_uids)
+                # Follow the preset that is running, start with one job
+                maxencodejobs = autotuner.level_for(
+                    data[encode_uids[0]]["quality"]) if encode_uids else 1
+
+            # == Create Jobs ==
+            with data_lock:
+                can_create_new_jobs = not stopping_flag
+
+            if can_create_new_jobs:
+                free_frame_count_jobs = max(
+                    0, maxframecountjobs - currentframecountjobs)
+                available_frame_count_job_uids = jc.get_frame_count_jobs(
+                    data, data_lock, free_frame_count_jobs)
+                for fc_job_uid in available_frame_count_job_uids:
+                    jc.create_frame_count_job(
+                        fc_job_uid, data, data_lock, supervisor
+                    )
+
+                free_encode_jobs = max(
+                    0, maxencodejobs - currentencodejobs)
+                available_encode_job_uids = jc.get_encode_jobs(
+                    data, data_lock, free_encode_jobs, scheduler
                 )
+                for encode_job_uid in available_encode_job_uids:
+                    if reserve_encode(encode_job_uid, remote=False):
+                        jc.create_encode_job(
+                            encode_job_uid, data, data_lock, supervisor
+                        )
+
+                # Remote workers waiting for a job get the next ones in line
+                if coordinator:
+                    for encode_job_uid in jc.get_encode_jobs(
+                            data, data_lock, coordinator.waiting(), scheduler):
+                        if reserve_encode(encode_job_uid, remote=True):
+                            jc.create_encode_job(
+                                encode_job_uid, data, data_lock, coordinator
+                            )
+
+                # Finished encodes are checked for truncation and corruption
+                free_verify_jobs = max(
+                    0, CONFIG.max_verify_jobs - currentverifyjobs)
+                for verify_job_uid in jc.get_verify_jobs(
+                        data, data_lock, free_verify_jobs):
+                    jc.create_verify_job(
+                        verify_job_uid, data, data_lock, supervisor
+                    )
+
+                # Encodes finished in the scratch folder are moved to the
+                # library, also waiting for space there
+                free_copy_jobs = max(0, CONFIG.max_copy_jobs - currentcopyjobs)
+                for copy_job_uid in jc.get_copy_jobs(
+                        data, data_lock, free_copy_jobs):
+                    if ledger.reserve(copy_job_uid, data):
+                        jc.create_copy_job(
+                            copy_job_uid, data, data_lock, supervisor
+                        )
+
+            # Inputs of the next jobs in line are copied while encodes run,
+            # copies of encoded jobs are removed
+            if prefetch:
+                with data_lock:
+                    scheduler.sync(data)
+                    prefetch.update(
+                        data, scheduler.peek(data, CONFIG.prefetch_jobs))
 
-            free_encode_jobs = max(
-                0, maxencodejobs - currentencodejobs)
-            available_encode_job_uids = jc.get_encode_jobs(
-                data, data_lock, free_encode_jobs
+            # == Save Data (only changed jobs are written) ==
+            with data_lock:
+                data.commit()
+
+            # == Wait for something to happen ==
+            # Workers wake the loop when they send updates or exit. While
+            # encodes run the loop also wakes up regularly for autotuning and
+            # to expire remote leases.
+            encoding = supervisor.count("encode") > 0 or (
+                coordinator and coordinator.leases)
+            changed_files = watcher.wait(
+                WAKE_INTERVAL if encoding else IDLE_INTERVAL,
+                supervisor.fds() + (coordinator.fds() if coordinator else [])
             )
-            for encode_job_uid in available_encode_job_uids:
-                jc.create_encode_job(
-                    encode_job_uid, data, data_lock, current_jobs
-                )
 
-        time.sleep(0.5)
+        # On Closing
+        print("Graceful stop complete. All jobs finished. Exiting...")
+        with data_lock:
+            data.close()
+        watcher.close()
+
 
-    # On Closing
-    print("Graceful stop complete. All jobs finished. Exiting...")
-    save_json(DATA_FILE_PATH, data)
+    except Exception as e:
+        # Catch any unexpected exceptions
+        print(f"\nAn unexpected error occurred: {e}")
 
 
-except Exception as e:
-    # Catch any unexpected exceptions
-    print(f"\nAn unexpected error occurred: {e}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+'''
+An asyncio alternative to the worker processes in supervisor.py.
+Every job runs the same steps as a worker process would (see
+supervisor.JOB_STEPS and processes.py), as a task on one event loop, so jobs
+do not need their own Python process. ffprobe and ffmpeg are started with
+asyncio.create_subprocess_exec and their output is read by tasks on the same
+loop, so a running encode does not need a thread. Copies are done in Python
+and run in a thread pool of their stage.
+Cancelling a job cancels its task, which stops its processes.
+AsyncSupervisor has the same interface as Supervisor so the daemon can use
+either.
+'''
+
+import asyncio
+import os
+import queue
+import subprocess
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from .priority import apply_priority, child_setup
+from .processes import Blocking, Parallel, Run, Stream
+from .supervisor import (
+    Supervisor, ReportingJob, JOB_STEPS, CANCEL_TIMEOUT
+)
+
+# Blocking steps run in a pool per stage, the stage's priority is applied to
+# each of its threads once
+_executors: dict[str, ThreadPoolExecutor] = {}
+
+
+def _executor(stage: str) -> ThreadPoolExecutor:
+    if stage not in _executors:
+        _executors[stage] = ThreadPoolExecutor(
+            thread_name_prefix=stage,
+            initializer=apply_priority,
+            initargs=(stage,)
+        )
+    return _executors[stage]
+
+
+async def _start(command: list, stage: str) -> asyncio.subprocess.Process:
+    return await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        preexec_fn=child_setup(stage)
+    )
+
+
+async def stop_process(process: asyncio.subprocess.Process):
+    '''
+    Stops a process, it is killed if it does not exit in CANCEL_TIMEOUT.
+    '''
+    if process.returncode is not None:
+        return
+    try:
+        process.terminate()
+        await asyncio.wait_for(process.wait(), CANCEL_TIMEOUT)
+    except ProcessLookupError:
+        pass
+    except TimeoutError:
+        process.kill()
+        await process.wait()
+
+
+async def run(request: Run) -> subprocess.CompletedProcess:
+    '''
+    Runs a Run request, see processes.run.
+    '''
+    process = await _start(request.command, request.stage)
+    try:
+        stdout, stderr = await asyncio.wait_for(
+            process.communicate(), request.timeout)
+    except TimeoutError:
+        await stop_process(process)
+        raise subprocess.TimeoutExpired(request.command, request.timeout)
+    except BaseException:
+        await stop_process(process)
+        raise
+    stdout = stdout.decode(errors="replace")
+    stderr = stderr.decode(errors="replace")
+    if request.check and process.returncode != 0:
+        raise subprocess.CalledProcessError(
+            process.returncode, request.command, stdout, stderr)
+    return subprocess.CompletedProcess(
+        request.command, process.returncode, stdout, stderr)
+
+
+async def stream(request: Stream) -> int:
+    '''
+    Runs a Stream request, see processes.stream. stdout and stderr are read
+    by a task each.
+    '''
+    process = await _start(request.command, request.stage)
+
+    async def read_stdout():
+        while True:
+            try:
+                line = await asyncio.wait_for(
+                    process.stdout.readline(), request.stall_timeout)
+            except TimeoutError:
+                raise TimeoutError(
+                    f"ffmpeg made no progress for "
+                    f"{request.stall_timeout}s") from None
+            if not line:
+                return
+            request.on_line(line.decode(errors="replace"))
+
+    async def read_stderr():
+        async for line in process.stderr:
+            line = line.decode(errors="replace").strip()
+            if line:
+                request.warnings.append(line)
+
+    readers = [
+        asyncio.create_task(read_stdout()),
+        asyncio.create_task(read_stderr()),
+    ]
+    try:
+        await asyncio.gather(*readers)
+        return await process.wait()
+    except BaseException:
+        for reader in readers:
+            reader.cancel()
+        await stop_process(process)
+        raise
+
+
+async def parallel(request: Parallel) -> list:
+    '''
+    Runs a Parallel request with a task per running generator. If one
+    fails the others are cancelled.
+    '''
+    steps = iter(request.steps)
+    results = []
+
+    async def lane():
+        for job in steps:
+            results.append(await drive(job))
+
+    lanes = [
+        asyncio.create_task(lane()) for _ in range(max(1, request.limit))
+    ]
+    try:
+        await asyncio.gather(*lanes)
+    except BaseException:
+        for other in lanes:
+            other.cancel()
+        await asyncio.gather(*lanes, return_exceptions=True)
+        raise
+    return results
+
+
+async def blocking(request: Blocking):
+    '''
+    Runs a Blocking request in the thread pool of its stage. A cancelled
+    job waits for the function to notice.
+    '''
+    cancelled = threading.Event()
+    future = asyncio.get_running_loop().run_in_executor(
+        _executor(request.stage), request.function, cancelled)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancelled.set()
+        await asyncio.gather(future, return_exceptions=True)
+        raise
+
+
+async def handle(request):
+    '''
+    Runs one request of a job and returns its result.
+    '''
+    if isinstance(request, Run):
+        return await run(request)
+    if isinstance(request, Stream):
+        return await stream(request)
+    if isinstance(request, Parallel):
+        return await parallel(request)
+    if isinstance(request, Blocking):
+        return await blocking(request)
+    raise TypeError(f"Unknown step {request!r}")
+
+
+async def drive(steps):
+    '''
+    Runs the steps of a job and returns what the job returns, see
+    processes.drive. A cancelled job is closed, so its cleanup runs.
+    '''
+    result, error = None, None
+    try:
+        while True:
+            try:
+                if error is not None:
+                    request = steps.throw(error)
+                else:
+                    request = steps.send(result)
+            except StopIteration as done:
+                return done.value
+            try:
+                result, error = await handle(request), None
+            except Exception as e:
+                result, error = None, e
+    finally:
+        steps.close()
+
+
+class _QueueConnection:
+    '''
+    Lets a ReportingJob send its changes to the AsyncSupervisor's queue.
+    '''
+
+    def __init__(self, supervisor, worker):
+        self._supervisor = supervisor
+        self._worker = worker
+
+    def send(self, message: tuple):
+        # A cancelled job is left as it was, like a killed worker process
+        if self._worker.cancelled:
+            return
+        self._supervisor.messages.put((self._worker.uid, *message))
+        self._supervisor.wake()
+
+
+class AsyncWorker:
+    '''
+    A job running as a task on the AsyncSupervisor's event loop.
+    '''
+
+    def __init__(self, supervisor, kind: str, uid: str, job: dict):
+        self.supervisor = supervisor
+        self.kind = kind
+        self.uid = uid
+        self.done = False
+        self.crash = None
+        self.cancelled = False
+        self.updates = []
+        self.finished = threading.Event()
+        self.task = None
+
+        self.job = ReportingJob(job, _QueueConnection(supervisor, self))
+        supervisor.loop.call_soon_threadsafe(self._create_task)
+
+    def _create_task(self):
+        self.task = self.supervisor.loop.create_task(self._run())
+
+    async def _run(self):
+        try:
+            await drive(JOB_STEPS[self.kind](
+                self.uid, {self.uid: self.job}, threading.Lock()))
+            self.job.flush()
+            self.done = True
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            self.job.flush()
+            self.crash = traceback.format_exc()
+        finally:
+            self.finished.set()
+            self.supervisor.wake()
+
+    def _cancel_task(self):
+        if self.task:
+            self.task.cancel()
+
+    def running(self) -> bool:
+        return not self.finished.is_set()
+
+    def receive(self) -> list:
+        self.supervisor.drain()
+        updates, self.updates = self.updates, []
+        return updates
+
+    def fds(self) -> list:
+        return []
+
+    def close(self):
+        pass
+
+    def succeeded(self) -> bool:
+        return self.done
+
+    def failure_reason(self) -> str:
+        return self.crash or "Task stopped"
+
+    def cancel(self, timeout: float):
+        self.cancelled = True
+        self.supervisor.loop.call_soon_threadsafe(self._cancel_task)
+        if not self.finished.wait(timeout + CANCEL_TIMEOUT):
+            print(f"Task for UID {self.uid} did not stop in time.")
+
+
+class AsyncSupervisor(Supervisor):
+    '''
+    Runs every job as an asyncio task on one event loop.
+    '''
+
+    def __init__(self, max_restarts: int = 1):
+        super().__init__(max_restarts)
+        self.messages = queue.SimpleQueue()
+
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(
+            target=self.loop.run_forever, daemon=True).start()
+
+    def start(self, kind: str, uid: str, job: dict):
+        self.workers[uid] = AsyncWorker(self, kind, uid, job)
+
+    def wake(self):
+        '''
+        Makes fds() readable so the daemon loop wakes up.
+        '''
+        try:
+            os.write(self._wake_w, b"\0")
+        except BlockingIOError:
+            pass
+
+    def fds(self) -> list:
+        return [self._wake_r]
+
+    def drain(self):
+        '''
+        Hands every queued update to the worker it belongs to.
+        '''
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        while True:
+            try:
+                uid, message, payload = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            worker = self.workers.get(uid)
+            if worker and message == "update":
+                worker.updates.append(payload)
@@ -0,0 +1,80 @@
+"""
+Decides how each audio stream that is kept is written.
+Streams that already meet the preset are copied: a codec Plex plays directly
+(audio_copy in the preset, AAC, AC3 and E-AC3 by default) at or below the
+preset's bitrate. Only the others are re-encoded to AAC, which saves CPU time
+and a generation of quality loss. The decision is stored on the job
+(audio_streams).
+"""
+
+COPY_CODECS = ["aac", "ac3", "eac3"]
+
+
+def parse_bitrate(bitrate) -> int | None:
+    """
+    Returns a bitrate such as "160k" in bit/s, or None if it is not one.
+    """
+    bitrate = str(bitrate).strip().lower()
+    scale = 1000 if bitrate.endswith("k") else 1
+    try:
+        return int(float(bitrate.rstrip("k")) * scale)
+    except ValueError:
+        return None
+
+
+def kept_streams(streams: list) -> list:
+    """
+    Returns the streams compressor.get_stream_map keeps, in output order.
+    English streams if there are any, otherwise the first stream.
+    """
+    english = [stream for stream in streams if stream["language"] == "eng"]
+    return english or streams[:1]
+
+
+def audio_plan(info: dict, quality: dict) -> list:
+    """
+    Returns what happens to every kept audio stream, "copy" or "aac".
+    Streams without a known bitrate are re-encoded, they could be far above
+    the target.
+    """
+    target = parse_bitrate(quality.get("bitrate", ""))
+    codecs = quality.get("audio_copy", COPY_CODECS)
+    plan = []
+    for stream in kept_streams(info["audio"]):
+        bit_rate = stream.get("bit_rate")
+        copy = (target is not None and stream["codec"] in codecs
+                and bit_rate is not None and bit_rate <= target)
+        plan.append({
+            "index": stream["index"],
+            "codec": stream["codec"],
+            "bit_rate": bit_rate,
+            "action": "copy" if copy else "aac",
+        })
+    return plan
+
+
+def audio_args(plan: list | None, bitrate: str) -> list:
+    """
+    Returns the audio codec arguments of an ffmpeg command.
+    Without a plan every audio stream is encoded to AAC.
+    """
+    if plan is None:
+        return ["-c:a", "aac", "-b:a", bitrate]
+    args = []
+    for no, stream in enumerate(plan):
+        if stream["action"] == "copy":
+            args.extend([f"-c:a:{no}", "copy"])
+        else:
+            args.extend([f"-c:a:{no}", "aac", f"-b:a:{no}", bitrate])
+    return args
+
+
+def describe_plan(plan: list) -> str:
+    """
+    One line about the plan, for example "eac3 (copy), dts -> aac".
+    """
+    return ", ".join(
+        f"{stream['codec']} (copy)" if stream["action"] == "copy"
+        else f"{stream['codec']} -> aac"
+        for stream in plan
+    ) or "no audio"
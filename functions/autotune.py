@@ -0,0 +1,118 @@
+'''
+Finds the number of concurrent encodes that gives the highest combined fps
+for each quality preset.
+While a preset is being tuned, the daemon runs 1, 2, 3... encodes at once and
+measures the combined frames per second from ffmpeg's progress over a window.
+It stops adding encodes once throughput stops improving and remembers the
+best level in autotune.json so it is not relearnt after a restart.
+'''
+
+import os
+import time
+
+from .file_handler import load_json, save_json
+
+
+class Autotuner:
+    '''
+    Measures encode throughput and picks the concurrency for each preset.
+    '''
+
+    def __init__(self, path, max_level: int = 4, window: float = 300):
+        self.path = path
+        self.max_level = max(1, max_level)
+        self.window = window
+        self.state: dict = load_json(path)
+
+        # Measurement of the level currently being tried
+        self._preset = None
+        self._level = None
+        self._frames = 0
+        self._seconds = 0.0
+        self._last_frames: dict[str, int] = {}
+        self._last_time = None
+
+    def _preset_state(self, preset: str) -> dict:
+        preset_state = self.state.setdefault(preset, {})
+        # Results from a machine with a different core count are relearnt
+        if preset_state.get("cpu_count") != os.cpu_count():
+            preset_state.clear()
+            preset_state["cpu_count"] = os.cpu_count()
+            preset_state["fps"] = {}
+            preset_state["best"] = None
+        return preset_state
+
+    def level_for(self, preset: str) -> int:
+        '''
+        Returns how many encodes should run at once for a preset.
+        '''
+        preset_state = self._preset_state(preset)
+        if preset_state["best"]:
+            return preset_state["best"]
+        return len(preset_state["fps"]) + 1
+
+    def _reset_measurement(self):
+        self._preset = None
+        self._level = None
+        self._frames = 0
+        self._seconds = 0.0
+
+    def sample(self, data, encode_uids: list):
+        '''
+        Called regularly by the daemon with the uids that are encoding.
+        Only counts time when every running encode uses the same preset that
+        is being tuned and exactly the level being tried is running.
+        '''
+        now = time.monotonic()
+        elapsed = now - self._last_time if self._last_time else 0
+        self._last_time = now
+
+        frames = {}
+        for uid in encode_uids:
+            frames[uid] = data[uid].get("current_frame", 0) or 0
+        new_frames = sum(
+            max(0, frames[uid] - self._last_frames[uid])
+            for uid in frames if uid in self._last_frames
+        )
+        self._last_frames = frames
+
+        presets = {data[uid].get("quality") for uid in encode_uids}
+        if len(presets) != 1:
+            self._reset_measurement()
+            return
+        preset = presets.pop()
+
+        preset_state = self._preset_state(preset)
+        level = len(encode_uids)
+        if preset_state["best"] or level != self.level_for(preset):
+            self._reset_measurement()
+            return
+
+        if (preset, level) != (self._preset, self._level):
+            # A new measurement starts, frames from before do not count
+            self._reset_measurement()
+            self._preset, self._level = preset, level
+            return
+
+        self._frames += new_frames
+        self._seconds += elapsed
+        if self._seconds >= self.window:
+            self._finish_level(preset_state)
+
+    def _finish_level(self, preset_state: dict):
+        fps = self._frames / self._seconds
+        preset_state["fps"][str(self._level)] = round(fps, 2)
+        print(f"Autotune: {self._preset} at {self._level} "
+              f"concurrent encode(s) = {fps:.1f} fps")
+
+        levels = {int(k): v for k, v in preset_state["fps"].items()}
+        previous = levels.get(self._level - 1)
+        if (self._level >= self.max_level
+                or (previous is not None and fps <= previous)):
+            best = max(levels, key=levels.get)
+            preset_state["best"] = best
+            print(f"Autotune: {self._preset} will use {best} "
+                  "concurrent encode(s)")
+
+        self._reset_measurement()
+        save_json(self.path, self.state)
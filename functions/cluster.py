@@ -0,0 +1,282 @@
+'''
+Lets other machines encode jobs for this daemon.
+The daemon runs a LeaseCoordinator, a small TCP server. Remote workers
+(worker.py) ask it for work and are handed a ready_to_encode job together
+with a lease. While encoding they send heartbeats with their progress and
+finally the result. A lease that gets no heartbeat for lease_timeout seconds
+expires and its job is queued again.
+Every message is one line of JSON and every request uses its own connection.
+Input and output paths are sent as they are, so every machine must see the
+media at the same paths (a shared filesystem).
+Every request carries the shared secret (CLUSTER_SECRET in .env), and only
+progress and the result are taken from a worker (WORKER_FIELDS), never paths.
+'''
+
+import collections
+import hmac
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+import uuid
+
+from .copier import encode_path
+
+# Longest a lease request is held open waiting for a job (seconds)
+MAX_LEASE_WAIT = 30
+
+# How long a client waits for a reply on top of the lease wait (seconds)
+REQUEST_TIMEOUT = 10
+
+# The job fields a worker may change and the values they may have
+WORKER_FIELDS = {
+    "current_frame": lambda value: type(value) is int and value >= 0,
+    "progress": lambda value: value is None or type(value) is dict,
+    "status": lambda value: value in ("encoding", "error"),
+    "error": lambda value: type(value) is str,
+    "audio_streams": lambda value: type(value) is list,
+    "resumed": lambda value: type(value) is bool,
+}
+
+
+def accepted_changes(changes: dict) -> dict:
+    '''
+    Returns the changes a worker sent that it is allowed to make.
+    '''
+    return {
+        key: value for key, value in changes.items()
+        if key in WORKER_FIELDS and WORKER_FIELDS[key](value)
+    }
+
+
+def send_request(host: str, port: int, message: dict) -> dict:
+    '''
+    Sends one message to a coordinator and returns its reply.
+    Raises OSError if the coordinator can not be reached.
+    '''
+    timeout = REQUEST_TIMEOUT + message.get("wait", 0)
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.sendall(json.dumps(message).encode() + b"\n")
+        with sock.makefile("rb") as reply:
+            line = reply.readline()
+    if not line:
+        raise ConnectionError("Coordinator closed the connection")
+    return json.loads(line)
+
+
+class Lease:
+    '''
+    A job handed out (or about to be handed out) to a remote worker.
+    '''
+
+    def __init__(self, uid: str, job: dict):
+        self.uid = uid
+        self.job = job
+        self.id = uuid.uuid4().hex
+        self.worker = None
+        self.last_seen = time.monotonic()
+        self.updates = []
+        self.finished = False
+        self.released = False
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline())
+            if not hmac.compare_digest(
+                    str(message.get("secret", "")).encode(),
+                    self.server.coordinator.secret.encode()):
+                raise PermissionError("Wrong cluster secret")
+            reply = self.server.coordinator.handle(message)
+        except PermissionError as e:
+            print(f"Refused a request from {self.client_address[0]}: {e}")
+            reply = {"ok": False, "error": str(e)}
+        except (ValueError, KeyError, TypeError) as e:
+            reply = {"ok": False, "error": f"Bad request: {e}"}
+        self.wfile.write(json.dumps(reply, default=str).encode() + b"\n")
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class LeaseCoordinator:
+    '''
+    Hands ready_to_encode jobs to remote workers.
+    The server threads only queue what workers send. The daemon applies it
+    with poll(data) from its main loop, the same way as Supervisor.
+    '''
+
+    def __init__(self, host: str, port: int, secret: str,
+                 lease_timeout: float = 60):
+        if not secret:
+            raise ValueError("The cluster needs a secret (CLUSTER_SECRET)")
+        self.secret = secret
+        self.lease_timeout = lease_timeout
+        self.leases: dict[str, Lease] = {}
+        self._offers = collections.deque()
+        self._waiting = 0
+        self._cond = threading.Condition()
+
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+
+        self._server = _Server((host, port), _RequestHandler)
+        self._server.coordinator = self
+        threading.Thread(
+            target=self._server.serve_forever, daemon=True).start()
+
+    # == Server side (runs in the server's threads) ==
+    def handle(self, message: dict) -> dict:
+        op = message["op"]
+        if op == "lease":
+            return self._lease(
+                message["worker"],
+                min(float(message.get("wait", 0)), MAX_LEASE_WAIT)
+            )
+        if op in ("heartbeat", "finish", "release"):
+            return self._report(op, message)
+        return {"ok": False, "error": f"Unknown op {op}"}
+
+    def _lease(self, worker: str, wait: float) -> dict:
+        with self._cond:
+            self._waiting += 1
+            self._wake()
+            self._cond.wait_for(lambda: self._offers, wait)
+            self._waiting -= 1
+            if not self._offers:
+                return {"ok": True, "uid": None}
+
+            lease = self.leases[self._offers.popleft()]
+            lease.worker = worker
+            lease.last_seen = time.monotonic()
+        print(f"Leased UID {lease.uid} to {worker}")
+        return {
+            "ok": True,
+            "uid": lease.uid,
+            "lease": lease.id,
+            "job": lease.job,
+            "heartbeat": self.lease_timeout / 3
+        }
+
+    def _report(self, op: str, message: dict) -> dict:
+        with self._cond:
+            lease = self.leases.get(message["uid"])
+            if lease is None or lease.id != message["lease"]:
+                # Expired, revoked or leased again to someone else
+                return {"ok": False}
+            lease.last_seen = time.monotonic()
+            changes = accepted_changes(message.get("changes") or {})
+            if changes:
+                lease.updates.append(changes)
+            lease.finished = op == "finish"
+            lease.released = op == "release"
+        self._wake()
+        return {"ok": True}
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b"\0")
+        except BlockingIOError:
+            pass
+
+    # == Daemon side (main thread) ==
+    def waiting(self) -> int:
+        '''
+        Returns how many workers are waiting for a job that has not been
+        offered yet.
+        '''
+        with self._cond:
+            return max(0, self._waiting - len(self._offers))
+
+    def start(self, kind: str, uid: str, job: dict):
+        '''
+        Offers a job to the next worker that asks for one.
+        Has the same signature as Supervisor.start, only encodes are leased.
+        '''
+        with self._cond:
+            self.leases[uid] = Lease(uid, job)
+            self._offers.append(uid)
+            self._cond.notify()
+
+    def fds(self) -> list:
+        '''
+        Becomes readable when a worker asks for a job or reports back.
+        '''
+        return [self._wake_r]
+
+    def poll(self, data) -> list:
+        '''
+        Applies everything workers sent and expires dead leases.
+        Returns a list of ("encode", uid) for leases that finished.
+        Expired and released jobs are queued again.
+        '''
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        finished = []
+        now = time.monotonic()
+        with self._cond:
+            for uid, lease in list(self.leases.items()):
+                updates, lease.updates = lease.updates, []
+                if uid not in data:
+                    self._drop(uid)
+                    continue
+                for changes in updates:
+                    with data[uid].lock:
+                        data[uid].update(changes)
+
+                if lease.finished:
+                    self._drop(uid)
+                    finished.append(("encode", uid))
+                elif lease.released:
+                    print(f"{lease.worker} released UID {uid}")
+                    self._drop(uid)
+                    self._requeue(data[uid])
+                elif now - lease.last_seen > self.lease_timeout:
+                    print(f"Lease for UID {uid} on "
+                          f"{lease.worker or 'no worker'} expired")
+                    self._drop(uid)
+                    self._requeue(data[uid])
+        return finished
+
+    def _drop(self, uid: str):
+        self.leases.pop(uid, None)
+        if uid in self._offers:
+            self._offers.remove(uid)
+
+    def _requeue(self, job):
+        # The path comes from the daemon's own copy of the job
+        try:
+            os.remove(encode_path(job))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f'Failed to remove due to error: {e}')
+        with job.lock:
+            job["status"] = "ready_to_encode"
+            job["current_frame"] = 0
+
+    def stop_all(self):
+        '''
+        Revokes every lease. Workers stop their encode on their next
+        heartbeat. Jobs are left as they are so they can be reset on the
+        next start.
+        '''
+        with self._cond:
+            self.leases.clear()
+            self._offers.clear()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        for fd in (self._wake_r, self._wake_w):
+            os.close(fd)
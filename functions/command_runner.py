@@ -1,10 +1,18 @@
+import collections
 import subprocess
 import signal
 import shlex
 import os
-import re
+import time
 from typing import Union, List
 
+from .audio import audio_args
+from .copier import encode_path
+from .encoders import video_args
+from .eta import smooth_progress
+from .prefetch import input_path
+from .processes import Stream
+
 
 def run_terminal_command(command: Union[str, List[str]]) -> str:
     """
@@ -83,79 +91,220 @@ def run_terminal_command(command: Union[str, List[str]]) -> str:
         return f"Error: Unexpected error during command execution: {e}"
 
 
+# How often progress is published per job (seconds)
+PROGRESS_INTERVAL = 0.5
+
+# How many warning/error lines from ffmpeg are kept per job
+WARNING_LINES = 20
+
+# An encode is stopped if ffmpeg reports no progress for this long (seconds)
+STALL_TIMEOUT = 600
+
+
+def build_ffmpeg_command(
+    input_file: str,
+    encoded_file: str,
+    quality: dict,
+    audio_map: str,
+    subtitle_map: str,
+    remux: bool = False,
+    audio_plan: list = None
+) -> list:
+    """
+    Returns the ffmpeg command used to encode a file.
+    With remux the streams are copied as they are instead.
+    audio_plan says which audio streams are copied (see audio.py).
+    Progress is written to stdout, warnings and errors to stderr.
+    """
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel", "warning",
+        "-nostats",
+        "-progress", "pipe:1",
+        "-i", input_file,
+        "-map", "0:v:0",
+    ]
+
+    if audio_map:
+        cmd.extend(audio_map.split())
+
+    if subtitle_map:
+        cmd.extend(subtitle_map.split())
+
+    if remux:
+        cmd.extend(["-c", "copy"])
+    else:
+        cmd.extend(video_args(quality))
+        cmd.extend(audio_args(audio_plan, quality['bitrate']))
+        cmd.extend(["-c:s", "copy"])
+    cmd.extend([
+        "-err_detect", "aggressive",
+        "-fflags", "+genpts+discardcorrupt",
+        f"{encoded_file}"
+    ])
+    return cmd
+
+
+def _progress_number(value: str, number_type=float, suffix: str = ""):
+    value = value.strip().removesuffix(suffix)
+    try:
+        return number_type(value)
+    except ValueError:
+        return None  # "N/A"
+
+
+def parse_progress_block(block: dict) -> dict:
+    """
+    Converts one block of ffmpeg's -progress output to numbers.
+    bitrate is in kbit/s, total_size in bytes and speed is a multiple of
+    real time. Values ffmpeg does not know yet are None.
+    """
+    return {
+        "frame": _progress_number(block.get("frame", ""), int),
+        "fps": _progress_number(block.get("fps", "")),
+        "bitrate": _progress_number(
+            block.get("bitrate", ""), suffix="kbits/s"),
+        "total_size": _progress_number(block.get("total_size", ""), int),
+        "out_time_us": _progress_number(block.get("out_time_us", ""), int),
+        "speed": _progress_number(block.get("speed", ""), suffix="x"),
+    }
+
+
+class ProgressParser:
+    """
+    Reads ffmpeg's -progress output line by line.
+    ffmpeg writes a block of key=value lines ending with progress=continue
+    (or progress=end). feed() returns the parsed block at most once every
+    interval seconds, and always for the last block.
+    """
+
+    def __init__(self, interval: float = PROGRESS_INTERVAL):
+        self.interval = interval
+        self.latest = None
+        self._block = {}
+        self._last_publish = 0.0
+
+    def feed(self, line: str) -> dict | None:
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            return None
+        if key != "progress":
+            self._block[key] = value
+            return None
+
+        self.latest = parse_progress_block(self._block)
+        self._block = {}
+        now = time.monotonic()
+        if value == "end" or now - self._last_publish >= self.interval:
+            self._last_publish = now
+            return self.latest
+        return None
+
+
+def apply_progress(job, progress: dict):
+    """
+    Stores a parsed progress block on a job.
+    """
+    if progress["frame"] is not None:
+        job["current_frame"] = progress["frame"]
+    job["progress"] = smooth_progress(job, {
+        key: value for key, value in progress.items() if key != "frame"
+    })
+
+
+def combine_progress(blocks: list) -> dict:
+    """
+    Adds up the progress of several ffmpeg processes working on one job.
+    out_time_us is None unless every block has it.
+    """
+    combined = {}
+    for key in ("frame", "fps", "total_size", "out_time_us", "speed"):
+        values = [block[key] for block in blocks if block[key] is not None]
+        combined[key] = sum(values) if values else None
+    if any(block["out_time_us"] is None for block in blocks):
+        combined["out_time_us"] = None
+    combined["bitrate"] = None
+    return combined
+
+
+def progress_steps(command: list, on_progress, warnings: collections.deque,
+                   timeout: float = STALL_TIMEOUT):
+    """
+    Steps that run an ffmpeg encode and call on_progress with its progress
+    (at most every PROGRESS_INTERVAL) until it exits. The last lines ffmpeg
+    writes to stderr are kept in warnings.
+    Returns ffmpeg's return code and the parser, which holds the last
+    progress. Raises TimeoutError if it reports nothing for timeout seconds.
+    """
+    parser = ProgressParser()
+
+    def on_line(line: str):
+        progress = parser.feed(line)
+        if progress is not None:
+            on_progress(progress)
+
+    returncode = yield Stream(command, "encode", on_line, warnings, timeout)
+    return returncode, parser
+
+
+def report_warnings(uid, warnings: collections.deque):
+    if warnings:
+        print(f"ffmpeg warnings for UID {uid} (last {len(warnings)}):")
+        for line in warnings:
+            print(f"  {line}")
+
+
 def run_ffmpeg_encode(
     uid,
     data,
     data_lock,
     quality,
     audio_map,
-    subtitle_map
+    subtitle_map,
+    remux=False
 ):
     with data_lock:
         try:
             # Construct the command as a list of strings
-            cmd = [
-                "ffmpeg",
-                "-hide_banner",
-                "-loglevel", "info",
-                "-stats",
-                "-progress", "pipe:1",
-                "-i", data[uid]["input_file"],
-                "-map", "0:v:0",
-            ]
-
-            if audio_map:
-                cmd.extend(audio_map.split())
-
-            if subtitle_map:
-                cmd.extend(subtitle_map.split())
-
-            cmd.extend([
-                "-c:v", "libx265",
-                "-preset", quality["preset"],
-                "-crf", str(quality["crf"]),
-                "-x265-params", f"aq-mode={quality['aq_mode']}",
-                "-c:a", "aac",
-                "-b:a", quality['bitrate'],
-                "-c:s", "copy",
-                "-err_detect", "aggressive",
-                "-fflags", "+genpts+discardcorrupt",
-                f"{data[uid]['encoded_file']}"
-            ])
+            cmd = build_ffmpeg_command(
+                input_path(data[uid]),
+                encode_path(data[uid]),
+                quality,
+                audio_map,
+                subtitle_map,
+                remux,
+                data[uid]["audio_streams"]
+            )
 
         except Exception as e:
             data[uid]["status"] = "error"
             data[uid]["error"] = e
             return False
 
-    process = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        universal_newlines=True,
-        bufsize=1
-    )
-
-    while True:
-        line = process.stdout.readline()
-        if not line and process.poll() is not None:
-            break
-
-        if line:
-            try:
-                match = re.search(r'frame=\s*(\d+)', line)
-                if match:
-                    curframe = int(match.group(1))
-                with data_lock:
-                    data[uid]["current_frame"] = curframe
-
-            except Exception as e:
-                # print(e)
-                # print(line)
-                pass
-
-    # Wait for the process to fully finish and get the return code
-    return process.wait()
+    # Warnings and errors are read separately from progress
+    warnings = collections.deque(maxlen=WARNING_LINES)
+
+    def on_progress(progress):
+        with data_lock:
+            apply_progress(data[uid], progress)
+
+    try:
+        returncode, _ = yield from progress_steps(cmd, on_progress, warnings)
+    except TimeoutError as e:
+        with data_lock:
+            data[uid]["status"] = "error"
+            data[uid]["error"] = str(e)
+        return False
+
+    report_warnings(uid, warnings)
+    if returncode != 0:
+        with data_lock:
+            data[uid]["status"] = "error"
+            data[uid]["error"] = (
+                warnings[-1] if warnings
+                else f"ffmpeg exited with code {returncode}")
+    return returncode
 
 
 if __name__ == "__main__":
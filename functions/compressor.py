@@ -2,7 +2,12 @@ from pathlib import Path
 
 from .config import load_config
 from . import disk_stats as ds
-from .command_runner import run_terminal_command, run_ffmpeg_encode
+from .audio import audio_plan, describe_plan
+from .command_runner import run_ffmpeg_encode
+from .copier import encode_path
+from .prefetch import input_path as cached_input_path
+from .media_info import media_info_steps, stream_languages
+from .segment_encoder import use_segments, run_segmented_encode
 
 CONFIG = load_config()
 
@@ -23,9 +28,10 @@ def verify_video_ready(input_path: str, output_path: str, quality_key: str):
         print(error_message)
         return error_message
 
-    # Check free space
+    # Check free space where the output goes. The daemon already reserved
+    # the expected output size, this catches disks that filled up since.
     buffer = ds.gib_to_bytes(CONFIG.buffer)
-    if not ds.check_enough_space(input_path, buffer):
+    if not ds.check_enough_space(output_path, buffer):
         error_message = "Not enough free space on disk (compressor)"
         print(error_message)
         return error_message
@@ -39,11 +45,30 @@ def verify_video_ready(input_path: str, output_path: str, quality_key: str):
         return error_message
 
 
+def get_stream_map(languages: list, stream_type: str) -> str:
+    """
+    Picks which streams of a type to keep.
+    English streams if there are any, otherwise the first stream.
+    Returns a blank string if there are no streams.
+    """
+    if 'eng' in languages:
+        return f"-map 0:{stream_type}:m:language:eng"
+    elif len(languages) > 0:
+        return f"-map 0:{stream_type}:0"
+    return ""
+
+
 def encode_video(uid, data, data_lock):
+    """
+    Steps of an encode job, see processes.py.
+    """
     with data_lock:
-        input_path = data[uid]["input_file"]
-        output_path = data[uid]["encoded_file"]
+        input_path = cached_input_path(data[uid])
+        output_path = encode_path(data[uid])
         quality_key = data[uid]["quality"]
+        duration = data[uid].get("duration", 0)
+        info = data[uid].get("media_info")
+        remux = data[uid].get("remux")
 
     quality = verify_video_ready(input_path, output_path, quality_key)
     if type(quality) is not dict:
@@ -52,47 +77,51 @@ def encode_video(uid, data, data_lock):
             data[uid]["error"] = quality
             return False
 
-    # get audio
-    audio_lang = run_terminal_command(f'''
-ffprobe -v error -select_streams a
--show_entries stream_tags=language
--of default=noprint_wrappers=1:nokey=1 "{input_path}"
-''').split()
-    if "Error:" in audio_lang:
+    # Jobs from before media info was stored are probed (or read from the
+    # cache) here
+    if not info:
+        info = yield from media_info_steps(input_path)
+        if type(info) is not dict:
+            with data_lock:
+                data[uid]["status"] = "error"
+                data[uid]["error"] = info
+                return False
         with data_lock:
-            data[uid]["status"] = "error"
-            data[uid]["error"] = audio_lang
-            return False
-    elif 'eng' in audio_lang:
-        audio_map = "-map 0:a:m:language:eng"
-    elif len(audio_lang) > 0:
-        audio_map = "-map 0:a:0"
-    else:
-        audio_map = ""
-
-    # get subtitles
-    sub_lang = run_terminal_command(f'''
-ffprobe -v error -select_streams s
--show_entries stream_tags=language
--of default=noprint_wrappers=1:nokey=1 "{input_path}"
-''').split()
-    if "Error:" in sub_lang:
+            data[uid]["media_info"] = info
+
+    # get audio and subtitles
+    audio_map = get_stream_map(stream_languages(info, "a"), "a")
+    subtitle_map = get_stream_map(stream_languages(info, "s"), "s")
+
+    # Audio that already meets the preset is copied (remuxes copy it all)
+    if not remux:
+        plan = audio_plan(info, quality)
+        print(f"Audio for UID {uid}: {describe_plan(plan)}")
         with data_lock:
-            data[uid]["status"] = "error"
-            data[uid]["error"] = sub_lang
-            return False
-    if 'eng' in sub_lang:
-        subtitle_map = "-map 0:s:m:language:eng"
-    elif len(sub_lang) > 0:
-        subtitle_map = "-map 0:s:0"
-    else:
-        subtitle_map = ''
-
-    return run_ffmpeg_encode(
+            data[uid]["audio_streams"] = plan
+
+    # Long files are split and encoded on several cores at once, remuxes
+    # only copy and are fast anyway
+    if not remux and use_segments(duration, CONFIG.segment_encode_enabled,
+                                  CONFIG.segment_min_duration):
+        return (yield from run_segmented_encode(
+            uid,
+            data,
+            data_lock,
+            quality,
+            audio_map,
+            subtitle_map,
+            CONFIG.segment_length,
+            CONFIG.segment_parallel,
+            CONFIG.segment_resume
+        ))
+
+    return (yield from run_ffmpeg_encode(
         uid,
         data,
         data_lock,
         quality,
         audio_map,
-        subtitle_map
-    )
+        subtitle_map,
+        bool(remux)
+    ))
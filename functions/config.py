@@ -8,6 +8,11 @@ PROJECT_ROOT = Path(__file__).resolve().parent.parent
 CONFIG_FILE_PATH = PROJECT_ROOT / "config.json"
 DOTENV_PATH = PROJECT_ROOT / ".env"
 DATA_FILE_PATH = PROJECT_ROOT / "data.json"
+JOBS_DB_PATH = PROJECT_ROOT / "jobs.db"
+AUTOTUNE_FILE_PATH = PROJECT_ROOT / "autotune.json"
+MEDIA_INFO_CACHE_PATH = PROJECT_ROOT / "media_info.db"
+THROUGHPUT_DB_PATH = PROJECT_ROOT / "throughput.db"
+STORAGE_FILE_PATH = PROJECT_ROOT / "storage.json"
 
 # local config files that are not pushed to github
 LOCAL_CONFIG_FILE_PATH = PROJECT_ROOT / "config.local.json"
@@ -36,6 +41,12 @@ class Config:
         job_limits = raw_config.get('job_limits', {})
         self.max_encode_jobs: int = job_limits.get('encode', 1)
         self.max_frame_count_jobs: int = job_limits.get('frame_count', 1)
+        self.worker_restarts: int = job_limits.get('worker_restarts', 1)
+        self.max_copy_jobs: int = job_limits.get('copy', 1)
+        self.max_verify_jobs: int = job_limits.get('verify', 2)
+        # "process" runs each job in its own worker process,
+        # "asyncio" runs every job as a task on one event loop.
+        self.worker_backend: str = raw_config.get('worker_backend', 'process')
 
         # --- 3. Quality Presets (From config.json) ---
         self.quality_presets: Dict[str, str] = raw_config.get(
@@ -45,6 +56,11 @@ class Config:
         self.input_dir: Path = Path(raw_config.get('input_dir', '.'))
         self.output_dir: Path = Path(
             raw_config.get('output_dir', './Encoded'))
+        # Fast local disk encodes are written to before they are copied to
+        # output_dir, None to write to output_dir directly
+        scratch_dir = raw_config.get('scratch_dir', '')
+        self.scratch_dir: Path | None = (
+            Path(scratch_dir) if scratch_dir else None)
 
         # --- 5. Storage Buffer ---
         self.buffer: float = raw_config.get('storage_buffer', 10)
@@ -60,13 +76,117 @@ class Config:
             'textual_overview_columns', [
                 "name",
                 "progress",
-                "status"
+                "status",
+                "eta"
             ]
         )
 
         # --- 7. Site settings ---
         self.site: list = raw_config.get("site", ["localhost", 8932]).values()
 
+        # --- 8. Encode scheduler ---
+        scheduler = raw_config.get('scheduler', {})
+        self.scheduler_policy: str = scheduler.get('policy', 'size')
+        self.scheduler_aging_per_hour: float = scheduler.get(
+            'aging_per_hour', 1)
+        self.scheduler_fair_share: bool = scheduler.get('fair_share', True)
+
+        # --- 9. Encode concurrency autotuning ---
+        autotune = raw_config.get('autotune', {})
+        self.autotune_enabled: bool = autotune.get('enabled', False)
+        self.autotune_max_encode_jobs: int = autotune.get(
+            'max_encode_jobs', 4)
+        self.autotune_window: float = autotune.get('window', 300)
+
+        # --- 10. Remote workers ---
+        cluster = raw_config.get('cluster', {})
+        self.cluster_enabled: bool = cluster.get('enabled', False)
+        # Address the daemon listens on for workers
+        self.cluster_bind: str = cluster.get('bind', '127.0.0.1')
+        # Address worker.py connects to
+        self.cluster_coordinator: str = cluster.get(
+            'coordinator', 'localhost')
+        self.cluster_port: int = cluster.get('port', 8933)
+        self.cluster_lease_timeout: float = cluster.get('lease_timeout', 60)
+        # Shared by the daemon and its workers, kept in .env like the API key
+        self.cluster_secret: str = os.getenv('CLUSTER_SECRET', '').strip()
+
+        # --- 11. Segment encoding ---
+        segment_encode = raw_config.get('segment_encode', {})
+        self.segment_encode_enabled: bool = segment_encode.get(
+            'enabled', False)
+        # Only files at least this long are split (seconds)
+        self.segment_min_duration: float = segment_encode.get(
+            'min_duration', 3600)
+        self.segment_length: float = segment_encode.get('segment_length', 300)
+        self.segment_parallel: int = segment_encode.get('parallel', 4)
+        # Keep finished segments so interrupted encodes can carry on
+        self.segment_resume: bool = segment_encode.get('resume', True)
+
+        # --- 12. Preset picker (quality "auto") ---
+        preset_picker = raw_config.get('preset_picker', {})
+        self.preset_picker_enabled: bool = preset_picker.get(
+            'enabled', False)
+        # Presets to try, every preset if empty
+        self.preset_picker_candidates: list = preset_picker.get(
+            'candidates', [])
+        self.preset_picker_samples: int = preset_picker.get('samples', 3)
+        self.preset_picker_sample_length: float = preset_picker.get(
+            'sample_length', 10)
+        # "size" or "quality"
+        self.preset_picker_target: str = preset_picker.get('target', 'size')
+        # Largest output size as a fraction of the input
+        self.preset_picker_max_size_ratio: float = preset_picker.get(
+            'max_size_ratio', 0.5)
+        # "ssim", "psnr" or "" to not measure quality
+        self.preset_picker_metric: str = preset_picker.get('metric', 'ssim')
+        # Lowest SSIM (0-1) or PSNR (dB) for the "quality" target
+        self.preset_picker_min_quality: float = preset_picker.get(
+            'min_quality', 0.97)
+
+        # --- 13. CPU and I/O priority of each stage ---
+        # probe, frame_count, encode, copy, prefetch and verify, each with
+        # nice, ionice
+        # ("realtime", "best_effort" or "idle"), ionice_level and sched_idle
+        self.priority: dict = raw_config.get('priority', {})
+
+        # --- 14. Input prefetch ---
+        prefetch = raw_config.get('prefetch', {})
+        self.prefetch_enabled: bool = prefetch.get('enabled', False)
+        self.prefetch_cache_dir: Path = Path(
+            prefetch.get('cache_dir', '') or PROJECT_ROOT / "prefetch")
+        # Largest size of the cache (GiB)
+        self.prefetch_max_size: float = prefetch.get('max_size', 50)
+        # How many queued jobs ahead are copied
+        self.prefetch_jobs: int = prefetch.get('jobs', 2)
+        self.prefetch_parallel: int = prefetch.get('parallel', 1)
+        # shipper removes old copies from the cache folder, so it may not
+        # be (inside) a folder that holds anything else
+        for name in ('scratch_dir', 'input_dir', 'output_dir'):
+            folder = raw_config.get(name, '')
+            if folder and _is_inside(self.prefetch_cache_dir, Path(folder)):
+                print(f"Error: prefetch.cache_dir must not be inside "
+                      f"{name}, prefetch is turned off.")
+                self.prefetch_enabled = False
+
+        # --- 15. Verification of finished encodes ---
+        verify = raw_config.get('verify', {})
+        self.verify_enabled: bool = verify.get('enabled', True)
+        # Largest difference between input and output duration (seconds)
+        self.verify_max_duration_diff: float = verify.get(
+            'max_duration_diff', 2)
+        # How many pieces are decoded and how long each is (seconds)
+        self.verify_samples: int = verify.get('samples', 4)
+        self.verify_sample_length: float = verify.get('sample_length', 5)
+
+
+def _is_inside(folder: Path, parent: Path) -> bool:
+    """
+    Returns True if folder is parent or a folder inside it.
+    """
+    folder, parent = folder.resolve(), parent.resolve()
+    return folder == parent or parent in folder.parents
+
 
 def load_config() -> Config:
     """
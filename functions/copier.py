@@ -0,0 +1,187 @@
+"""
+Moves finished encodes from the scratch folder into the library.
+With scratch_dir set, ffmpeg writes to fast local disk instead of output_dir
+and a separate copy stage (job_limits.copy at once) moves each finished file
+to its place in the Plex layout. Files are copied in large chunks with
+copy_file_range (or sendfile) to a hidden .part file next to the destination,
+which is renamed into place once complete, so Plex never sees half a file.
+A scratch folder on the same filesystem as the library is just renamed.
+"""
+
+import errno
+import os
+import time
+from pathlib import Path
+
+from .disk_stats import existing_parent
+from .processes import Blocking, JobCancelled
+
+# How much is copied per call (bytes)
+CHUNK_SIZE = 64 * 2**20
+
+# copy_file_range and sendfile fail with these where they are not supported
+# (older kernels, some network filesystems), the next method is used instead
+FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP}
+
+
+def scratch_path(scratch_dir, uid: str, encoded_file: str) -> str:
+    """
+    Where a job is encoded in the scratch folder.
+    """
+    return str(Path(scratch_dir) / uid / Path(encoded_file).name)
+
+
+def use_scratch(uid: str, job, scratch_dir):
+    """
+    Sets where an encode that is about to start writes to. Jobs for remote
+    workers and daemons without scratch_dir write straight to the library.
+    """
+    job["scratch_file"] = scratch_path(
+        scratch_dir, uid, job["encoded_file"]) if scratch_dir else ""
+
+
+def encode_path(job) -> str:
+    """
+    The file ffmpeg writes a job's output to.
+    """
+    return job["scratch_file"] or job["encoded_file"]
+
+
+def partial_path(encoded_file: str) -> Path:
+    """
+    The file a copy is written to before it is renamed into place.
+    """
+    encoded_file = Path(encoded_file)
+    return encoded_file.with_name(f".{encoded_file.name}.part")
+
+
+def same_filesystem(source: str, destination: str) -> bool:
+    return (os.stat(source).st_dev
+            == os.stat(existing_parent(destination)).st_dev)
+
+
+def _copy_methods() -> list:
+    methods = [
+        name for name in ("copy_file_range", "sendfile") if hasattr(os, name)
+    ]
+    return methods + ["pread"]
+
+
+def _copy_chunk(method: str, src: int, dst: int, offset: int,
+                count: int) -> int:
+    if method == "copy_file_range":
+        return os.copy_file_range(src, dst, count, offset, offset)
+    if method == "sendfile":
+        os.lseek(dst, offset, os.SEEK_SET)
+        return os.sendfile(dst, src, offset, count)
+    return os.pwrite(dst, os.pread(src, count, offset), offset)
+
+
+def copy_chunks(source: str, destination: Path):
+    """
+    Copies a file CHUNK_SIZE at a time, yielding (bytes copied, size) after
+    every chunk. The copy is flushed to disk before the last yield returns.
+    """
+    methods = _copy_methods()
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(src.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        size = os.fstat(src.fileno()).st_size
+        copied = 0
+        while copied < size:
+            try:
+                done = _copy_chunk(methods[0], src.fileno(), dst.fileno(),
+                                   copied, min(CHUNK_SIZE, size - copied))
+            except OSError as e:
+                if len(methods) == 1 or e.errno not in FALLBACK_ERRNOS:
+                    raise
+                methods.pop(0)
+                continue
+            if done == 0:
+                raise OSError(
+                    f"{source} ended after {copied} of {size} bytes")
+            copied += done
+            yield copied, size
+        os.fsync(dst.fileno())
+
+
+def move_to_library(source: str, destination: str):
+    """
+    Moves a finished encode into place, yielding (bytes copied, size) while
+    it is copied. An unfinished copy is removed.
+    """
+    if same_filesystem(source, destination):
+        os.replace(source, destination)
+        return
+    partial = partial_path(destination)
+    try:
+        yield from copy_chunks(source, partial)
+        os.replace(partial, destination)
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+    os.remove(source)
+
+
+def prepare_copy(job) -> str:
+    """
+    Checks a copy can start. Returns an error, or a blank string.
+    """
+    if Path(job["encoded_file"]).exists():
+        return "Output file already exists (copy)"
+    if not Path(job["scratch_file"]).exists():
+        return "Encoded file is missing from the scratch folder (copy)"
+    Path(job["encoded_file"]).parent.mkdir(parents=True, exist_ok=True)
+    job["copy_start_time"] = int(time.time())
+    job["percentage_copied"] = 0
+    return ""
+
+
+def finish_copy(job, error: str = ""):
+    """
+    Marks a copy as done, or failed if there is an error.
+    """
+    if error:
+        job["status"] = "error"
+        job["error"] = error
+        return
+    # The job's folder in the scratch folder is empty now
+    try:
+        os.rmdir(Path(job["scratch_file"]).parent)
+    except OSError:
+        pass
+    job["scratch_file"] = ""
+    job["percentage_copied"] = 100
+    job["copy_end_time"] = int(time.time())
+    job["status"] = "encoded"
+
+
+def copy_job(uid, data, data_lock):
+    """
+    Moves a job's encode from the scratch folder into the library.
+    Steps of a copy job, see processes.py. The copy is done in Python, so
+    it is one Blocking step.
+    """
+    with data_lock:
+        error = prepare_copy(data[uid])
+        source = data[uid]["scratch_file"]
+        destination = data[uid]["encoded_file"]
+
+    def copy(cancelled):
+        for copied, size in move_to_library(source, destination):
+            # Copies running in a thread stop between chunks
+            if cancelled.is_set():
+                raise JobCancelled()
+            with data_lock:
+                data[uid]["percentage_copied"] = round(
+                    copied / size * 100, 1)
+
+    if not error:
+        print(f"Copying UID {uid} to {destination}")
+        try:
+            yield Blocking(copy, "copy")
+        except OSError as e:
+            error = f"Failed to copy to the library: {e}"
+
+    with data_lock:
+        finish_copy(data[uid], error)
@@ -24,6 +24,28 @@ def get_file_size(path: str) -> float:
     return Path(path).stat().st_size
 
 
+def existing_parent(path: str) -> Path:
+    """
+    Returns the path, or its closest parent that exists.
+    Output folders are only made when an encode starts.
+    """
+    path = Path(path).absolute()
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return path
+
+
+def mount_point(path: str) -> Path:
+    """
+    Returns the mount point of the filesystem a path is (or will be) on.
+    """
+    path = existing_parent(path)
+    device = path.stat().st_dev
+    while path != path.parent and path.parent.stat().st_dev == device:
+        path = path.parent
+    return path
+
+
 def get_disk_metrics(path: str = "/") -> tuple[float, float, float]:
     """
     Calculates and returns total bytes, used bytes, and decimal usage ratio.
@@ -35,17 +57,16 @@ def get_disk_metrics(path: str = "/") -> tuple[float, float, float]:
     return total_bytes, used_bytes, disk_decimal
 
 
-def check_enough_space(path: str, buffer: float = 0) -> bool:
+def check_enough_space(path: str, buffer: float = 0, size: float = 0) -> bool:
     """
-    Function to check if duplicating a file will exceed the disk space.
+    Function to check if size bytes can be written to the filesystem path is
+    (or will be) on.
     Buffer should be in bytes.
     Buffer is first removed from disk space.
     Returns boolean (true if there is enough space).
     """
-    file_size = get_file_size(path)
-    disk_space, used_disk, _ = get_disk_metrics()
-    final_disk_space = disk_space - used_disk - buffer - file_size
-    return final_disk_space > 0
+    free_disk = shutil.disk_usage(existing_parent(path)).free
+    return free_disk - buffer - size > 0
 
 
 def print_disk_usage(
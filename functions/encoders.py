@@ -0,0 +1,193 @@
+"""
+The video encoders a quality preset can use.
+Each preset in quality_presets names its encoder (libx265 if it does not)
+and can pass encoder specific options, which are added to the encoder's
+params (-x265-params, -x264-params or -svtav1-params). The daemon checks at
+startup that the local ffmpeg has every encoder the presets use.
+"""
+
+import signal
+import subprocess
+
+DEFAULT_ENCODER = "libx265"
+
+X26X_PRESETS = (
+    "ultrafast", "superfast", "veryfast", "faster", "fast",
+    "medium", "slow", "slower", "veryslow", "placebo",
+)
+
+
+class Encoder:
+    """
+    Builds the video arguments of an ffmpeg command for one encoder.
+    """
+
+    name = ""
+    # ffmpeg option the encoder params are passed with
+    params_flag = ""
+    # Encoder param that limits how many threads one encode uses
+    threads_param = ""
+
+    def params(self, quality: dict, threads: int = None) -> dict:
+        params = dict(quality.get("options", {}))
+        if threads:
+            params[self.threads_param] = threads
+        return params
+
+    def args(self, quality: dict, threads: int = None) -> list:
+        """
+        Returns the video arguments for a preset. threads limits the number
+        of threads when several encodes share the cores.
+        """
+        args = [
+            "-c:v", self.name,
+            "-preset", str(quality["preset"]),
+            "-crf", str(quality["crf"]),
+        ]
+        params = self.params(quality, threads)
+        if params:
+            args.extend([self.params_flag, ":".join(
+                f"{key}={value}" for key, value in params.items())])
+        return args
+
+    def validate(self, quality: dict) -> list:
+        """
+        Returns what is wrong with a preset for this encoder.
+        """
+        errors = [
+            f"missing '{key}'" for key in ("crf", "preset")
+            if key not in quality
+        ]
+        if not isinstance(quality.get("options", {}), dict):
+            errors.append("'options' must be an object of encoder params")
+        if not isinstance(quality.get("remux", {}), dict):
+            errors.append("'remux' must be an object with codecs, "
+                          "max_bitrate and min_saving")
+        if not isinstance(quality.get("audio_copy", []), list):
+            errors.append("'audio_copy' must be a list of audio codecs")
+        return errors
+
+
+class X26xEncoder(Encoder):
+    def params(self, quality: dict, threads: int = None) -> dict:
+        params = {}
+        if quality.get("aq_mode"):
+            params["aq-mode"] = quality["aq_mode"]
+        return params | super().params(quality, threads)
+
+    def validate(self, quality: dict) -> list:
+        errors = super().validate(quality)
+        if "preset" in quality and quality["preset"] not in X26X_PRESETS:
+            errors.append(
+                f"preset '{quality['preset']}' is not one of "
+                f"{', '.join(X26X_PRESETS)}")
+        return errors
+
+
+class X265Encoder(X26xEncoder):
+    name = "libx265"
+    params_flag = "-x265-params"
+    threads_param = "pools"
+
+
+class X264Encoder(X26xEncoder):
+    name = "libx264"
+    params_flag = "-x264-params"
+    threads_param = "threads"
+
+
+class SvtAv1Encoder(Encoder):
+    # aq_mode is an x26x setting, SVT-AV1 options go in "options"
+    name = "libsvtav1"
+    params_flag = "-svtav1-params"
+    threads_param = "lp"
+
+    def validate(self, quality: dict) -> list:
+        errors = super().validate(quality)
+        try:
+            if not -2 <= int(quality.get("preset", 0)) <= 13:
+                raise ValueError
+        except (TypeError, ValueError):
+            errors.append(
+                f"preset '{quality['preset']}' must be a number from -2 "
+                "(slowest) to 13 (fastest)")
+        return errors
+
+
+ENCODERS = {
+    encoder.name: encoder
+    for encoder in (X265Encoder(), X264Encoder(), SvtAv1Encoder())
+}
+
+
+def get_encoder(quality: dict) -> Encoder:
+    """
+    Returns the encoder a preset uses.
+    """
+    return ENCODERS[quality.get("encoder", DEFAULT_ENCODER)]
+
+
+def video_args(quality: dict, threads: int = None) -> list:
+    """
+    Returns the video arguments of an ffmpeg command for a preset.
+    """
+    return get_encoder(quality).args(quality, threads)
+
+
+def available_encoders() -> set | None:
+    """
+    Returns the names of the encoders the local ffmpeg was built with,
+    or None if ffmpeg could not be run.
+    """
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            capture_output=True, text=True, check=True,
+            preexec_fn=lambda: signal.signal(signal.SIGINT, signal.SIG_IGN)
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    # After a legend ending in " ------", lines look like
+    # " V....D libx265    libx265 H.265 / HEVC"
+    _, _, listing = result.stdout.partition("------")
+    encoders = set()
+    for line in listing.splitlines():
+        fields = line.split()
+        if len(fields) >= 2 and fields[0].startswith("V"):
+            encoders.add(fields[1])
+    return encoders
+
+
+def validate_presets(presets: dict, available: set | None) -> list:
+    """
+    Returns an error for every preset that names an unknown encoder, one
+    ffmpeg does not have or settings the encoder can not use.
+    """
+    if available is None:
+        return ["Could not run 'ffmpeg -encoders', is ffmpeg installed?"]
+    errors = []
+    for preset_name, quality in presets.items():
+        name = quality.get("encoder", DEFAULT_ENCODER)
+        if name not in ENCODERS:
+            errors.append(
+                f"Preset '{preset_name}': unknown encoder '{name}', "
+                f"use one of {', '.join(ENCODERS)}")
+            continue
+        if name not in available:
+            errors.append(
+                f"Preset '{preset_name}': this ffmpeg was built without "
+                f"{name}")
+        errors.extend(
+            f"Preset '{preset_name}' ({name}): {error}"
+            for error in ENCODERS[name].validate(quality))
+    return errors
+
+
+def check_encoders(presets: dict) -> bool:
+    """
+    Prints what is wrong with the presets, returns False if anything is.
+    """
+    errors = validate_presets(presets, available_encoders())
+    for error in errors:
+        print(f"Error: {error}")
+    return not errors
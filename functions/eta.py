@@ -0,0 +1,149 @@
+"""
+Estimates how long encodes have left.
+How far an encode is comes from ffmpeg's out_time (frames done if ffmpeg
+does not report it). Workers smooth the encode speed ffmpeg reports (how
+many seconds of video are encoded per second) with an exponentially weighted
+moving average, so the ETA does not swing around at the start of an encode
+or after a restart.
+The queue ETA adds up the time left on running encodes and the predicted
+time of every waiting job, using the ThroughputModel of the recorded encodes
+(the same forecast as plan.py).
+"""
+
+import math
+import time
+
+try:
+    from .throughput import video_class
+except ImportError:
+    from throughput import video_class
+
+# Roughly how many seconds of history the smoothed speed follows
+ETA_WINDOW = 60
+
+RUNNING_STATUSES = ("encoding",)
+WAITING_STATUSES = ("not_started", "getting_frames", "ready_to_encode")
+
+
+def _fraction_done(job) -> float | None:
+    frames = job.get("frames")
+    if not frames:
+        return None
+    return min(1.0, (job.get("current_frame") or 0) / frames)
+
+
+def _position(job, progress: dict) -> float | None:
+    """
+    How many seconds of the video are encoded. Frame counts can be
+    estimates, so ffmpeg's out_time is used when it reports one.
+    """
+    if progress.get("out_time_us") is not None:
+        return progress["out_time_us"] / 1e6
+    done = _fraction_done(job)
+    duration = job.get("duration")
+    return done * duration if done is not None and duration else None
+
+
+def smooth_progress(job, progress: dict, now: float = None) -> dict:
+    """
+    Adds the smoothed speed (speed_avg), the seconds left (eta), the time
+    they were worked out (updated) and the time measuring started (since) to
+    a progress block.
+    The speed is measured from how far the encode got since the last block
+    and seeded with ffmpeg's own speed.
+    """
+    now = time.time() if now is None else now
+    previous = job.get("progress") or {}
+    duration = job.get("duration") or 0
+    position = _position(job, progress)
+
+    speed = progress.get("speed")
+    last_position = previous.get("position")
+    last_update = previous.get("updated")
+    since = previous.get("since", now)
+    # Progress from before a restart is too old to measure against
+    if last_update is None or not 0 < now - last_update <= ETA_WINDOW:
+        last_update = None
+        since = now
+    elif (position is not None and last_position is not None
+            and position >= last_position):
+        speed = (position - last_position) / (now - last_update)
+
+    speed_avg = previous.get("speed_avg")
+    if speed_avg is None or last_update is None:
+        speed_avg = speed or speed_avg
+    elif speed is not None:
+        # Average everything measured until the window has filled, so the
+        # first (noisy) speed does not linger
+        alpha = max(1 - math.exp(-(now - last_update) / ETA_WINDOW),
+                    (now - last_update) / (now - since))
+        speed_avg += alpha * (speed - speed_avg)
+
+    eta = None
+    if position is not None and duration and speed_avg:
+        eta = max(0.0, (duration - position) / speed_avg)
+
+    return {
+        **progress,
+        "position": position,
+        "speed_avg": speed_avg,
+        "eta": eta,
+        "updated": now,
+        "since": since,
+    }
+
+
+def job_eta(job, now: float = None) -> float | None:
+    """
+    Returns the seconds left on a running encode, or None if not known.
+    """
+    progress = job.get("progress") or {}
+    if job.get("status") not in RUNNING_STATUSES or progress.get(
+            "eta") is None:
+        return None
+    now = time.time() if now is None else now
+    return max(0.0, progress["eta"] - (now - progress["updated"]))
+
+
+def predicted_time(job, model) -> float | None:
+    """
+    Returns how long a job is expected to take to encode, from earlier
+    encodes of its preset (model is a ThroughputModel).
+    """
+    prediction = model.predict(
+        job.get("quality", ""), *video_class(job.get("media_info")))
+    if prediction is None or not job.get("duration"):
+        return None
+    return job["duration"] / prediction["speed"]
+
+
+def queue_eta(jobs: dict, model, parallel: int = None,
+              now: float = None) -> float | None:
+    """
+    Returns the seconds until every running and waiting job in jobs is done.
+    Running encodes use their own measured speed, waiting jobs (and encodes
+    that have not measured one yet) are predicted with model.
+    The work is shared between parallel encodes (job_limits.encode), or the
+    number running now if more are. Jobs with no estimate are left out,
+    None means nothing could be estimated.
+    """
+    total = None
+    running = 0
+    for job in jobs.values():
+        if job.get("status") in RUNNING_STATUSES:
+            running += 1
+            seconds = job_eta(job, now)
+            if seconds is None:
+                seconds = predicted_time(job, model)
+                if seconds is not None:
+                    seconds *= 1 - (_fraction_done(job) or 0)
+        elif job.get("status") in WAITING_STATUSES:
+            seconds = predicted_time(job, model)
+        else:
+            continue
+        if seconds is not None:
+            total = (total or 0) + seconds
+
+    if total is None:
+        return None
+    return total / max(1, parallel or 0, running)
@@ -0,0 +1,175 @@
+'''
+A compact record for a single job.
+Every known field is a slot instead of a dictionary key, which keeps large
+job histories small in memory. Only fields that differ from their default are
+saved. Jobs still behave like dictionaries (job["status"], job.get(...)) so
+the rest of the code does not need to know the difference.
+Each job has its own lock, so updating one job does not need the daemon-wide
+data_lock.
+'''
+
+import json
+import threading
+
+# Every known field and its default value
+JOB_DEFAULTS = {
+    "id": "",
+    "name": "",
+    "year": 0,
+    "quality": "",
+    "preset_samples": None,
+    "remux": "",
+    "type": "",
+    "status": "not_started",
+    "priority": 0,
+    "error": "",
+    "input_file": "",
+    "cached_input": "",
+    "encoded_file": "",
+    "scratch_file": "",
+    "before_size": 0,
+    "after_size": 0,
+    "frames": 0,
+    "frames_estimated": False,
+    "current_frame": 0,
+    "progress": None,
+    "duration": 0,
+    "media_info": None,
+    "audio_streams": None,
+    "verification": None,
+    "percentage_copied": 0,
+    "queued_time": 0,
+    "job_start_time": 0,
+    "encode_start_time": 0,
+    "resumed": False,
+    "encode_end_time": 0,
+    "copy_start_time": 0,
+    "copy_end_time": 0,
+    "job_end_time": 0,
+}
+
+# Old fields that were never used, they are dropped when a job is loaded
+DROPPED_FIELDS = ("current_frames", "percentage_encoded")
+
+
+def with_defaults(job: dict) -> dict:
+    '''
+    Returns a saved job with every missing field set to its default.
+    '''
+    return {**JOB_DEFAULTS, **job}
+
+
+class Job:
+    '''
+    A single job. Unknown fields are kept in a small extra dictionary.
+    '''
+
+    __slots__ = (*JOB_DEFAULTS, "uid", "lock", "_store", "_extra")
+
+    def __init__(self, job: dict = None, uid: str = None, store=None):
+        self.uid = uid
+        self.lock = threading.Lock()
+        self._store = None
+        self._extra = None
+        for key, value in JOB_DEFAULTS.items():
+            setattr(self, key, value)
+        for key, value in (job or {}).items():
+            self[key] = value
+        self._store = store
+
+    # == Dictionary interface ==
+    def __getitem__(self, key):
+        if key in JOB_DEFAULTS:
+            return getattr(self, key)
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in DROPPED_FIELDS:
+            return
+        store = self._store
+        if key == "status" and store is not None:
+            store._move_status(self.uid, self.status, value)
+        if key in JOB_DEFAULTS:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+        if store is not None:
+            store._dirty.add(self.uid)
+
+    def __delitem__(self, key):
+        if key in JOB_DEFAULTS:
+            self[key] = JOB_DEFAULTS[key]
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+            if self._store is not None:
+                self._store._dirty.add(self.uid)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in JOB_DEFAULTS or (
+            self._extra is not None and key in self._extra)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self) -> list:
+        return [*JOB_DEFAULTS, *(self._extra or {})]
+
+    def items(self) -> list:
+        return [(key, self[key]) for key in self.keys()]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    # == Serialization ==
+    def to_dict(self) -> dict:
+        '''
+        Returns only the fields that differ from their defaults.
+        '''
+        job = {
+            key: getattr(self, key)
+            for key, default in JOB_DEFAULTS.items()
+            if getattr(self, key) != default
+        }
+        if self._extra:
+            job.update(self._extra)
+        return job
+
+    def to_json(self) -> str:
+        '''
+        Serializes the job for storage.
+        Values that are not JSON serializable (such as exceptions) are
+        stored as strings.
+        '''
+        with self.lock:
+            return json.dumps(self.to_dict(), default=str)
+
+    def __repr__(self):
+        return f"Job({self.uid}, {self.to_dict()})"
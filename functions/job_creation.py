@@ -1,186 +1,353 @@
-import threading
-import os
-import signal
+import heapq
 import subprocess
 import time
 from pathlib import Path
 
-from .compressor import encode_video
+from .copier import encode_path
+from .disk_stats import bytes_to_gib
+from .media_info import media_info_steps
+from .preset_picker import AUTO_QUALITY, pick_preset, set_picked_preset
+from .processes import FRAME_COUNT_TIMEOUT, Run
+
+SCHEDULER_POLICIES = ("fifo", "size", "duration")
+
+
+def job_cost(job: dict, policy: str) -> float:
+    """
+    Returns how expensive a job is expected to be.
+    size: GiB of the input file.
+    duration: minutes of video (falls back to size if not probed).
+    fifo: every job costs the same.
+    """
+    if policy == "duration" and job.get("duration"):
+        return job["duration"] / 60
+    if policy in ("size", "duration"):
+        return bytes_to_gib(job.get("before_size", 0))
+    return 1
+
+
+class EncodeScheduler:
+    """
+    Decides which ready_to_encode jobs are started next.
+
+    Jobs with a higher priority always go first.
+    Within a priority every show (by id) has its own heap ordered by cost
+    (shortest job first). Jobs are aged by the time they have waited, so a
+    big job's cost drops by aging_per_hour every hour until it runs.
+    With fair_share, shows take turns weighted by the cost they have already
+    been given, so one large remux can not hold back a whole season and a
+    season can not hold back everything else.
+    """
+
+    def __init__(self, policy: str = "size", aging_per_hour: float = 0,
+                 fair_share: bool = True):
+        if policy not in SCHEDULER_POLICIES:
+            print(f"Unknown scheduler policy '{policy}', using 'fifo'.")
+            policy = "fifo"
+        self.policy = policy
+        self.aging_per_hour = aging_per_hour
+        self.fair_share = fair_share
+
+        # priority -> show id -> heap of (key, int uid, uid, cost)
+        self._queues: dict[int, dict[str, list]] = {}
+        # show id -> total cost already dispatched
+        self._served: dict[str, float] = {}
+        self._queued: set[str] = set()
+        # uid -> (priority, show, heap entry) of the jobs the last pop
+        # returned, so they can be put back (unpop)
+        self._popped: dict[str, tuple] = {}
+
+    def push(self, uid: str, job: dict):
+        """
+        Adds a ready_to_encode job to the queue.
+        """
+        if uid in self._queued:
+            return
+        priority = int(job.get("priority", 0) or 0)
+        show = str(job.get("id", ""))
+        cost = job_cost(job, self.policy)
+        queued_hours = (job.get("queued_time") or time.time()) / 3600
+
+        # Aging lowers every waiting job's cost by the same amount per hour,
+        # so it can be folded into a fixed key based on when it was queued.
+        key = cost + self.aging_per_hour * queued_hours
+
+        shows = self._queues.setdefault(priority, {})
+        if show not in shows:
+            # A show that has been idle starts level with the active shows
+            # instead of being owed everything it missed.
+            active = [self._served.get(s, 0) for s in shows]
+            self._served[show] = max(
+                self._served.get(show, 0), min(active, default=0))
+            shows[show] = []
+
+        heapq.heappush(shows[show], (key, int(uid), uid, cost))
+        self._queued.add(uid)
+
+    def sync(self, data):
+        """
+        Queues any ready_to_encode jobs that are not queued yet.
+        """
+        for uid in data.uids_with_status("ready_to_encode"):
+            if uid not in self._queued:
+                self.push(uid, data[uid])
+
+    def _is_ready(self, data, uid: str) -> bool:
+        return uid in data and data[uid].get("status") == "ready_to_encode"
+
+    def _pop_one(self, data) -> str | None:
+        for priority in sorted(self._queues, reverse=True):
+            shows = self._queues[priority]
+            best = None
+            for show in list(shows):
+                heap = shows[show]
+                # Drop jobs that are no longer waiting
+                while heap and not self._is_ready(data, heap[0][2]):
+                    self._queued.discard(heapq.heappop(heap)[2])
+                if not heap:
+                    del shows[show]
+                    continue
+
+                tag = heap[0][0]
+                if self.fair_share:
+                    tag += self._served.get(show, 0)
+                if best is None or (tag, heap[0][1]) < best[0]:
+                    best = ((tag, heap[0][1]), show)
+
+            if best is None:
+                del self._queues[priority]
+                continue
+
+            show = best[1]
+            entry = heapq.heappop(shows[show])
+            _, _, uid, cost = entry
+            self._queued.discard(uid)
+            self._served[show] = self._served.get(show, 0) + cost
+            self._popped[uid] = (priority, show, entry)
+            if not shows[show]:
+                del shows[show]
+            return uid
+        return None
+
+    def peek(self, data, max_jobs: int) -> list:
+        """
+        Returns the next max_jobs uids in line without removing them.
+        """
+        state = (self._queues, self._served, self._queued, self._popped)
+        self._queues = {
+            priority: {show: list(heap) for show, heap in shows.items()}
+            for priority, shows in self._queues.items()
+        }
+        self._served = dict(self._served)
+        self._queued = set(self._queued)
+        try:
+            return self.pop(data, max_jobs)
+        finally:
+            (self._queues, self._served, self._queued,
+             self._popped) = state
+
+    def pop(self, data, max_jobs: int) -> list:
+        """
+        Removes and returns up to max_jobs uids in the order they should run.
+        """
+        self._popped = {}
+        uids = []
+        while len(uids) < max_jobs:
+            uid = self._pop_one(data)
+            if uid is None:
+                break
+            uids.append(uid)
+        return uids
+
+    def unpop(self, uid: str):
+        """
+        Puts a job the last pop returned back in its place and refunds its
+        cost, for a job that could not start after all.
+        """
+        priority, show, entry = self._popped.pop(uid)
+        shows = self._queues.setdefault(priority, {})
+        heapq.heappush(shows.setdefault(show, []), entry)
+        self._served[show] -= entry[3]
+        self._queued.add(uid)
 
 
 def get_frame_count_jobs(data, data_lock, max_jobs):
     with data_lock:
-        uids = [
-            k for k, v in data.items()
-            if v.get("status") == "not_started"
-        ][:max_jobs]
+        uids = data.uids_with_status("not_started", max_jobs)
+    return uids
+
+
+def get_encode_jobs(data, data_lock, max_jobs, scheduler: EncodeScheduler):
+    with data_lock:
+        scheduler.sync(data)
+        uids = scheduler.pop(data, max_jobs)
     return uids
 
 
-def get_encode_jobs(data, data_lock, max_jobs):
+def get_verify_jobs(data, data_lock, max_jobs):
     with data_lock:
-        uids = [
-            k for k, v in data.items()
-            if v.get("status") == "ready_to_encode"
-        ][:max_jobs]
+        uids = data.uids_with_status("ready_to_verify", max_jobs)
     return uids
 
 
-def get_frame_count(file_path: str) -> int | str:
+def get_copy_jobs(data, data_lock, max_jobs):
+    with data_lock:
+        uids = data.uids_with_status("ready_to_copy", max_jobs)
+    return uids
+
+
+def count_packets_command(file_path: str) -> list:
     """
-    Return total frame count of a video using ffprobe,
-    or an error string on failure.
+    ffprobe command that counts the packets of the video stream.
+    Reads the whole file but does not decode it.
     """
-    if not os.path.exists(file_path):
-        return f"Error: File not found — {file_path}"
+    return [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-count_packets",
+        "-show_entries", "stream=nb_read_packets",
+        "-of", "csv=p=0", file_path
+    ]
 
-    def set_sigint_ignore():
-        """
-        Sets the signal handler for SIGINT to ignore in the child.
-        """
-        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def frame_count_from_info(info: dict) -> dict:
+    """
+    Returns the duration and either the exact frame count from the
+    container, an estimate from duration x frame rate or no frame count.
+    """
+    video = info["video"] or {}
+    duration = video.get("duration") or info["duration"]
+    result = {
+        "duration": duration,
+        "frames": video.get("frames"),
+        "frames_estimated": False,
+        "media_info": info,
+    }
+    if not result["frames"] and video.get("frame_rate") and duration:
+        result["frames"] = round(duration * video["frame_rate"])
+        result["frames_estimated"] = True
+    return result
+
+
+def get_frame_count(file_path: str):
+    """
+    Steps that return the frame count, duration and media info of a video,
+    or an error string on failure.
+    Containers without a frame count (such as most MKVs) get an estimate
+    from duration x frame rate. The exact count is taken from the encode
+    once it finishes. Packets are only counted if there is no frame rate.
+    """
+    info = yield from media_info_steps(file_path)
+    if type(info) is not dict:
+        return info
+    probe = frame_count_from_info(info)
+    if probe["frames"]:
+        return probe
 
     try:
-        result = subprocess.run(
-            [
-                "ffprobe", "-v", "error",
-                "-select_streams", "v:0",
-                "-show_entries", "stream=nb_frames",
-                "-of", "default=nokey=1:noprint_wrappers=1", file_path
-            ],
-            capture_output=True, text=True, check=True,
-            preexec_fn=set_sigint_ignore
-        )
-        # Tries to get frame count from stream metadata
-        try:
-            frames = int(result.stdout.strip())
-            if frames > 0:
-                return frames
-        except ValueError:
-            pass  # Fallback to counting packets if stream data is missing
-
-        # Second attempt: count packets
-        result = subprocess.run(
-            [
-                "ffprobe", "-v", "error",
-                "-show_entries", "frame=pkt_pts_time",
-                "-select_streams", "v:0",
-                "-of", "csv=p=0", file_path
-            ],
-            capture_output=True, text=True, check=True,
-            preexec_fn=set_sigint_ignore
-        )
-        lines = result.stdout.count('\n')
-        if not lines:
+        # Last resort: count packets
+        result = yield Run(count_packets_command(file_path), "frame_count",
+                           FRAME_COUNT_TIMEOUT, check=True)
+        probe["frames"] = int(result.stdout.strip() or 0)
+        if probe["frames"] <= 0:
             return f"Error: Failed to retrieve frame data from {file_path}"
-        return lines
+        return probe
 
     except subprocess.CalledProcessError as e:
         return f"Error running ffprobe: {e}"
+    except subprocess.TimeoutExpired:
+        return f"Error: ffprobe timed out on {file_path}"
     except Exception as e:
         return f"Unexpected error: {e}"
 
 
-def threaded_frame_count(uid, data, data_lock, current_jobs):
-    """Runs frame count and updates shared data structure upon completion."""
-    input_file = data[uid]['input_file']
-    frames_or_error = get_frame_count(input_file)
+def set_frame_count_result(job: dict, probe_or_error):
+    """
+    Stores the result of a frame count on a job.
+    """
+    if type(probe_or_error) is dict:
+        # Success
+        # Store total frames in 'data'
+        job["frames"] = probe_or_error["frames"]
+        job["frames_estimated"] = probe_or_error["frames_estimated"]
+        # Codecs, resolution and streams, used when encoding
+        job["media_info"] = probe_or_error["media_info"]
+        # Duration is used by the scheduler when the policy is duration
+        if probe_or_error["duration"]:
+            job["duration"] = probe_or_error["duration"]
+        job["status"] = "ready_to_encode"  # Transition to ready
+    else:
+        # Failure
+        job["status"] = 'error'
+        job["error"] = str(probe_or_error)
 
-    # Use the lock to safely update the shared 'data' dictionary and remove job
-    with data_lock:
-        if type(frames_or_error) is int:
-            # Success
-            # Store total frames in 'data'
-            data[uid]["frames"] = frames_or_error
-            data[uid]["status"] = "ready_to_encode"  # Transition to ready
-        else:
-            # Failure
-            data[uid]["status"] = 'error'
-            data[uid]["error"] = str(frames_or_error)
-
-        # Remove the framecount job from the current_jobs list
-        job_to_remove = next((
-            j for j in current_jobs
-            if j["uid"] == uid and j["type"] == "framecount"), None
+
+def frame_count_job(uid, data, data_lock):
+    """
+    Runs frame count and updates the job upon completion.
+    Steps of a frame count job, see processes.py.
+    """
+    probe_or_error = yield from get_frame_count(data[uid]['input_file'])
+
+    # Jobs queued with the quality "auto" get a preset before they are
+    # ready to encode
+    if (type(probe_or_error) is dict
+            and data[uid]["quality"] == AUTO_QUALITY):
+        picked_or_error = yield from pick_preset(
+            data[uid]['input_file'],
+            probe_or_error["duration"],
+            data[uid]["before_size"]
         )
-        if job_to_remove:
-            current_jobs.remove(job_to_remove)
+        with data_lock:
+            if not set_picked_preset(data[uid], picked_or_error):
+                return
+
+    with data_lock:
+        set_frame_count_result(data[uid], probe_or_error)
 
 
-def create_frame_count_job(uid, data, data_lock, current_jobs):
+def create_frame_count_job(uid, data, data_lock, supervisor):
     with data_lock:
         data[uid]["status"] = 'getting_frames'
 
-        # Add job to current_jobs list
-        current_jobs.append({
-            "type": "framecount",
-            "uid": uid,
-            "thread": None  # Placeholder for thread object if needed
-        })
-
         print(f'Starting frame count for UID {uid}')
 
-        t = threading.Thread(
-            target=threaded_frame_count,
-            args=(
-                uid,
-                data,
-                data_lock,
-                current_jobs
-            ),
-            daemon=True
-        )
-        t.start()
-        # Store the thread object
-        current_jobs[-1]["thread"] = t
+        supervisor.start("framecount", uid, dict(data[uid]))
 
 
-def read_progress(proc, job, data, data_lock):
-    frame_lines = [
-        line for line in proc.stdout if line.startswith("frame=")
-    ]
+def create_encode_job(uid, data, data_lock, supervisor):
+    with data_lock:
+        data[uid]["status"] = 'encoding'
+        data[uid]["job_start_time"] = int(time.time())
+        data[uid]["encode_start_time"] = int(time.time())
+        data[uid]["resumed"] = False
 
-    for line in frame_lines:
-        try:
-            curframe = int(line.split("=")[1])
-            job["curframe"] = curframe
-            with data_lock:
-                data[job['uid']]["current_frame"] = curframe
+        # Create output folder (in the scratch folder if there is one)
+        Path(encode_path(data[uid])).parent.mkdir(
+            parents=True, exist_ok=True)
 
-        except ValueError:
-            pass
+        if data[uid]["remux"]:
+            print(f'Remuxing UID {uid} instead of encoding: '
+                  f'{data[uid]["remux"]}')
+        else:
+            print(f'Starting encoding for UID {uid}')
 
-    proc.stdout.close()
+        supervisor.start("encode", uid, dict(data[uid]))
 
 
-def create_encode_job(uid, data, data_lock, current_jobs):
+def create_verify_job(uid, data, data_lock, supervisor):
     with data_lock:
-        data[uid]["status"] = 'encoding'
-        data[uid]["job_start_time"] = int(time.time())
-        data[uid]["encode_start_time"] = int(time.time())
+        data[uid]["status"] = 'verifying'
 
-        # Create output folder
-        Path(data[uid]["encoded_file"]).parent.mkdir(
-            parents=True, exist_ok=True)
+        print(f'Starting verification for UID {uid}')
 
-        # Add job to current_jobs list
-        current_jobs.append({
-            "type": "encode",
-            "uid": uid,
-            "thread": None
-        })
-
-        print(f'Starting encoding for UID {uid}')
-
-        t = threading.Thread(
-            target=encode_video,
-            args=(
-                uid,
-                data,
-                data_lock
-            ),
-            daemon=True
-        )
-        t.start()
-        print(t)
-        current_jobs[-1]["thread"] = t
+        supervisor.start("verify", uid, dict(data[uid]))
+
+
+def create_copy_job(uid, data, data_lock, supervisor):
+    with data_lock:
+        data[uid]["status"] = 'copying'
+
+        print(f'Starting copy for UID {uid}')
+
+        supervisor.start("copy", uid, dict(data[uid]))
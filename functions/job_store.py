@@ -0,0 +1,260 @@
+'''
+An SQLite backed store for all jobs.
+The daemon is the only writer. It keeps every job in memory and only writes
+the jobs that changed since the last commit.
+The TUI and t_status.py read the same database while the daemon writes to it.
+The database runs in WAL mode so readers never block the daemon.
+'''
+
+import json
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+from pathlib import Path
+
+try:
+    from .job import Job, with_defaults
+except ImportError:
+    from job import Job, with_defaults
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    uid INTEGER PRIMARY KEY,
+    status TEXT NOT NULL,
+    job TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+'''
+
+
+def connect(db_path: Path, read_only: bool = False) -> sqlite3.Connection:
+    '''
+    Opens a connection to the job database.
+    Read only connections are used by the TUI and t_status.py.
+    '''
+    if read_only:
+        conn = sqlite3.connect(
+            f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+    return conn
+
+
+def load_jobs(db_path: Path) -> dict:
+    '''
+    Returns all jobs in the database as a dictionary of uid to job.
+    Missing fields are filled in with their defaults.
+    If the database does not exist it returns an empty dictionary.
+    '''
+    if not Path(db_path).exists():
+        return {}
+    conn = connect(db_path, read_only=True)
+    try:
+        return read_all(conn)
+    finally:
+        conn.close()
+
+
+def read_all(conn: sqlite3.Connection) -> dict:
+    '''
+    Reads every job from an open connection, ordered by uid.
+    Missing fields are filled in with their defaults.
+    '''
+    rows = conn.execute("SELECT uid, job FROM jobs ORDER BY uid")
+    return {str(uid): with_defaults(json.loads(job)) for uid, job in rows}
+
+
+class JobStore(MutableMapping):
+    '''
+    A dictionary of uid to job that is persisted to SQLite.
+    Jobs are kept in memory and indexed by status.
+    Changes are only written to disk when commit() is called and only the
+    changed jobs are written.
+    Adding and deleting jobs should happen while holding the daemon's
+    data_lock. Fields of a single job can be changed without it, the status
+    index has its own lock and each job has its own lock (job.lock).
+    '''
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._conn = connect(self.db_path)
+        self._jobs: dict[str, Job] = {}
+        self._by_status: dict[str, dict[str, None]] = {}
+        self._index_lock = threading.Lock()
+        self._dirty: set[str] = set()
+        self._deleted: set[str] = set()
+
+        rows = self._conn.execute("SELECT uid, job FROM jobs ORDER BY uid")
+        for uid, job in rows:
+            self._insert(str(uid), json.loads(job))
+
+        max_uid = self._conn.execute("SELECT MAX(uid) FROM jobs").fetchone()
+        self._next_uid = (max_uid[0] or 0) + 1
+
+    # == Status index ==
+    def _move_status(self, uid: str, old_status, new_status):
+        if old_status == new_status:
+            return
+        with self._index_lock:
+            if old_status is not None:
+                self._by_status.get(old_status, {}).pop(uid, None)
+            if new_status is not None:
+                self._by_status.setdefault(new_status, {})[uid] = None
+
+    def _insert(self, uid: str, job: dict) -> Job:
+        tracked = Job(job, uid, self)
+        self._jobs[uid] = tracked
+        self._move_status(uid, None, tracked.status)
+        return tracked
+
+    def uids_with_status(self, status: str, limit: int = None) -> list:
+        '''
+        Returns the uids of jobs with the given status, oldest first.
+        If limit is given, at most that many uids are returned.
+        '''
+        with self._index_lock:
+            uids = self._by_status.get(status, {})
+            if limit is None:
+                return list(uids)
+            result = []
+            for uid in uids:
+                if len(result) >= limit:
+                    break
+                result.append(uid)
+        return result
+
+    def count_with_status(self, status: str) -> int:
+        '''
+        Returns the number of jobs with the given status.
+        '''
+        return len(self._by_status.get(status, {}))
+
+    # == Mapping interface ==
+    def __getitem__(self, uid):
+        return self._jobs[str(uid)]
+
+    def __setitem__(self, uid, job: dict):
+        uid = str(uid)
+        if uid in self._jobs:
+            self._move_status(uid, self._jobs[uid].status, None)
+        self._insert(uid, job)
+        self._dirty.add(uid)
+        self._deleted.discard(uid)
+        self._next_uid = max(self._next_uid, int(uid) + 1)
+
+    def __delitem__(self, uid):
+        uid = str(uid)
+        job = self._jobs.pop(uid)
+        self._move_status(uid, job.status, None)
+        self._dirty.discard(uid)
+        self._deleted.add(uid)
+
+    def __iter__(self):
+        return iter(self._jobs)
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def add(self, job: dict) -> str:
+        '''
+        Adds a new job and returns its uid.
+        '''
+        uid = str(self._next_uid)
+        self[uid] = job
+        return uid
+
+    # == Persistence ==
+    def commit(self) -> bool:
+        '''
+        Writes all changed and deleted jobs in one transaction.
+        Returns True if anything was written.
+        '''
+        if not self._dirty and not self._deleted:
+            return False
+
+        # Jobs changed while this runs are picked up by the next commit
+        dirty, self._dirty = self._dirty, set()
+        rows = [
+            (int(uid), self._jobs[uid].status, self._jobs[uid].to_json())
+            for uid in dirty if uid in self._jobs
+        ]
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO jobs (uid, status, job) "
+                "VALUES (?, ?, ?)",
+                rows
+            )
+            self._conn.executemany(
+                "DELETE FROM jobs WHERE uid = ?",
+                [(int(uid),) for uid in self._deleted]
+            )
+        self._deleted.clear()
+        return True
+
+    def migrate_json(self, json_path: Path) -> int:
+        '''
+        One time migration from the old data.json file.
+        Only runs if the database is empty and the json file exists.
+        The json file is renamed to data.json.migrated afterwards.
+        Returns the number of jobs migrated.
+        '''
+        json_path = Path(json_path)
+        if self._jobs or not json_path.exists():
+            return 0
+
+        with open(json_path) as f:
+            text = f.read()
+        old_data = json.loads(text) if text.strip() else {}
+
+        for uid, job in old_data.items():
+            self[uid] = job
+        self.commit()
+
+        json_path.rename(json_path.with_name(json_path.name + ".migrated"))
+        return len(old_data)
+
+    def close(self):
+        '''
+        Commits any outstanding changes and closes the database.
+        '''
+        self.commit()
+        self._conn.close()
+
+
+class JobStoreReader:
+    '''
+    A read only view of the job database for the TUI.
+    has_changed() is cheap so it can be polled often.
+    '''
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._conn = None
+        self._data_version = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = connect(self.db_path, read_only=True)
+        return self._conn
+
+    def has_changed(self) -> bool:
+        '''
+        Returns True if the daemon committed since the last call.
+        Raises FileNotFoundError if the database does not exist yet.
+        '''
+        if not self.db_path.exists():
+            raise FileNotFoundError(self.db_path)
+        version = self._connection().execute(
+            "PRAGMA data_version").fetchone()[0]
+        changed = version != self._data_version
+        self._data_version = version
+        return changed
+
+    def load(self) -> dict:
+        '''
+        Returns all jobs as a dictionary of uid to job.
+        '''
+        return read_all(self._connection())
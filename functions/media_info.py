@@ -0,0 +1,214 @@
+"""
+Probes a media file once and remembers the result.
+One ffprobe call (-show_streams -show_format) gives everything the daemon
+needs about an input: codecs, resolution, duration, frame rate and the
+streams with their languages. The summary is stored on the job and in an
+SQLite cache keyed by path, size, mtime and inode, so files that are
+re-queued or retried are not probed again.
+"""
+
+import json
+import os
+import sqlite3
+import subprocess
+from pathlib import Path
+
+from .config import MEDIA_INFO_CACHE_PATH
+from .processes import PROBE_TIMEOUT, Run, drive
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS media_info (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    info TEXT NOT NULL
+);
+'''
+
+
+def probe_command(file_path: str) -> list:
+    """
+    ffprobe command that prints every stream and the container as JSON.
+    """
+    return [
+        "ffprobe", "-v", "error",
+        "-show_streams", "-show_format",
+        "-of", "json", file_path
+    ]
+
+
+def _number(value, number_type=float):
+    try:
+        number = number_type(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number > 0 else None
+
+
+def _frame_rate(value) -> float | None:
+    numerator, _, denominator = (value or "").partition("/")
+    frame_rate = _number(numerator)
+    if frame_rate and denominator:
+        frame_rate /= _number(denominator) or 1
+    return frame_rate
+
+
+def _bit_rate(stream: dict) -> int | None:
+    # MKVs usually only have the statistics tags mkvmerge writes
+    tags = stream.get("tags", {})
+    return _number(stream.get("bit_rate"), int) or _number(
+        tags.get("BPS") or tags.get("BPS-eng"), int)
+
+
+def summarize(probe: dict) -> dict:
+    """
+    Keeps the parts of ffprobe's output that shipper uses.
+    """
+    container = probe.get("format", {})
+    info = {
+        "container": container.get("format_name", ""),
+        "duration": _number(container.get("duration")),
+        "size": _number(container.get("size"), int),
+        "bit_rate": _number(container.get("bit_rate"), int),
+        "video": None,
+        "audio": [],
+        "subtitles": [],
+    }
+
+    for stream in probe.get("streams", []):
+        codec_type = stream.get("codec_type")
+        common = {
+            "index": stream.get("index"),
+            "codec": stream.get("codec_name", ""),
+            "language": stream.get("tags", {}).get("language", "und"),
+        }
+        if codec_type == "video" and info["video"] is None:
+            # Cover art is stored as a video stream with a single frame
+            if stream.get("disposition", {}).get("attached_pic"):
+                continue
+            info["video"] = {
+                **common,
+                "profile": stream.get("profile", ""),
+                "width": stream.get("width"),
+                "height": stream.get("height"),
+                "pix_fmt": stream.get("pix_fmt", ""),
+                "frame_rate": _frame_rate(stream.get("avg_frame_rate")),
+                "frames": _number(stream.get("nb_frames"), int),
+                "duration": _number(stream.get("duration")),
+                "bit_rate": _bit_rate(stream),
+            }
+        elif codec_type == "audio":
+            info["audio"].append({
+                **common,
+                "channels": stream.get("channels"),
+                "bit_rate": _bit_rate(stream),
+            })
+        elif codec_type == "subtitle":
+            info["subtitles"].append(common)
+    return info
+
+
+def stream_languages(info: dict, stream_type: str) -> list:
+    """
+    Returns the language of every stream of a type ("a" for audio, "s" for
+    subtitles). Streams without a language are "und".
+    """
+    streams = info["audio"] if stream_type == "a" else info["subtitles"]
+    return [stream["language"] for stream in streams]
+
+
+# == Cache ==
+def _file_key(file_path: str) -> tuple:
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+def _connect(cache_path: Path) -> sqlite3.Connection:
+    # Worker processes share the cache, so wait for each other's writes
+    conn = sqlite3.connect(cache_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def cached_media_info(file_path: str,
+                      cache_path: Path = MEDIA_INFO_CACHE_PATH
+                      ) -> dict | None:
+    """
+    Returns the cached summary of a file, or None if the file changed or
+    was never probed.
+    """
+    try:
+        key = _file_key(file_path)
+        conn = _connect(cache_path)
+        try:
+            row = conn.execute(
+                "SELECT size, mtime, inode, info FROM media_info "
+                "WHERE path = ?", (str(file_path),)
+            ).fetchone()
+        finally:
+            conn.close()
+    except (OSError, sqlite3.Error):
+        return None
+    if row is None or tuple(row[:3]) != key:
+        return None
+    return json.loads(row[3])
+
+
+def store_media_info(file_path: str, info: dict,
+                     cache_path: Path = MEDIA_INFO_CACHE_PATH):
+    """
+    Saves the summary of a file in the cache.
+    """
+    try:
+        size, mtime, inode = _file_key(file_path)
+        conn = _connect(cache_path)
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO media_info "
+                    "(path, size, mtime, inode, info) VALUES (?, ?, ?, ?, ?)",
+                    (str(file_path), size, mtime, inode, json.dumps(info))
+                )
+        finally:
+            conn.close()
+    except (OSError, sqlite3.Error) as e:
+        print(f"Failed to cache media info for {file_path}: {e}")
+
+
+def media_info_steps(file_path: str,
+                     cache_path: Path = MEDIA_INFO_CACHE_PATH):
+    """
+    Steps that return the summary of a file from the cache, or probe it.
+    Returns an error string on failure.
+    """
+    if not os.path.exists(file_path):
+        return f"Error: File not found — {file_path}"
+
+    info = cached_media_info(file_path, cache_path)
+    if info is not None:
+        return info
+
+    try:
+        result = yield Run(probe_command(file_path), "probe", PROBE_TIMEOUT,
+                           check=True)
+        info = summarize(json.loads(result.stdout))
+    except subprocess.CalledProcessError as e:
+        return f"Error running ffprobe: {e.stderr.strip() or e}"
+    except subprocess.TimeoutExpired:
+        return f"Error: ffprobe timed out on {file_path}"
+    except Exception as e:
+        return f"Unexpected error: {e}"
+
+    store_media_info(file_path, info, cache_path)
+    return info
+
+
+def get_media_info(file_path: str,
+                   cache_path: Path = MEDIA_INFO_CACHE_PATH) -> dict | str:
+    """
+    Returns the summary of a file from the cache, or probes it.
+    Returns an error string on failure.
+    """
+    return drive(media_info_steps(file_path, cache_path))
@@ -0,0 +1,193 @@
+"""
+Copies the inputs of the next jobs in line to a local cache.
+When input_dir is on a network mount, ffmpeg's decoder waits on every read
+and the encoder sits partly idle. While the current encodes run, the daemon
+copies the inputs of the next prefetch.jobs queued jobs to
+prefetch.cache_dir in background threads, keeping the cache under
+prefetch.max_size. Encodes read the local copy when it is complete
+(cached_input on the job), and it is removed once the job is encoded.
+"""
+
+import re
+import shutil
+import threading
+import uuid
+from pathlib import Path
+
+from .copier import copy_chunks, partial_path
+from .disk_stats import bytes_to_gib, check_enough_space
+from .priority import apply_priority
+
+# Jobs whose cached input may still be read
+USING_STATUSES = ("ready_to_encode", "encoding")
+
+# The folders _start makes, <uid>-<8 hex digits>. Nothing else in the cache
+# folder is touched.
+ENTRY_FOLDER = re.compile(r"\d+-[0-9a-f]{8}")
+
+
+def input_path(job) -> str:
+    """
+    The file an encode reads: the local copy if there is one.
+    """
+    return job["cached_input"] or job["input_file"]
+
+
+class PrefetchCache:
+    """
+    The local copies of queued inputs and the threads making them.
+    All methods should be called from the daemon's main thread.
+    """
+
+    def __init__(self, cache_dir: Path, max_size: int, parallel: int = 1,
+                 buffer: int = 0):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self.parallel = parallel
+        self.buffer = buffer
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # uid -> path, size, done, error and the event that stops the copy
+        self.entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def load(self, data):
+        """
+        Keeps the finished copies of jobs that are still waiting and removes
+        the other copies left in the cache by an earlier run.
+        """
+        for uid, job in data.items():
+            cached = job["cached_input"]
+            if not cached:
+                continue
+            if (job["status"] in USING_STATUSES and Path(cached).exists()
+                    and Path(cached).stat().st_size == job["before_size"]):
+                self.entries[uid] = self._entry(Path(cached), done=True)
+            else:
+                job["cached_input"] = ""
+        kept = {entry["path"].parent for entry in self.entries.values()}
+        for folder in self.cache_dir.iterdir():
+            if (folder not in kept and folder.is_dir()
+                    and ENTRY_FOLDER.fullmatch(folder.name)):
+                shutil.rmtree(folder, ignore_errors=True)
+
+    @staticmethod
+    def _entry(path: Path, done: bool = False) -> dict:
+        return {
+            "path": path,
+            "size": path.stat().st_size if done else 0,
+            "done": done,
+            "error": "",
+            "stop": threading.Event(),
+        }
+
+    def size(self) -> int:
+        """
+        The space the cache uses, or will use once every copy finishes.
+        """
+        return sum(entry["size"] for entry in self.entries.values())
+
+    def update(self, data, next_uids: list):
+        """
+        Removes copies that are no longer needed, hands finished ones to
+        their jobs and starts copying the inputs of next_uids.
+        """
+        with self._lock:
+            for uid, entry in list(self.entries.items()):
+                job = data.get(uid)
+                if job is None or job["status"] not in USING_STATUSES:
+                    self._remove(uid, data)
+                elif not entry["done"] and job["status"] == "encoding":
+                    # The encode started reading the original already
+                    self._remove(uid, data)
+                elif entry["error"]:
+                    print(f"Prefetch of UID {uid} failed: {entry['error']}")
+                    self._remove(uid, data)
+                elif (entry["done"] and not job["cached_input"]
+                        and job["status"] == "ready_to_encode"):
+                    job["cached_input"] = str(entry["path"])
+
+            running = sum(
+                not entry["done"] for entry in self.entries.values())
+            for uid in next_uids:
+                if running >= self.parallel:
+                    break
+                if uid in self.entries:
+                    continue
+                if not self._make_room(data, data[uid]["before_size"],
+                                       next_uids):
+                    break
+                self._start(uid, data[uid])
+                running += 1
+
+    def _make_room(self, data, size: int, next_uids: list) -> bool:
+        """
+        Removes finished copies of jobs further back in line until size
+        bytes fit. Returns False if they do not.
+        """
+        if size > self.max_size:
+            return False
+        spare = [
+            uid for uid, entry in self.entries.items()
+            if entry["done"] and uid not in next_uids
+            and data[uid]["status"] != "encoding"
+        ]
+        while self.size() + size > self.max_size and spare:
+            self._remove(spare.pop(), data)
+        return (self.size() + size <= self.max_size
+                and check_enough_space(self.cache_dir, self.buffer, size))
+
+    def _start(self, uid: str, job):
+        source = job["input_file"]
+        # Every attempt gets its own folder, a stopped copy of the same job
+        # may still be running and removes its folder when it notices
+        folder = self.cache_dir / f"{uid}-{uuid.uuid4().hex[:8]}"
+        path = folder / Path(source).name
+        entry = self._entry(path)
+        entry["size"] = job["before_size"]
+        self.entries[uid] = entry
+        print(f"Prefetching UID {uid} "
+              f"({bytes_to_gib(entry['size']):.1f} GiB) to {path}")
+        threading.Thread(
+            target=self._copy, args=(source, entry), daemon=True).start()
+
+    def _copy(self, source: str, entry: dict):
+        apply_priority("prefetch")
+        path = entry["path"]
+        partial = partial_path(path)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            chunks = copy_chunks(source, partial)
+            for _ in chunks:
+                if entry["stop"].is_set():
+                    chunks.close()
+                    shutil.rmtree(path.parent, ignore_errors=True)
+                    return
+            partial.rename(path)
+        except OSError as e:
+            shutil.rmtree(path.parent, ignore_errors=True)
+            with self._lock:
+                entry["error"] = str(e)
+            return
+        with self._lock:
+            # Stopped while the copy was being finished
+            if entry["stop"].is_set():
+                shutil.rmtree(path.parent, ignore_errors=True)
+            else:
+                entry["done"] = True
+
+    def _remove(self, uid: str, data):
+        entry = self.entries.pop(uid)
+        # A running copy removes its own partial file when it stops
+        entry["stop"].set()
+        if entry["done"]:
+            shutil.rmtree(entry["path"].parent, ignore_errors=True)
+        if uid in data and data[uid]["cached_input"]:
+            data[uid]["cached_input"] = ""
+
+    def stop(self):
+        """
+        Stops every copy that is running.
+        """
+        with self._lock:
+            for entry in self.entries.values():
+                entry["stop"].set()
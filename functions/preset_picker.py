@@ -0,0 +1,245 @@
+"""
+Picks a quality preset for jobs queued with the quality "auto".
+A few short samples spread over the input are encoded with every candidate
+preset. Each preset's speed, projected output size and (optionally) SSIM or
+PSNR against the original are measured, and the fastest preset that meets
+the target in config.json (preset_picker) is used for the job.
+Runs in the frame count stage, before the job is ready to encode.
+"""
+
+import re
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from .audio import parse_bitrate
+from .config import load_config
+from .encoders import video_args
+from .processes import FRAME_COUNT_TIMEOUT, Run
+
+CONFIG = load_config()
+
+AUTO_QUALITY = "auto"
+
+METRIC_PATTERNS = {
+    # [Parsed_ssim_0 @ 0x...] SSIM Y:0.991 (20.5) U:... V:... All:0.989 (19.7)
+    "ssim": re.compile(r"SSIM .*All:([\d.]+)"),
+    # [Parsed_psnr_0 @ 0x...] PSNR y:41.2 u:... v:... average:42.0 min:...
+    "psnr": re.compile(r"PSNR .*average:([\d.]+|inf)"),
+}
+
+
+def sample_times(duration: float, samples: int,
+                 sample_length: float) -> list:
+    """
+    Returns the start of every sample, spread evenly over the video.
+    Short videos get one sample from the start.
+    """
+    if not duration or duration <= samples * sample_length:
+        return [0]
+    return [
+        round(duration * (i + 1) / (samples + 1) - sample_length / 2, 3)
+        for i in range(samples)
+    ]
+
+
+def sample_encode_command(input_file: str, start: float, length: float,
+                          quality: dict, encoded: Path) -> list:
+    """
+    ffmpeg command that encodes the video of one sample with a preset.
+    """
+    return [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+        "-ss", str(start), "-t", str(length),
+        "-i", input_file,
+        "-map", "0:v:0",
+        *video_args(quality),
+        "-an", "-sn",
+        str(encoded)
+    ]
+
+
+def metric_command(input_file: str, start: float, length: float,
+                   encoded: Path, metric: str) -> list:
+    """
+    ffmpeg command that compares an encoded sample with the original.
+    The result is logged to stderr.
+    """
+    return [
+        "ffmpeg", "-hide_banner", "-nostats",
+        "-ss", str(start), "-t", str(length),
+        "-i", input_file,
+        "-i", str(encoded),
+        "-lavfi", f"[1:v:0][0:v:0]{metric}",
+        "-f", "null", "-"
+    ]
+
+
+def parse_metric(output: str, metric: str) -> float | None:
+    """
+    Reads the SSIM (All) or average PSNR from ffmpeg's log.
+    """
+    match = METRIC_PATTERNS[metric].search(output)
+    if not match:
+        return None
+    return float(match.group(1))
+
+
+def audio_bytes(quality: dict, duration: float) -> float:
+    """
+    Roughly how much the re-encoded audio adds to the output.
+    """
+    return (parse_bitrate(quality.get("bitrate", "0")) or 0) * duration / 8
+
+
+def summarize_samples(quality: dict, samples: list, duration: float,
+                      before_size: int) -> dict:
+    """
+    Combines the samples of one preset.
+    samples is a list of (seconds of video, encode seconds, bytes, metric).
+    """
+    seconds = sum(sample[0] for sample in samples)
+    encode_seconds = sum(sample[1] for sample in samples)
+    size = sum(sample[2] for sample in samples)
+    size_ratio = None
+    if duration and before_size:
+        projected = (size / seconds * duration
+                     + audio_bytes(quality, duration))
+        size_ratio = projected / before_size
+    scores = [sample[3] for sample in samples if sample[3] is not None]
+    return {
+        "speed": seconds / encode_seconds if encode_seconds else None,
+        "size_ratio": size_ratio,
+        "score": sum(scores) / len(scores) if scores else None,
+    }
+
+
+def choose_preset(measurements: dict, target: str, max_size_ratio: float,
+                  min_quality: float) -> str:
+    """
+    Returns the fastest preset that meets the target. If none does, the
+    preset that comes closest (smallest or best looking) is returned.
+    """
+    def meets(result: dict) -> bool:
+        if target == "quality":
+            return (result["score"] is not None
+                    and result["score"] >= min_quality)
+        return (result["size_ratio"] is not None
+                and result["size_ratio"] <= max_size_ratio)
+
+    by_speed = sorted(measurements, key=lambda name: -(
+        measurements[name]["speed"] or 0))
+    for name in by_speed:
+        if meets(measurements[name]):
+            return name
+
+    if target == "quality":
+        return max(by_speed, key=lambda name: (
+            measurements[name]["score"] or 0))
+    return min(by_speed, key=lambda name: (
+        measurements[name]["size_ratio"] or float("inf")))
+
+
+def candidate_presets() -> dict:
+    presets = CONFIG.quality_presets
+    names = CONFIG.preset_picker_candidates or list(presets)
+    return {name: presets[name] for name in names if name in presets}
+
+
+def picker_metric() -> str:
+    """
+    The quality metric to measure, the quality target always needs one.
+    """
+    if CONFIG.preset_picker_target == "quality":
+        return CONFIG.preset_picker_metric or "ssim"
+    return CONFIG.preset_picker_metric
+
+
+def sample_plan(duration: float) -> tuple[float, list]:
+    """
+    Returns how long each sample is and where they start.
+    """
+    length = CONFIG.preset_picker_sample_length
+    if duration and duration < length:
+        length = duration
+    return length, sample_times(
+        duration, CONFIG.preset_picker_samples, length)
+
+
+def finish_pick(measurements: dict) -> tuple[str, dict] | str:
+    """
+    Chooses from the measurements of every preset.
+    """
+    if not measurements:
+        return "No presets to pick from (preset_picker.candidates)"
+    chosen = choose_preset(
+        measurements,
+        CONFIG.preset_picker_target,
+        CONFIG.preset_picker_max_size_ratio,
+        CONFIG.preset_picker_min_quality
+    )
+    return chosen, measurements
+
+
+def pick_preset(input_file: str, duration: float,
+                before_size: int):
+    """
+    Steps that encode the samples with every candidate preset and return
+    the chosen preset with the measurements, or an error string.
+    """
+    length, starts = sample_plan(duration)
+    metric = picker_metric()
+    measurements = {}
+
+    with tempfile.TemporaryDirectory(prefix="shipper-samples-") as work_dir:
+        for name, quality in candidate_presets().items():
+            samples = []
+            for no, start in enumerate(starts):
+                encoded = Path(work_dir) / f"{name}-{no}.mkv"
+                began = time.monotonic()
+                try:
+                    result = yield Run(
+                        sample_encode_command(
+                            input_file, start, length, quality, encoded),
+                        "frame_count", FRAME_COUNT_TIMEOUT)
+                    took = time.monotonic() - began
+                    if result.returncode != 0:
+                        return (f"Sample encode with {name} failed: "
+                                f"{result.stderr.strip()}")
+
+                    score = None
+                    if metric:
+                        result = yield Run(
+                            metric_command(
+                                input_file, start, length, encoded, metric),
+                            "frame_count", FRAME_COUNT_TIMEOUT)
+                        score = parse_metric(result.stderr, metric)
+                except subprocess.TimeoutExpired:
+                    return f"Error: sample encode with {name} timed out"
+                samples.append(
+                    (length, took, encoded.stat().st_size, score))
+
+            measurements[name] = summarize_samples(
+                quality, samples, duration, before_size)
+    return finish_pick(measurements)
+
+
+def set_picked_preset(job: dict, picked_or_error) -> bool:
+    """
+    Stores the chosen preset on a job. Returns False on an error.
+    """
+    if type(picked_or_error) is str:
+        job["status"] = "error"
+        job["error"] = picked_or_error
+        return False
+    chosen, measurements = picked_or_error
+    job["quality"] = chosen
+    job["preset_samples"] = {
+        "target": CONFIG.preset_picker_target,
+        "metric": picker_metric(),
+        "chosen": chosen,
+        "presets": measurements,
+    }
+    print(f"Picked preset {chosen} for {job['input_file']}")
+    return True
@@ -0,0 +1,138 @@
+"""
+CPU and I/O priority of the work each stage does.
+The ffprobe and ffmpeg processes of every stage (probe, frame_count, encode,
+verify) are started with the stage's nice value, I/O scheduling class
+(ionice) and optionally SCHED_IDLE, set in config.json (priority), so shipper
+gives way to Plex streaming from the same machine. The copy and prefetch stages copy
+in Python, so their class is applied to the thread that copies.
+Stages without settings run at the daemon's own priority.
+"""
+
+import ctypes
+import os
+import platform
+import signal
+
+from .config import load_config
+
+CONFIG = load_config()
+
+STAGES = ("probe", "frame_count", "encode", "copy", "prefetch", "verify")
+
+IOPRIO_CLASSES = {"realtime": 1, "best_effort": 2, "idle": 3}
+
+# ioprio_set is not in the os module, it is called through libc by number
+IOPRIO_SYSCALLS = {
+    "x86_64": 251,
+    "i386": 289,
+    "i686": 289,
+    "aarch64": 30,
+    "armv7l": 314,
+    "riscv64": 30,
+}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+
+
+def _ioprio_set():
+    """
+    Returns a function that sets the calling thread's I/O priority, or None
+    if this platform does not have ioprio_set.
+    """
+    number = IOPRIO_SYSCALLS.get(platform.machine())
+    if number is None or platform.system() != "Linux":
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+    except OSError:
+        return None
+
+    def ioprio_set(io_class: int, level: int) -> bool:
+        value = (io_class << IOPRIO_CLASS_SHIFT) | level
+        return libc.syscall(number, IOPRIO_WHO_PROCESS, 0, value) == 0
+    return ioprio_set
+
+
+IOPRIO_SET = _ioprio_set()
+
+
+def stage_priority(stage: str) -> dict:
+    return CONFIG.priority.get(stage) or {}
+
+
+def _apply(settings: dict):
+    # Also runs in forked children before exec, so nothing here may raise.
+    # Lowering the priority always works, raising it needs root.
+    if settings.get("nice") is not None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, int(settings["nice"]))
+        except (OSError, ValueError):
+            pass
+    io_class = IOPRIO_CLASSES.get(settings.get("ionice"))
+    if io_class and IOPRIO_SET:
+        # The idle class has no levels
+        level = 0 if io_class == 3 else settings.get("ionice_level", 4)
+        if isinstance(level, int) and 0 <= level <= 7:
+            IOPRIO_SET(io_class, level)
+    if settings.get("sched_idle") and hasattr(os, "SCHED_IDLE"):
+        try:
+            os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+        except OSError:
+            pass
+
+
+def apply_priority(stage: str):
+    """
+    Gives the calling thread (on Linux each thread has its own) the
+    priority of a stage.
+    """
+    _apply(stage_priority(stage))
+
+
+def child_setup(stage: str):
+    """
+    Returns the preexec_fn for the processes a stage starts. Children ignore
+    SIGINT, Ctrl+C is handled by the daemon, and get the stage's priority.
+    """
+    settings = stage_priority(stage)
+
+    def setup():
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        _apply(settings)
+    return setup
+
+
+def validate_priorities(priority: dict) -> list:
+    """
+    Returns what is wrong with the priority settings.
+    """
+    errors = []
+    for stage, settings in priority.items():
+        if stage not in STAGES:
+            errors.append(f"{stage}: unknown stage, use one of "
+                          f"{', '.join(STAGES)}")
+            continue
+        nice = settings.get("nice")
+        if nice is not None and not (
+                isinstance(nice, int) and -20 <= nice <= 19):
+            errors.append(f"{stage}: nice must be a number from -20 to 19")
+        ionice = settings.get("ionice")
+        if ionice and ionice not in IOPRIO_CLASSES:
+            errors.append(f"{stage}: ionice must be one of "
+                          f"{', '.join(IOPRIO_CLASSES)}")
+        elif ionice and IOPRIO_SET is None:
+            errors.append(f"{stage}: ionice is not supported on "
+                          f"{platform.system()} {platform.machine()}")
+        level = settings.get("ionice_level", 4)
+        if not (isinstance(level, int) and 0 <= level <= 7):
+            errors.append(f"{stage}: ionice_level must be from 0 to 7")
+    return errors
+
+
+def check_priorities(priority: dict):
+    """
+    Prints what is wrong with the priority settings. Nothing here stops
+    shipper, settings that can not be applied are skipped.
+    """
+    for error in validate_priorities(priority):
+        print(f"Warning: priority.{error}")
@@ -0,0 +1,232 @@
+"""
+Starts the ffprobe and ffmpeg processes of jobs.
+Jobs are written as generators of steps: they yield a request (Run, Stream,
+Parallel or Blocking) whenever they need a process or a blocking copy, and
+get its result back, so the same job code works with both worker backends.
+drive() runs the steps of a job with blocking calls, inside a worker process
+(supervisor.py). The asyncio backend (async_supervisor.py) runs the same
+steps with asyncio subprocesses instead.
+A request that fails raises its error inside the job, where the yield is.
+"""
+
+import os
+import selectors
+import subprocess
+import threading
+import time
+from typing import Callable, Generator, Iterable, NamedTuple
+
+from .priority import apply_priority, child_setup
+
+# How long a quick ffprobe call may take (seconds)
+PROBE_TIMEOUT = 300
+
+# How long reading through a whole file may take (seconds)
+FRAME_COUNT_TIMEOUT = 3600
+
+
+class JobCancelled(Exception):
+    """
+    Raised in a Blocking step of a job that was cancelled.
+    """
+
+
+class Run(NamedTuple):
+    """
+    Runs a command until it exits, with the output captured as text.
+    The result is a subprocess.CompletedProcess. Raises
+    subprocess.TimeoutExpired after timeout seconds, and
+    subprocess.CalledProcessError if check is set and the command failed.
+    """
+    command: list
+    stage: str
+    timeout: float | None = None
+    check: bool = False
+
+
+class Stream(NamedTuple):
+    """
+    Runs a command and calls on_line with every line it writes to stdout.
+    The last lines of stderr are added to warnings (a deque). The result is
+    the return code. Raises TimeoutError if nothing is written to stdout
+    for stall_timeout seconds.
+    """
+    command: list
+    stage: str
+    on_line: Callable[[str], None]
+    warnings: object
+    stall_timeout: float
+
+
+class Parallel(NamedTuple):
+    """
+    Runs the steps of several generators, at most limit at once. A new
+    generator is taken from steps whenever one finishes. The result is a
+    list of what they returned, in the order they finished.
+    """
+    steps: Iterable[Generator]
+    limit: int
+
+
+class Blocking(NamedTuple):
+    """
+    Calls function(cancelled) with the priority of a stage, for work done
+    in Python such as copies. cancelled is a threading.Event that is set
+    when the job is cancelled, the function should then raise JobCancelled.
+    """
+    function: Callable
+    stage: str
+
+
+def popen(command: list, stage: str, **kwargs) -> subprocess.Popen:
+    """
+    subprocess.Popen with the priority of a stage.
+    """
+    return subprocess.Popen(command, preexec_fn=child_setup(stage), **kwargs)
+
+
+def run(command: list, stage: str, timeout: float | None = None,
+        check: bool = False) -> subprocess.CompletedProcess:
+    """
+    subprocess.run with the output captured as text and the priority of a
+    stage. Raises subprocess.TimeoutExpired after timeout seconds, the
+    process is killed first.
+    """
+    process = popen(command, stage, stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE, text=True)
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except BaseException:
+        process.kill()
+        process.communicate()
+        raise
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(
+            process.returncode, command, stdout, stderr)
+    return subprocess.CompletedProcess(
+        command, process.returncode, stdout, stderr)
+
+
+def _lines(buffer: bytes, chunk: bytes) -> tuple[list, bytes]:
+    """
+    Splits what was read so far into whole lines and the rest.
+    """
+    *lines, rest = (buffer + chunk).split(b"\n")
+    return [line.decode(errors="replace") for line in lines], rest
+
+
+def stream(request: Stream) -> int:
+    """
+    Runs a Stream request. stdout and stderr are read in this thread, so
+    neither blocks the other.
+    """
+    process = popen(request.command, request.stage,
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    selector = selectors.DefaultSelector()
+    buffers = {process.stdout: b"", process.stderr: b""}
+    for pipe in buffers:
+        selector.register(pipe, selectors.EVENT_READ)
+
+    def emit(pipe, lines: list):
+        for line in lines:
+            if pipe is process.stdout:
+                request.on_line(line)
+            elif line.strip():
+                request.warnings.append(line.strip())
+
+    last_line = time.monotonic()
+    try:
+        while selector.get_map():
+            waited = time.monotonic() - last_line
+            if waited > request.stall_timeout:
+                raise TimeoutError(
+                    f"ffmpeg made no progress for "
+                    f"{request.stall_timeout}s")
+            for key, _ in selector.select(request.stall_timeout - waited):
+                pipe = key.fileobj
+                chunk = os.read(pipe.fileno(), 65536)
+                if not chunk:
+                    selector.unregister(pipe)
+                    if buffers[pipe]:
+                        emit(pipe, [buffers[pipe].decode(errors="replace")])
+                    pipe.close()
+                    continue
+                if pipe is process.stdout:
+                    last_line = time.monotonic()
+                lines, buffers[pipe] = _lines(buffers[pipe], chunk)
+                emit(pipe, lines)
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        selector.close()
+    return process.wait()
+
+
+def parallel(request: Parallel) -> list:
+    """
+    Runs a Parallel request with a thread per running generator.
+    """
+    steps = iter(request.steps)
+    lock = threading.Lock()
+    results = []
+    errors = []
+
+    def lane():
+        while not errors:
+            with lock:
+                job = next(steps, None)
+            if job is None:
+                return
+            try:
+                results.append(drive(job))
+            except Exception as e:
+                errors.append(e)
+
+    threads = [
+        threading.Thread(target=lane) for _ in range(max(1, request.limit))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def handle(request):
+    """
+    Runs one request of a job with blocking calls and returns its result.
+    """
+    if isinstance(request, Run):
+        return run(*request)
+    if isinstance(request, Stream):
+        return stream(request)
+    if isinstance(request, Parallel):
+        return parallel(request)
+    if isinstance(request, Blocking):
+        # Only used in worker processes, which do one job each
+        apply_priority(request.stage)
+        return request.function(threading.Event())
+    raise TypeError(f"Unknown step {request!r}")
+
+
+def drive(steps: Generator):
+    """
+    Runs the steps of a job and returns what the job returns.
+    """
+    result, error = None, None
+    while True:
+        try:
+            if error is not None:
+                request = steps.throw(error)
+            else:
+                request = steps.send(result)
+        except StopIteration as done:
+            return done.value
+        try:
+            result, error = handle(request), None
+        except Exception as e:
+            result, error = None, e
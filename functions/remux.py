@@ -0,0 +1,66 @@
+"""
+Decides whether a job is worth encoding.
+Inputs that are already in an efficient codec at a low bitrate, or that
+earlier encodes say would barely shrink, are remuxed instead: the streams
+are copied into the output (in the Plex layout) without re-encoding. Each
+quality preset sets its own thresholds with a "remux" object in
+config.json. Presets without one always encode.
+"""
+
+from .throughput import video_class
+
+# max_bitrate is for 1080p, other resolutions are scaled by pixel count
+REFERENCE_PIXELS = 1920 * 1080
+
+
+def video_bitrate(info: dict) -> float | None:
+    """
+    Returns the bitrate of the video stream in kbit/s. MKVs often only
+    store the bitrate of the whole file, which is used instead.
+    """
+    bit_rate = (info.get("video") or {}).get("bit_rate") or info.get(
+        "bit_rate")
+    return bit_rate / 1000 if bit_rate else None
+
+
+def remux_reason(job, quality: dict, model) -> str:
+    """
+    Returns why a job should be remuxed, or a blank string if it should
+    be encoded.
+    model is a ThroughputModel, used to estimate the saving of an encode.
+    """
+    remux = quality.get("remux")
+    info = job["media_info"]
+    if not remux or not info or not info.get("video"):
+        return ""
+    codec = info["video"]["codec"]
+    if codec not in remux.get("codecs", []):
+        return ""
+
+    bitrate = video_bitrate(info)
+    if bitrate and remux.get("max_bitrate"):
+        pixels = (info["video"]["width"] or 0) * (
+            info["video"]["height"] or 0)
+        max_bitrate = remux["max_bitrate"] * (
+            pixels / REFERENCE_PIXELS if pixels else 1)
+        if bitrate <= max_bitrate:
+            return (f"{codec} at {bitrate:.0f} kbit/s is below "
+                    f"{max_bitrate:.0f} kbit/s")
+
+    # Earlier encodes of the same preset, input codec and resolution. Other
+    # codecs compress differently, so there is no fallback.
+    prediction = model.predict(job["quality"], *video_class(info), exact=True)
+    if prediction and remux.get("min_saving"):
+        saving = 1 - prediction["ratio"]
+        if saving < remux["min_saving"]:
+            return (f"encoding {codec} with this preset saves about "
+                    f"{saving:.0%}, less than {remux['min_saving']:.0%}")
+    return ""
+
+
+def set_remux_decision(uid: str, job, presets: dict, model):
+    """
+    Decides if a job that is about to start is remuxed, stored in the
+    job's remux field.
+    """
+    job["remux"] = remux_reason(job, presets.get(job["quality"], {}), model)
@@ -0,0 +1,417 @@
+"""
+Encodes one long file on several cores at once.
+The video stream is split into segments at keyframes, the segments are encoded
+by several ffmpeg processes in parallel and the results are joined without
+re-encoding. Audio and subtitles are taken from the input while joining, using
+the stream maps compressor.py chose.
+A single encoder process does not scale well past a certain number of
+threads, so this mostly helps long (4K) movies on machines with many cores.
+Finished segments are recorded in a manifest, so an encode that is
+interrupted (crash, restart or quick stop) only redoes the unfinished segments.
+"""
+
+import collections
+import json
+import os
+import shutil
+import subprocess
+import threading
+from pathlib import Path
+
+from .command_runner import (
+    WARNING_LINES, apply_progress, combine_progress, progress_steps
+)
+from .audio import audio_args
+from .copier import encode_path
+from .encoders import video_args
+from .prefetch import input_path
+from .processes import FRAME_COUNT_TIMEOUT, Parallel, Run
+
+# Splitting and joining copy the whole video, from a NAS for long 4K titles.
+# They may take FRAME_COUNT_TIMEOUT plus a second for every
+# COPY_TIMEOUT_RATE bytes of input (about 10 MB/s).
+COPY_TIMEOUT_RATE = 10 * 2**20
+
+
+def use_segments(duration: float, enabled: bool, min_duration: float) -> bool:
+    """
+    Returns True if a file is long enough to be encoded in segments.
+    """
+    return enabled and bool(duration) and duration >= min_duration
+
+
+def segment_dir(encoded_file: str) -> Path:
+    """
+    The folder segments are kept in while encoding, next to the output.
+    """
+    encoded_file = Path(encoded_file)
+    return encoded_file.with_name(f".{encoded_file.stem}.segments")
+
+
+def remove_segments(encoded_file: str):
+    """
+    Removes the segments of a job that will not be resumed.
+    """
+    shutil.rmtree(segment_dir(encoded_file), ignore_errors=True)
+
+
+def segment_settings(input_file: str, quality: dict,
+                     segment_length: float) -> dict:
+    """
+    Everything the segments depend on. If any of it changes the segments
+    can not be reused.
+    """
+    stat = os.stat(input_file)
+    return {
+        "input_file": input_file,
+        "input_size": stat.st_size,
+        "input_mtime": stat.st_mtime_ns,
+        "quality": quality,
+        "segment_length": segment_length,
+    }
+
+
+def save_manifest(work_dir: Path, manifest: dict):
+    """
+    Writes the manifest so it survives a crash or power loss.
+    """
+    temp_file = work_dir / "manifest.json.tmp"
+    with open(temp_file, "w") as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, work_dir / "manifest.json")
+
+
+def prepare_work_dir(work_dir: Path, settings: dict,
+                     resume: bool) -> dict | None:
+    """
+    Returns the manifest of an earlier attempt if its segments can be reused.
+    Otherwise the folder is emptied and None is returned.
+    """
+    if resume:
+        try:
+            with open(work_dir / "manifest.json") as f:
+                manifest = json.load(f)
+            if (manifest["settings"] == settings and all(
+                    (work_dir / name).exists()
+                    for name in manifest["sources"])):
+                # Segments that were still being encoded are redone
+                for partial in work_dir.glob("*.partial.mkv"):
+                    partial.unlink()
+                return manifest
+        except (OSError, ValueError, KeyError):
+            pass
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+    work_dir.mkdir(parents=True)
+    return None
+
+
+def encoded_segment(work_dir: Path, source_name: str,
+                    partial: bool = False) -> Path:
+    name = source_name.replace("source-", "encoded-")
+    if partial:
+        name = name.replace(".mkv", ".partial.mkv")
+    return work_dir / name
+
+
+def mark_segment_done(work_dir: Path, manifest: dict, index: int,
+                      frames: int):
+    """
+    Moves a finished segment into place and records it in the manifest.
+    """
+    source_name = manifest["sources"][index]
+    partial = encoded_segment(work_dir, source_name, partial=True)
+    with open(partial, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(partial, encoded_segment(work_dir, source_name))
+    manifest["done"][str(index)] = frames
+    save_manifest(work_dir, manifest)
+
+
+def new_manifest(work_dir: Path, settings: dict) -> dict:
+    """
+    Records the segments the input was split into.
+    """
+    manifest = {
+        "settings": settings,
+        "sources": sorted(
+            source.name for source in work_dir.glob("source-*.mkv")),
+        "done": {},
+    }
+    save_manifest(work_dir, manifest)
+    return manifest
+
+
+def segment_times(duration: float, segment_length: float) -> list:
+    """
+    Returns the times (in seconds) the video should be split at.
+    ffmpeg splits at the first keyframe after each time.
+    """
+    times = []
+    time = segment_length
+    # Do not make a tiny last segment
+    while time < duration - segment_length / 2:
+        times.append(round(time, 3))
+        time += segment_length
+    return times
+
+
+def split_command(input_file: str, times: list, work_dir: Path) -> list:
+    """
+    ffmpeg command that copies the video stream into segments.
+    """
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+        "-i", input_file,
+        "-map", "0:v:0",
+        "-c", "copy",
+        "-f", "segment",
+        "-reset_timestamps", "1",
+    ]
+    if times:
+        cmd.extend(["-segment_times", ",".join(str(t) for t in times)])
+    cmd.append(str(work_dir / "source-%04d.mkv"))
+    return cmd
+
+
+def segment_encode_command(
+    source: Path,
+    encoded: Path,
+    quality: dict,
+    threads: int
+) -> list:
+    """
+    ffmpeg command that encodes the video of one segment.
+    threads limits the number of threads the encoder uses.
+    """
+    return [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+        "-progress", "pipe:1",
+        "-i", str(source),
+        "-map", "0:v:0",
+        *video_args(quality, threads),
+        str(encoded)
+    ]
+
+
+def concat_command(
+    list_file: Path,
+    input_file: str,
+    encoded_file: str,
+    quality: dict,
+    audio_map: str,
+    subtitle_map: str,
+    audio_plan: list = None
+) -> list:
+    """
+    ffmpeg command that joins the encoded segments and adds the audio and
+    subtitles from the original input.
+    """
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-i", str(list_file),
+        "-i", input_file,
+        "-map", "0:v:0",
+    ]
+    # The stream maps refer to the input as 0, here it is the second input
+    for stream_map in (audio_map, subtitle_map):
+        if stream_map:
+            cmd.extend(stream_map.replace("-map 0:", "-map 1:").split())
+
+    cmd.extend([
+        "-c:v", "copy",
+        *audio_args(audio_plan, quality['bitrate']),
+        "-c:s", "copy",
+        "-fflags", "+genpts",
+        encoded_file
+    ])
+    return cmd
+
+
+def write_concat_list(work_dir: Path, encoded_segments: list) -> Path:
+    """
+    Writes the file list used by ffmpeg's concat demuxer.
+    """
+    list_file = work_dir / "segments.txt"
+    with open(list_file, "w") as f:
+        for segment in encoded_segments:
+            path = str(segment.resolve()).replace("'", "'\\''")
+            f.write(f"file '{path}'\n")
+    return list_file
+
+
+def segment_progress(frames: int, out_time_us: int | None) -> dict:
+    """
+    Progress of a segment that is not being encoded right now.
+    out_time_us is None if it is not known (segments finished by an earlier
+    attempt), the ETA then goes by frames.
+    """
+    return {
+        "frame": frames,
+        "fps": None,
+        "bitrate": None,
+        "total_size": None,
+        "out_time_us": out_time_us,
+        "speed": None,
+    }
+
+
+def threads_per_segment(parallel: int) -> int:
+    return max(1, (os.cpu_count() or 1) // parallel)
+
+
+def copy_timeout(size: int) -> float:
+    """
+    How long splitting or joining a file of size bytes may take (seconds).
+    """
+    return FRAME_COUNT_TIMEOUT + (size or 0) / COPY_TIMEOUT_RATE
+
+
+def run_segmented_encode(
+    uid,
+    data,
+    data_lock,
+    quality,
+    audio_map,
+    subtitle_map,
+    segment_length: float,
+    parallel: int,
+    resume: bool = True
+):
+    """
+    Steps that encode a job in segments, parallel at a time.
+    If resume is True, segments finished by an earlier attempt are reused
+    and the segments are kept when the encode fails.
+    Has the same result as run_ffmpeg_encode: ffmpeg's return code, or
+    False if the encode could not be done.
+    """
+    with data_lock:
+        input_file = data[uid]["input_file"]
+        # The local copy is read if the input was prefetched
+        source = input_path(data[uid])
+        encoded_file = encode_path(data[uid])
+        duration = data[uid]["duration"]
+        audio_plan = data[uid]["audio_streams"]
+        timeout = copy_timeout(data[uid]["before_size"])
+
+    work_dir = segment_dir(encoded_file)
+    settings = segment_settings(input_file, quality, segment_length)
+    manifest = prepare_work_dir(work_dir, settings, resume)
+    succeeded = False
+
+    def fail(error: str):
+        with data_lock:
+            data[uid]["status"] = "error"
+            data[uid]["error"] = error
+        return False
+
+    try:
+        # 1. Split the video at keyframes
+        if manifest is None:
+            try:
+                result = yield Run(
+                    split_command(
+                        source, segment_times(duration, segment_length),
+                        work_dir),
+                    "encode", timeout)
+            except subprocess.TimeoutExpired:
+                return fail("Failed to split video: timed out")
+            if result.returncode != 0:
+                return fail(
+                    f"Failed to split video: {result.stderr.strip()}")
+            manifest = new_manifest(work_dir, settings)
+        else:
+            print(f"Resuming UID {uid}, {len(manifest['done'])} of "
+                  f"{len(manifest['sources'])} segments already encoded")
+            with data_lock:
+                data[uid]["resumed"] = bool(manifest["done"])
+
+        sources = [work_dir / name for name in manifest["sources"]]
+        blocks = [
+            segment_progress(manifest["done"][str(index)], None)
+            if str(index) in manifest["done"] else segment_progress(0, 0)
+            for index in range(len(sources))
+        ]
+        remaining = [
+            index for index in range(len(sources))
+            if str(index) not in manifest["done"]
+        ]
+        print(f"Encoding UID {uid} in {len(sources)} segments, "
+              f"{parallel} at a time")
+
+        # 2. Encode the remaining segments in parallel
+        errors = []
+        segment_lock = threading.Lock()
+
+        def encode_segment(index: int):
+            warnings = collections.deque(maxlen=WARNING_LINES)
+
+            def on_progress(progress):
+                with data_lock:
+                    blocks[index] = progress
+                    apply_progress(data[uid], combine_progress(blocks))
+
+            try:
+                returncode, parser = yield from progress_steps(
+                    segment_encode_command(
+                        sources[index],
+                        encoded_segment(
+                            work_dir, sources[index].name, partial=True),
+                        quality,
+                        threads_per_segment(parallel)),
+                    on_progress, warnings)
+            except TimeoutError as e:
+                errors.append(f"Segment {index} failed: {e}")
+                return
+
+            with data_lock:
+                # A finished segment only adds its frames
+                latest = parser.latest or {}
+                blocks[index] = segment_progress(
+                    latest.get("frame") or 0, latest.get("out_time_us"))
+            if returncode != 0:
+                errors.append(
+                    f"Segment {index} failed: " + (
+                        warnings[-1] if warnings
+                        else f"ffmpeg exited with code {returncode}"))
+            else:
+                with segment_lock:
+                    mark_segment_done(
+                        work_dir, manifest, index, blocks[index]["frame"])
+
+        def segment_steps():
+            # No new segments are started once one failed
+            for index in remaining:
+                if errors:
+                    return
+                yield encode_segment(index)
+
+        yield Parallel(segment_steps(), min(parallel, len(sources)))
+        if errors:
+            return fail(errors[0])
+
+        # 3. Join the segments and add audio and subtitles
+        encoded = [
+            encoded_segment(work_dir, source.name) for source in sources
+        ]
+        try:
+            process = yield Run(
+                concat_command(
+                    write_concat_list(work_dir, encoded), source,
+                    encoded_file, quality, audio_map, subtitle_map,
+                    audio_plan),
+                "encode", timeout)
+        except subprocess.TimeoutExpired:
+            return fail("Failed to join segments: timed out")
+        if process.returncode != 0:
+            return fail(
+                f"Failed to join segments: {process.stderr.strip()}")
+        succeeded = True
+        return process.returncode
+
+    finally:
+        # Unfinished segments are kept for the next attempt
+        if succeeded or not resume:
+            shutil.rmtree(work_dir, ignore_errors=True)
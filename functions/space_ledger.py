@@ -0,0 +1,143 @@
+'''
+Keeps several encodes from filling the same disk together.
+Before an encode starts the daemon reserves the size its output is expected
+to reach on the filesystem the output goes to (the scratch folder, if there
+is one). Copies from the scratch folder reserve the encoded size in the
+library. The size comes from the
+compression ratio of earlier encodes with the same preset (throughput.db),
+or the input size if there are none. An encode is only started if the free
+space, minus what running encodes have reserved but not written yet, leaves
+storage_buffer free.
+'''
+
+import os
+from pathlib import Path
+
+from .copier import encode_path
+from .disk_stats import bytes_to_gib, existing_parent, mount_point
+from .segment_encoder import use_segments
+from .storage_metrics import StorageMetrics
+from .throughput import ThroughputModel, load_history, video_class
+
+# Reserve a bit more than the median ratio, half of all encodes are bigger
+RESERVE_MARGIN = 1.25
+
+# Jobs that are writing, and waiting to write, to a reservation
+ACTIVE_STATUSES = ("encoding", "copying")
+WAITING_STATUSES = ("ready_to_encode", "ready_to_copy")
+
+
+class SpaceLedger:
+    '''
+    Reservations of running encodes, grouped by filesystem.
+    '''
+
+    def __init__(self, buffer: float, metrics: StorageMetrics,
+                 segment_enabled: bool = False,
+                 segment_min_duration: float = 0):
+        self.buffer = buffer
+        self.metrics = metrics
+        self.segment_enabled = segment_enabled
+        self.segment_min_duration = segment_min_duration
+        # uid -> (filesystem device, reserved bytes)
+        self.reservations: dict[str, tuple[int, int]] = {}
+        # Jobs waiting for space, so the message is only printed once
+        self.blocked: set[str] = set()
+        self.model = None
+        self.refresh()
+
+    def refresh(self):
+        '''
+        Reloads the compression ratios, called when an encode finished.
+        '''
+        self.model = ThroughputModel(load_history())
+
+    def projected_size(self, job) -> int:
+        '''
+        Returns how much space an encode is expected to need.
+        Segment encodes also keep a copy of the video stream while encoding.
+        Remuxes are as big as the input.
+        '''
+        if job["remux"]:
+            return job["before_size"]
+        prediction = self.model.predict(
+            job["quality"], *video_class(job["media_info"]))
+        ratio = prediction["ratio"] * RESERVE_MARGIN if prediction else 1.0
+        size = job["before_size"] * ratio
+        if use_segments(job["duration"], self.segment_enabled,
+                        self.segment_min_duration):
+            size += job["before_size"]
+        return int(size)
+
+    @staticmethod
+    def written(job) -> int:
+        '''
+        Returns how much of its reservation a job has written.
+        '''
+        if job["status"] == "copying":
+            return int(job["after_size"] * job["percentage_copied"] / 100)
+        return (job["progress"] or {}).get("total_size") or 0
+
+    def outstanding(self, device: int, data) -> int:
+        '''
+        Returns the space reserved on a filesystem that has not been
+        written yet.
+        '''
+        total = 0
+        for uid, (reserved_device, size) in self.reservations.items():
+            if reserved_device != device:
+                continue
+            total += max(0, size - self.written(data[uid]))
+        return total
+
+    def target(self, job) -> tuple[Path, int]:
+        '''
+        Returns the folder a job is about to write to and how much it needs.
+        Copies within one filesystem are renamed and need nothing.
+        '''
+        if job["status"] == "ready_to_copy":
+            path = existing_parent(job["encoded_file"])
+            same = (os.stat(path).st_dev
+                    == os.stat(existing_parent(job["scratch_file"])).st_dev)
+            return path, 0 if same else job["after_size"]
+        return existing_parent(encode_path(job)), self.projected_size(job)
+
+    def reserve(self, uid: str, data, job=None) -> bool:
+        '''
+        Reserves space for an encode or copy that is about to start.
+        job is the encode as it is planned to run, if data[uid] has not been
+        changed yet. Returns False if there is not enough space for it yet.
+        '''
+        if job is None:
+            job = data[uid]
+        path, size = self.target(job)
+        device = os.stat(path).st_dev
+        free = self.metrics.free(path) - self.outstanding(device, data)
+
+        if free - size < self.buffer:
+            if uid not in self.blocked:
+                self.blocked.add(uid)
+                print(f"Not enough space on {mount_point(path)} for UID "
+                      f"{uid}: needs {bytes_to_gib(size):.1f} GiB, "
+                      f"{bytes_to_gib(max(0, free)):.1f} GiB free after "
+                      "other encodes. Waiting.")
+            return False
+
+        self.blocked.discard(uid)
+        self.reservations[uid] = (device, size)
+        return True
+
+    def sync(self, data):
+        '''
+        Releases the reservations of jobs that are no longer encoding or
+        copying.
+        '''
+        for uid in list(self.reservations):
+            if uid not in data or data[uid]["status"] not in ACTIVE_STATUSES:
+                del self.reservations[uid]
+                # The output is now counted by the filesystem itself
+                self.metrics.invalidate()
+        self.blocked = {
+            uid for uid in self.blocked
+            if uid in data and data[uid]["status"] in WAITING_STATUSES
+        }
@@ -0,0 +1,195 @@
+'''
+Free space of every disk shipper uses, shared by the daemon and the TUI.
+The disks are found from input_dir, output_dir and the project folder (job
+database and caches). Measurements are cached for ttl seconds and kept for
+TREND_WINDOW seconds, so the rate each disk is being written at and the time
+until it is full can be worked out.
+The daemon saves every measurement to storage.json. TUI sessions read that
+instead of each measuring on their own, and only measure themselves when
+the daemon is not running.
+'''
+
+import collections
+import os
+import shutil
+import time
+from pathlib import Path
+
+try:
+    from .config import PROJECT_ROOT
+    from .disk_stats import bytes_to_gib, existing_parent, mount_point
+    from .file_handler import load_json, save_json
+except ImportError:
+    from config import PROJECT_ROOT
+    from disk_stats import bytes_to_gib, existing_parent, mount_point
+    from file_handler import load_json, save_json
+
+# How long the write rate is measured over (seconds)
+TREND_WINDOW = 600
+
+# Snapshots older than this are not used by readers (seconds)
+SNAPSHOT_MAX_AGE = 30
+
+
+def storage_paths(config) -> dict:
+    '''
+    Returns the folders shipper reads and writes, by name.
+    '''
+    paths = {
+        "input": config.input_dir,
+        "output": config.output_dir,
+        "project": PROJECT_ROOT,
+    }
+    if config.scratch_dir:
+        paths["scratch"] = config.scratch_dir
+    if config.prefetch_enabled:
+        paths["prefetch"] = config.prefetch_cache_dir
+    return paths
+
+
+class StorageMetrics:
+    '''
+    Cached disk usage of the filesystems the given paths are on.
+    '''
+
+    def __init__(self, paths: dict, ttl: float = 5,
+                 snapshot_path: Path = None):
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        # device -> mount point, names of the paths on it, samples
+        self.mounts: dict[int, dict] = {}
+        for name, path in paths.items():
+            self._mount(path)["names"].append(name)
+        self._last_refresh = None
+
+    def _mount(self, path) -> dict:
+        path = existing_parent(path)
+        device = os.stat(path).st_dev
+        if device not in self.mounts:
+            self.mounts[device] = {
+                "path": path,
+                "mount_point": mount_point(path),
+                "names": [],
+                # (time, total, used, free)
+                "samples": collections.deque(),
+            }
+        return self.mounts[device]
+
+    def refresh(self, force: bool = False):
+        '''
+        Measures every disk if the last measurement is older than ttl.
+        '''
+        now = time.monotonic()
+        if (not force and self._last_refresh is not None
+                and now - self._last_refresh < self.ttl):
+            return
+        self._last_refresh = now
+        for mount in self.mounts.values():
+            self._measure(mount, now)
+        if self.snapshot_path:
+            save_json(self.snapshot_path, {
+                "time": time.time(), "mounts": self.snapshot()})
+
+    def _measure(self, mount: dict, now: float):
+        try:
+            total, used, free = shutil.disk_usage(mount["path"])
+        except OSError as e:
+            print(f"Failed to measure {mount['mount_point']}: {e}")
+            return
+        samples = mount["samples"]
+        samples.append((now, total, used, free))
+        while samples and now - samples[0][0] > TREND_WINDOW:
+            samples.popleft()
+
+    def invalidate(self):
+        '''
+        Makes the next read measure again, used when space was just freed.
+        '''
+        self._last_refresh = None
+
+    def free(self, path) -> int:
+        '''
+        Returns the free bytes on the filesystem a path is (or will be) on.
+        '''
+        mount = self._mount(path)
+        self.refresh()
+        if not mount["samples"]:
+            self._measure(mount, time.monotonic())
+        return mount["samples"][-1][3]
+
+    @staticmethod
+    def write_rate(mount: dict) -> float | None:
+        '''
+        Returns how many bytes a second the disk is filling up at, over the
+        trend window. Negative when space is being freed.
+        '''
+        samples = mount["samples"]
+        if len(samples) < 2 or samples[-1][0] - samples[0][0] <= 0:
+            return None
+        return ((samples[-1][2] - samples[0][2])
+                / (samples[-1][0] - samples[0][0]))
+
+    def snapshot(self) -> list:
+        '''
+        Returns the latest measurement of every disk.
+        '''
+        result = []
+        for mount in self.mounts.values():
+            if not mount["samples"]:
+                continue
+            _, total, used, free = mount["samples"][-1]
+            rate = self.write_rate(mount)
+            result.append({
+                "mount_point": str(mount["mount_point"]),
+                "names": mount["names"],
+                "total": total,
+                "used": used,
+                "free": free,
+                "write_rate": rate,
+                "time_until_full": free / rate if rate and rate > 0
+                else None,
+            })
+        return result
+
+
+def describe_mount(mount: dict) -> str:
+    '''
+    One line about a disk from a snapshot: what is on it, how full it is and
+    how fast it is filling up.
+    '''
+    text = (f"{mount['mount_point']} ({', '.join(mount['names'])}): "
+            f"{bytes_to_gib(mount['free']):,.1f} GiB free of "
+            f"{bytes_to_gib(mount['total']):,.1f} GiB")
+    if mount["write_rate"]:
+        text += f", {mount['write_rate'] / 2**20:+.1f} MiB/s"
+    if mount["time_until_full"] is not None:
+        hours = mount["time_until_full"] / 3600
+        text += f", full in {hours:.1f}h"
+    return text
+
+
+def load_snapshot(snapshot_path: Path,
+                  max_age: float = SNAPSHOT_MAX_AGE) -> list | None:
+    '''
+    Returns the disks the daemon measured last, or None if it has not
+    measured them recently.
+    '''
+    try:
+        snapshot = load_json(snapshot_path)
+    except (OSError, ValueError):
+        return None
+    if not snapshot or time.time() - snapshot.get("time", 0) > max_age:
+        return None
+    return snapshot["mounts"]
+
+
+def read_storage(snapshot_path: Path, metrics: StorageMetrics) -> list:
+    '''
+    Returns the daemon's latest snapshot, or measures with metrics if the
+    daemon is not running.
+    '''
+    snapshot = load_snapshot(snapshot_path)
+    if snapshot is None:
+        metrics.refresh()
+        snapshot = metrics.snapshot()
+    return snapshot
@@ -0,0 +1,291 @@
+'''
+Runs every frame count and encode in its own worker process.
+Workers get a copy of their job and send back the fields they change over a
+pipe. Progress is batched in the worker and the daemon applies everything
+that arrived in one go, so one busy or crashing worker can not block or
+corrupt the daemon's state.
+Workers that crash are restarted a limited number of times.
+'''
+
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import traceback
+
+from .compressor import encode_video
+from .copier import copy_job, encode_path, partial_path
+from .job_creation import frame_count_job
+from .processes import drive
+from .verifier import verify_job
+
+# How often a worker sends progress (seconds). Status changes are sent at once.
+UPDATE_INTERVAL = 1.0
+
+# Fields that are only sent every UPDATE_INTERVAL
+PROGRESS_FIELDS = ("current_frame", "progress", "percentage_copied")
+
+# How long a cancelled worker has to exit before it is killed (seconds)
+CANCEL_TIMEOUT = 5
+
+# The daemon runs threads (the asyncio loop, the coordinator, prefetch
+# copies), and forking a process with threads can leave locks held in the
+# child. Workers are forked from a forkserver started before any of them
+# instead, which already has the job modules imported.
+_mp = multiprocessing.get_context("forkserver")
+_mp.set_forkserver_preload(["functions.logger", "functions.supervisor"])
+
+# The steps of every kind of job (see processes.py), shared with the asyncio
+# backend
+JOB_STEPS = {
+    "framecount": frame_count_job,
+    "encode": encode_video,
+    "copy": copy_job,
+    "verify": verify_job,
+}
+
+
+def _picklable(value):
+    if isinstance(value, (str, int, float, bool, type(None), list, dict)):
+        return value
+    return str(value)
+
+
+class ReportingJob(dict):
+    '''
+    The job dictionary inside a worker.
+    Changed fields are collected and sent to the daemon. Progress
+    (PROGRESS_FIELDS) is only sent every UPDATE_INTERVAL, anything else
+    is sent straight away.
+    '''
+
+    def __init__(self, job: dict, conn):
+        super().__init__(job)
+        self._conn = conn
+        self._changes = {}
+        self._last_send = 0.0
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changes[key] = _picklable(value)
+        if (key not in PROGRESS_FIELDS
+                or time.monotonic() - self._last_send >= UPDATE_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        if self._changes:
+            self._conn.send(("update", self._changes))
+            self._changes = {}
+        self._last_send = time.monotonic()
+
+
+def _worker_main(kind: str, uid: str, job: dict, conn):
+    '''
+    Entry point of a worker process.
+    '''
+    # Own process group so cancelling also stops ffmpeg/ffprobe children
+    os.setpgid(0, 0)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    reporting_job = ReportingJob(job, conn)
+    data = {uid: reporting_job}
+    try:
+        drive(JOB_STEPS[kind](uid, data, threading.Lock()))
+        reporting_job.flush()
+        conn.send(("done", None))
+    except Exception:
+        reporting_job.flush()
+        conn.send(("crash", traceback.format_exc()))
+        conn.close()
+        os._exit(1)
+    conn.close()
+
+
+class Worker:
+    '''
+    A running worker process and its pipe.
+    '''
+
+    def __init__(self, kind: str, uid: str, job: dict):
+        self.kind = kind
+        self.uid = uid
+        self.done = False
+        self.crash = None
+        self.cancelled = False
+
+        self.conn, child_conn = _mp.Pipe(duplex=False)
+        self.process = _mp.Process(
+            target=_worker_main,
+            args=(kind, uid, job, child_conn),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+    def receive(self) -> list:
+        '''
+        Returns every update waiting in the pipe.
+        '''
+        updates = []
+        try:
+            while self.conn.poll():
+                message, payload = self.conn.recv()
+                if message == "update":
+                    updates.append(payload)
+                elif message == "done":
+                    self.done = True
+                elif message == "crash":
+                    self.crash = payload
+        except (EOFError, OSError):
+            pass
+        return updates
+
+    def running(self) -> bool:
+        return self.process.is_alive()
+
+    def fds(self) -> list:
+        return [self.conn.fileno(), self.process.sentinel]
+
+    def close(self):
+        self.process.join()
+        self.conn.close()
+
+    def succeeded(self) -> bool:
+        return self.done and self.process.exitcode == 0
+
+    def failure_reason(self) -> str:
+        return self.crash or (
+            f"Worker exited with code {self.process.exitcode}")
+
+    def signal(self, sig):
+        try:
+            os.killpg(self.process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            # The worker has not made its process group yet
+            try:
+                os.kill(self.process.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def cancel(self, timeout: float):
+        self.cancelled = True
+        self.signal(signal.SIGTERM)
+        self.process.join(timeout)
+        if self.process.is_alive():
+            print(f"Worker for UID {self.uid} did not stop, killing...")
+            self.signal(signal.SIGKILL)
+            self.process.join()
+
+
+class Supervisor:
+    '''
+    Starts, watches, cancels and restarts worker processes.
+    All methods should be called from the daemon's main thread.
+    '''
+
+    def __init__(self, max_restarts: int = 1):
+        self.max_restarts = max_restarts
+        self.workers: dict[str, Worker] = {}
+        self._restarts: dict[str, int] = {}
+
+    def start(self, kind: str, uid: str, job: dict):
+        '''
+        Starts a worker for a job. job should be a plain copy of the job.
+        '''
+        self.workers[uid] = Worker(kind, uid, job)
+
+    def uids(self, kind: str = None) -> list:
+        return [
+            uid for uid, worker in self.workers.items()
+            if kind is None or worker.kind == kind
+        ]
+
+    def count(self, kind: str = None) -> int:
+        return len(self.uids(kind))
+
+    def fds(self) -> list:
+        '''
+        File descriptors that become readable when a worker sends an update
+        or exits. Used to wake the daemon loop.
+        '''
+        fds = []
+        for worker in self.workers.values():
+            fds.extend(worker.fds())
+        return fds
+
+    def poll(self, data) -> list:
+        '''
+        Applies all waiting updates to data and reaps finished workers.
+        Each job is updated while holding its own lock, so the daemon's
+        data_lock is not needed.
+        Returns a list of (kind, uid) for workers that finished normally.
+        Crashed workers are restarted or their job is marked as an error.
+        '''
+        finished = []
+        for uid, worker in list(self.workers.items()):
+            running = worker.running()
+            for changes in worker.receive():
+                if uid in data:
+                    with data[uid].lock:
+                        data[uid].update(changes)
+
+            if running:
+                continue
+
+            worker.close()
+            del self.workers[uid]
+
+            if worker.cancelled or uid not in data:
+                continue
+            if worker.succeeded():
+                self._restarts.pop(uid, None)
+                finished.append((worker.kind, uid))
+                continue
+
+            self._handle_crash(worker, data, worker.failure_reason())
+        return finished
+
+    def _handle_crash(self, worker, data, reason: str):
+        uid = worker.uid
+        restarts = self._restarts.get(uid, 0)
+        print(f"{worker.kind} worker for UID {uid} crashed: {reason}")
+
+        if worker.kind == "encode":
+            try:
+                os.remove(encode_path(data[uid]))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f'Failed to remove due to error: {e}')
+        elif worker.kind == "copy":
+            partial_path(data[uid]["encoded_file"]).unlink(missing_ok=True)
+
+        if restarts >= self.max_restarts:
+            data[uid]["status"] = "error"
+            data[uid]["error"] = reason.strip().splitlines()[-1]
+            self._restarts.pop(uid, None)
+            return
+
+        self._restarts[uid] = restarts + 1
+        print(f"Restarting {worker.kind} worker for UID {uid} "
+              f"({restarts + 1}/{self.max_restarts})")
+        self.start(worker.kind, uid, dict(data[uid]))
+
+    def cancel(self, uid: str, timeout: float = CANCEL_TIMEOUT):
+        '''
+        Stops a worker and everything it started.
+        Its job is left as it is so it can be reset on the next start.
+        '''
+        worker = self.workers.get(uid)
+        if worker:
+            worker.cancel(timeout)
+
+    def stop_all(self):
+        '''
+        Cancels every worker.
+        '''
+        for uid in list(self.workers):
+            self.cancel(uid)
+            self.workers.pop(uid).close()
@@ -1,14 +1,40 @@
-from textual.widgets import ProgressBar
-from .disk_stats import get_disk_metrics
+from textual.app import ComposeResult
+from textual.containers import Vertical
+from textual.widgets import Label, ProgressBar
 
+from .config import STORAGE_FILE_PATH, load_config
+from .storage_metrics import (
+    StorageMetrics, storage_paths, read_storage, describe_mount
+)
+
+CONFIG = load_config()
+
+
+class DiskSpace(Vertical):
+    """A usage bar for every disk shipper uses, from the daemon's measurements."""
+
+    # Only measures itself while the daemon is not running
+    metrics: StorageMetrics = None
+
+    def compose(self) -> ComposeResult:
+        self.metrics = StorageMetrics(storage_paths(CONFIG), ttl=15)
+        for no, mount in enumerate(read_storage(
+                STORAGE_FILE_PATH, self.metrics)):
+            yield Label(describe_mount(mount), id=f"disk-label-{no}")
+            yield ProgressBar(
+                total=mount["total"], show_eta=False, id=f"disk-bar-{no}")
 
-class DiskSpaceBar(ProgressBar):
     def check_space(self) -> None:
-        total, used, pct = get_disk_metrics()
-        self.update(
-            total=total,
-            progress=used
-        )
+        for no, mount in enumerate(read_storage(
+                STORAGE_FILE_PATH, self.metrics)):
+            labels = self.query(f"#disk-label-{no}")
+            if not labels:
+                continue
+            labels.first(Label).update(describe_mount(mount))
+            self.query_one(f"#disk-bar-{no}", ProgressBar).update(
+                total=mount["total"],
+                progress=mount["used"]
+            )
 
     def on_mount(self) -> None:
         """Called when widget first attached."""
@@ -1,34 +1,27 @@
-import json
-import os
 from textual.widgets import DataTable
 
-from .config import DATA_FILE_PATH, load_config
+from .config import JOBS_DB_PATH, load_config
+from .job_store import JobStoreReader
 from .t_status_data import get_data_table, get_overview_data_table
 
 CONFIG = load_config()
 
 
 class StatusTable(DataTable):
-    """A custom widget for displaying data from a dynamically updating JSON file."""
+    """A custom widget for displaying data from the dynamically updating job database."""
 
-    # Store the last known modification time of the file
-    last_mtime: float = 0.0
+    # Read only view of the job database
+    reader: JobStoreReader = None
 
     def load_data_from_json(self) -> None:
-        """Reads and updates the table content from the JSON file."""
+        """Reads and updates the table content from the job database."""
         try:
-            # Check if file has been modified recently
-            current_mtime = os.path.getmtime(DATA_FILE_PATH)
-            if current_mtime <= self.last_mtime:
+            # Check if the daemon has committed since the last read
+            if not self.reader.has_changed():
                 return  # Skip if not modified
-            self.last_mtime = current_mtime
 
             # Get new data
-            with open(DATA_FILE_PATH, "r") as f:
-                try:
-                    data = json.load(f)
-                except Exception:
-                    return
+            data = self.reader.load()
             if not data:
                 return  # Skip if data is empty
             filtered_data = get_data_table(data)
@@ -62,13 +55,15 @@ class StatusTable(DataTable):
 
         except FileNotFoundError:
             # Optional: Display a message if the file is missing
-            self.app.log(f"JSON file not found: {DATA_FILE_PATH}")
+            self.app.log(f"Job database not found: {JOBS_DB_PATH}")
         except Exception as e:
-            self.app.log(f"Error loading JSON data: {e}")
+            self.app.log(f"Error loading job data: {e}")
 
     def on_mount(self) -> None:
         """Called when the widget is first attached to the app."""
 
+        self.reader = JobStoreReader(JOBS_DB_PATH)
+
         columns = CONFIG.textual_columns
         for c_no in range(len(columns)):
             self.add_column(columns[c_no], key=str(c_no))
@@ -79,26 +74,20 @@ class StatusTable(DataTable):
 
 
 class OverviewTable(DataTable):
-    """A custom widget for displaying data from a dynamically updating JSON file."""
+    """A custom widget for displaying data from the dynamically updating job database."""
 
-    # Store the last known modification time of the file
-    last_mtime: float = 0.0
+    # Read only view of the job database
+    reader: JobStoreReader = None
 
     def load_data_from_json(self) -> None:
-        """Reads and updates the table content from the JSON file."""
+        """Reads and updates the table content from the job database."""
 #        try:
-        # Check if file has been modified recently
-        current_mtime = os.path.getmtime(DATA_FILE_PATH)
-        if current_mtime <= self.last_mtime:
+        # Check if the daemon has committed since the last read
+        if not self.reader.has_changed():
             return  # Skip if not modified
-        self.last_mtime = current_mtime
 
         # Get new data
-        with open(DATA_FILE_PATH, "r") as f:
-            try:
-                data = json.load(f)
-            except Exception:
-                return
+        data = self.reader.load()
         if not data:
             return  # Skip if data is empty
         filtered_data = get_overview_data_table(data)
@@ -133,13 +122,15 @@ class OverviewTable(DataTable):
 
 #        except FileNotFoundError:
 #            # Optional: Display a message if the file is missing
-#            self.app.log(f"JSON file not found: {DATA_FILE_PATH}")
+#            self.app.log(f"Job database not found: {JOBS_DB_PATH}")
 #        except Exception as e:
-#            self.app.log(f"Error loading JSON data: {e}")
+#            self.app.log(f"Error loading job data: {e}")
 
     def on_mount(self) -> None:
         """Called when the widget is first attached to the app."""
 
+        self.reader = JobStoreReader(JOBS_DB_PATH)
+
         columns = CONFIG.textual_overview_columns
         for c_no in range(len(columns)):
             self.add_column(columns[c_no], key=str(c_no))
@@ -1,24 +1,34 @@
 import pprint
-import time
 import re
 
 try:
-    from functions.config import PROJECT_ROOT, load_config
-    from functions.disk_stats import get_disk_metrics, print_disk_usage
-    from functions.file_handler import load_json
+    from functions.config import (
+        PROJECT_ROOT, JOBS_DB_PATH, STORAGE_FILE_PATH, THROUGHPUT_DB_PATH,
+        load_config)
+    from functions.disk_stats import print_disk_usage
+    from functions.storage_metrics import (
+        StorageMetrics, storage_paths, read_storage, describe_mount)
+    from functions.job_store import load_jobs
+    from functions.eta import job_eta, queue_eta
+    from functions.throughput import ThroughputModel, load_history
 except Exception:
-    from config import PROJECT_ROOT, load_config
-    from disk_stats import get_disk_metrics, print_disk_usage
-    from file_handler import load_json
+    from config import (
+        PROJECT_ROOT, JOBS_DB_PATH, STORAGE_FILE_PATH, THROUGHPUT_DB_PATH,
+        load_config)
+    from disk_stats import print_disk_usage
+    from storage_metrics import (
+        StorageMetrics, storage_paths, read_storage, describe_mount)
+    from job_store import load_jobs
+    from eta import job_eta, queue_eta
+    from throughput import ThroughputModel, load_history
 
 CONFIG = load_config()
-DATA_FILE_PATH = PROJECT_ROOT / "data.json"
 STOPPING_FLAG_FILE_PATH = PROJECT_ROOT / "stop.flag"
 
-if not DATA_FILE_PATH.exists():
-    print("Error: data.json file missing.")
+if not JOBS_DB_PATH.exists():
+    print("Error: jobs.db file missing.")
     print("Please make sure that the daemon is currently running.")
-    print(f"Tried to find data.json at {DATA_FILE_PATH}")
+    print(f"Tried to find jobs.db at {JOBS_DB_PATH}")
     exit()
 
 
@@ -65,29 +75,66 @@ def get_pct(job):
         if current_frames == 0:
             return 0
         else:
-            return (current_frames / total_frames) * 100
+            pct = (current_frames / total_frames) * 100
+            # An estimated frame count can be a little short
+            if job.get("frames_estimated"):
+                pct = min(pct, 99.9)
+            return pct
     return 0
 
 
 def get_pct_str(job):
     pct = get_pct(job)
     if job["status"] == "encoding":
-        return f"{pct:5.1f}%"
+        # ~ marks progress based on an estimated frame count
+        marker = "~" if job.get("frames_estimated") else " "
+        return f"{marker}{pct:5.1f}%"
+    if job["status"] == "copying":
+        return f" {job.get('percentage_copied', 0):5.1f}%"
     return ""
 
 
 def get_eta(job):
-    now = int(time.time())
-    if (job['status'] == "encoding"
-        and job.get("encode_start_time")
-        and job["encode_start_time"] != now
-        ):
-        elapsed = now - job["encode_start_time"]
-        pct = get_pct(job)
-        # pct+0.01 to avoid div/0
-        total_est = elapsed / ((pct+0.01) / 100)
-        return format_time(total_est - elapsed)
-    return ''
+    """
+    Time left on a running encode, from its smoothed encode speed.
+    """
+    eta = job_eta(job)
+    if eta is None:
+        return ''
+    return format_time(eta)
+
+
+_model_cache = {"mtime": None, "model": None}
+
+
+def throughput_model():
+    """
+    The ThroughputModel of every recorded encode, loaded again when
+    throughput.db changes.
+    """
+    # New encodes are written to the WAL file first
+    mtime = []
+    for path in (THROUGHPUT_DB_PATH,
+                 THROUGHPUT_DB_PATH.with_name("throughput.db-wal")):
+        try:
+            mtime.append(path.stat().st_mtime_ns)
+        except OSError:
+            mtime.append(0)
+    if _model_cache["model"] is None or _model_cache["mtime"] != mtime:
+        _model_cache["model"] = ThroughputModel(load_history())
+        _model_cache["mtime"] = mtime
+    return _model_cache["model"]
+
+
+def get_queue_eta(jobs: dict, model) -> str:
+    """
+    Time until every running and waiting job in jobs is encoded, shared
+    between job_limits.encode encodes.
+    """
+    eta = queue_eta(jobs, model, CONFIG.max_encode_jobs)
+    if eta is None:
+        return ''
+    return format_time(eta)
 
 
 def parse_episode_code(episode_code: str):
@@ -98,8 +145,13 @@ def parse_episode_code(episode_code: str):
     return map(int, match.groups())
 
 
+# Row key of the whole queue's ETA
+QUEUE_ROW = "queue"
+
+
 def get_data_table(
-        data: dict, shown_columns: list = CONFIG.textual_columns) -> dict:
+        data: dict, shown_columns: list = CONFIG.textual_columns,
+        queue_row: bool = True) -> dict:
     output_table = {}
 
     for uid, job in data.items():
@@ -111,6 +163,14 @@ def get_data_table(
                 output_table[uid]['eta'] = get_eta(job)
             elif column in job.keys():
                 output_table[uid][column] = job[column]
+
+    # Last row shows when the whole queue should be done
+    if queue_row and 'eta' in shown_columns:
+        output_table[QUEUE_ROW] = {column: '' for column in shown_columns}
+        if 'name' in shown_columns:
+            output_table[QUEUE_ROW]['name'] = 'Whole queue'
+        output_table[QUEUE_ROW]['eta'] = get_queue_eta(
+            data, throughput_model())
     return output_table
 
 
@@ -121,7 +181,9 @@ def get_overview_data_table(
         "status",
         "percentage",
         "id",
-    ])
+    ], queue_row=False)
+    model = throughput_model()
+    show_jobs = {}
     output_table = {}
     for uid, job in input_table.items():
         sn, ep = parse_episode_code(job["name"])
@@ -134,6 +196,7 @@ def get_overview_data_table(
                 "name": job["name"],
             }
         output_table[job_id]["total"] += 1
+        show_jobs.setdefault(job_id, {})[uid] = data[uid]
         if job["status"] == 'not_started':
             output_table[job_id]["not_started"] += 1
         elif job["status"] == "encoded":
@@ -151,6 +214,8 @@ def get_overview_data_table(
                 output_table[job_id]["status"] = "In Progress"
         except:
             raise Exception(output_table)
+        output_table[job_id]["eta"] = get_queue_eta(
+            show_jobs[job_id], model)
 
         try:
             del output_table[job_id]["total"]
@@ -159,6 +224,11 @@ def get_overview_data_table(
         except:
             pass
 
+    if 'eta' in shown_columns:
+        output_table[QUEUE_ROW] = {column: '' for column in shown_columns}
+        if 'name' in shown_columns:
+            output_table[QUEUE_ROW]['name'] = 'Whole queue'
+        output_table[QUEUE_ROW]['eta'] = get_queue_eta(data, model)
     return output_table
 
 
@@ -168,11 +238,14 @@ if __name__ == "__main__":
         print("Daemon will stop when all jobs are complete.")
         print("To reverse this, create a file called \"unstop\"")
 
-    # Show disk usage stats
-    print_disk_usage(
-        *get_disk_metrics(), 20
-    )
+    # Show disk usage stats of every disk in use
+    for mount in read_storage(
+            STORAGE_FILE_PATH, StorageMetrics(storage_paths(CONFIG))):
+        print(describe_mount(mount))
+        print_disk_usage(
+            mount["total"], mount["used"], mount["used"] / mount["total"], 20
+        )
 
     # Show main data
-    data = load_json(DATA_FILE_PATH)
+    data = load_jobs(JOBS_DB_PATH)
     pprint.pprint(get_data_table(data))
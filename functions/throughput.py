@@ -0,0 +1,273 @@
+'''
+Learns how long encodes take and how much they shrink files.
+Every finished encode is recorded in throughput.db with its quality preset,
+the codec and resolution of the input, how long it took and the sizes before
+and after. ThroughputModel uses the median of similar encodes to predict the
+time and output size of jobs that have not been encoded yet, which is what
+plan.py shows for the queue or a batch before it is submitted.
+'''
+
+import sqlite3
+import statistics
+import time
+from pathlib import Path
+
+from .config import THROUGHPUT_DB_PATH
+from .disk_stats import bytes_to_gib
+from .media_info import get_media_info
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS encodes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    quality TEXT NOT NULL,
+    codec TEXT NOT NULL,
+    resolution TEXT NOT NULL,
+    duration REAL NOT NULL,
+    frames INTEGER,
+    encode_seconds REAL NOT NULL,
+    before_size INTEGER NOT NULL,
+    after_size INTEGER NOT NULL,
+    finished INTEGER NOT NULL
+);
+'''
+
+# Fewer similar encodes than this and the next wider group is used
+MIN_SAMPLES = 3
+
+
+def resolution_class(height) -> str:
+    '''
+    Groups video heights so 1080p and 1040p (cropped) encodes count together.
+    '''
+    if not height:
+        return ""
+    if height <= 576:
+        return "sd"
+    if height <= 720:
+        return "720p"
+    if height <= 1080:
+        return "1080p"
+    return "2160p"
+
+
+def video_class(info: dict | None) -> tuple[str, str]:
+    '''
+    Returns the codec and resolution class of a media_info summary.
+    '''
+    video = (info or {}).get("video") or {}
+    return video.get("codec", ""), resolution_class(video.get("height"))
+
+
+def encode_stats(job) -> dict | None:
+    '''
+    Returns the stats of a finished encode, or None if it is missing
+    anything the model needs. Resumed encodes only timed what was left, so
+    they are left out too.
+    '''
+    encode_seconds = job["encode_end_time"] - job["encode_start_time"]
+    if (not job["encode_start_time"] or encode_seconds <= 0
+            or not job["duration"] or not job["before_size"]
+            or not job["after_size"] or job["remux"] or job["resumed"]):
+        return None
+    codec, resolution = video_class(job["media_info"])
+    return {
+        "quality": job["quality"],
+        "codec": codec,
+        "resolution": resolution,
+        "duration": job["duration"],
+        "frames": job["frames"],
+        "encode_seconds": encode_seconds,
+        "before_size": job["before_size"],
+        "after_size": job["after_size"],
+        "finished": job["encode_end_time"],
+    }
+
+
+def _connect(db_path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def record_encode(job, db_path: Path = THROUGHPUT_DB_PATH) -> bool:
+    '''
+    Adds a finished encode to the history.
+    Returns False if it was not recorded.
+    '''
+    stats = encode_stats(job)
+    if stats is None:
+        return False
+    try:
+        conn = _connect(db_path)
+        try:
+            with conn:
+                conn.execute(
+                    f"INSERT INTO encodes ({', '.join(stats)}) "
+                    f"VALUES ({', '.join('?' * len(stats))})",
+                    tuple(stats.values())
+                )
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"Failed to record encode stats: {e}")
+        return False
+    return True
+
+
+def load_history(db_path: Path = THROUGHPUT_DB_PATH) -> list:
+    '''
+    Returns every recorded encode as a list of dictionaries.
+    '''
+    if not Path(db_path).exists():
+        return []
+    conn = _connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        return [dict(row) for row in conn.execute(
+            "SELECT * FROM encodes ORDER BY id")]
+    finally:
+        conn.close()
+
+
+class ThroughputModel:
+    '''
+    Predicts encode speed (seconds of video per second) and compression
+    ratio (output size / input size) from past encodes.
+    The most specific group with enough samples is used: same preset, codec
+    and resolution, then same preset and resolution, then same preset.
+    Presets differ too much to predict one from another.
+    '''
+
+    def __init__(self, history: list):
+        self._groups: dict[tuple, list] = {}
+        for encode in history:
+            sample = (
+                encode["duration"] / encode["encode_seconds"],
+                encode["after_size"] / encode["before_size"],
+                encode["frames"] / encode["encode_seconds"]
+                if encode["frames"] else None,
+            )
+            for key in self._keys(
+                    encode["quality"], encode["codec"],
+                    encode["resolution"]):
+                self._groups.setdefault(key, []).append(sample)
+
+    @staticmethod
+    def _keys(quality: str, codec: str, resolution: str) -> list:
+        return [
+            (quality, codec, resolution),
+            (quality, None, resolution),
+            (quality, None, None),
+        ]
+
+    @staticmethod
+    def _stats(samples: list) -> dict:
+        fps = [sample[2] for sample in samples if sample[2]]
+        return {
+            "speed": statistics.median(sample[0] for sample in samples),
+            "ratio": statistics.median(sample[1] for sample in samples),
+            "fps": statistics.median(fps) if fps else None,
+            "samples": len(samples),
+        }
+
+    def predict(self, quality: str, codec: str = "", resolution: str = "",
+                exact: bool = False) -> dict | None:
+        '''
+        Returns the median speed, ratio and fps of the closest group with
+        the number of samples it is based on. None if nothing was recorded.
+        With exact, only encodes of the same codec and resolution are used.
+        '''
+        samples = None
+        keys = self._keys(quality, codec, resolution)
+        for key in keys[:1] if exact else keys:
+            group = self._groups.get(key)
+            if group:
+                samples = group
+                if len(group) >= MIN_SAMPLES:
+                    break
+        if samples is None:
+            return None
+        return self._stats(samples)
+
+    def summary(self) -> dict:
+        '''
+        Returns the stats of every preset and resolution recorded.
+        '''
+        return {
+            (quality, resolution): self._stats(samples)
+            for (quality, codec, resolution), samples in self._groups.items()
+            if codec is None and resolution is not None
+        }
+
+
+def forecast(jobs: list, model: ThroughputModel, parallel: int = 1) -> dict:
+    '''
+    Forecasts the encode time and output size of a list of jobs.
+    Each job needs quality, duration, before_size and media_info. A running
+    job only counts the part that is left (from frames and current_frame).
+    Time is shared between parallel encodes. Jobs the model can not predict
+    are only counted in "unknown".
+    '''
+    result = {
+        "jobs": len(jobs),
+        "unknown": 0,
+        "encode_seconds": 0.0,
+        "before_size": 0,
+        "after_size": 0.0,
+    }
+    for job in jobs:
+        prediction = model.predict(
+            job.get("quality", ""), *video_class(job.get("media_info")))
+        if prediction is None or not job.get("duration"):
+            result["unknown"] += 1
+            continue
+        result["before_size"] += job.get("before_size") or 0
+        left = 1.0
+        if job.get("frames") and job.get("current_frame"):
+            left = max(0.0, 1 - job["current_frame"] / job["frames"])
+        result["encode_seconds"] += (
+            job["duration"] * left / prediction["speed"])
+        result["after_size"] += (
+            (job.get("before_size") or 0) * prediction["ratio"])
+    result["seconds"] = result["encode_seconds"] / max(1, parallel)
+    result["finish_time"] = time.time() + result["seconds"]
+    return result
+
+
+def with_media_info(job: dict) -> dict:
+    '''
+    Fills in media_info, duration and before_size of a job that has not
+    been probed yet (probes are cached).
+    '''
+    if job.get("media_info") and job.get("duration"):
+        return job
+    info = get_media_info(job["input_file"])
+    if isinstance(info, str):
+        print(info)
+        return job
+    return {
+        **job,
+        "media_info": info,
+        "duration": job.get("duration") or info["duration"],
+        "before_size": job.get("before_size") or info["size"] or 0,
+    }
+
+
+def _format_time(seconds: float) -> str:
+    hours, seconds = divmod(int(seconds), 3600)
+    return f"{hours}h {seconds // 60:02}m"
+
+
+def print_forecast(title: str, result: dict):
+    '''
+    Prints a forecast made by forecast().
+    '''
+    print(f"{title}: {result['jobs']} job(s)")
+    if result["unknown"]:
+        print(f"  {result['unknown']} job(s) can not be predicted yet "
+              "(no finished encodes of their preset) and are left out.")
+    print(f"  Encode time: {_format_time(result['seconds'])}, done around "
+          f"{time.strftime('%a %H:%M', time.localtime(result['finish_time']))}")
+    print(f"  Size: {bytes_to_gib(result['before_size']):.1f} GiB -> "
+          f"{bytes_to_gib(result['after_size']):.1f} GiB")
@@ -0,0 +1,195 @@
+"""
+Checks every finished encode before it goes into the library.
+ffmpeg can exit cleanly and still leave a short or damaged file (a full disk,
+a dropped network mount, corrupt input packets that were discarded). Each
+encode is probed and compared with the probed input: the duration must match
+within verify.max_duration_diff seconds and every kept stream must be there.
+Then verify.samples short pieces spread over the file, the last one at the
+very end, are decoded and any decoder error fails the job. This only decodes
+a few seconds per file, so job_limits.verify checks keep up with the encodes.
+The result is stored on the job (verification).
+"""
+
+import json
+import subprocess
+import time
+
+from .audio import kept_streams
+from .config import load_config
+from .copier import encode_path
+from .media_info import probe_command, summarize
+from .processes import PROBE_TIMEOUT, Run
+
+CONFIG = load_config()
+
+# How many decoder errors are kept on the job
+MAX_ERRORS = 5
+
+
+def next_status(job) -> str:
+    """
+    The status of an encode that is done: encodes in the scratch folder
+    still need copying.
+    """
+    return "ready_to_copy" if job["scratch_file"] else "encoded"
+
+
+def expected_streams(info: dict) -> dict:
+    """
+    The streams an encode of a probed input has, see
+    compressor.get_stream_map.
+    """
+    return {
+        "video": 1 if info["video"] else 0,
+        "audio": len(kept_streams(info["audio"])),
+        "subtitles": len(kept_streams(info["subtitles"])),
+    }
+
+
+def stream_counts(info: dict) -> dict:
+    return {
+        "video": 1 if info["video"] else 0,
+        "audio": len(info["audio"]),
+        "subtitles": len(info["subtitles"]),
+    }
+
+
+def compare(job, output: dict, max_duration_diff: float) -> list:
+    """
+    Returns what is wrong with an encode's probe compared to its input.
+    """
+    problems = []
+    source = job["media_info"]
+    if source:
+        expected = expected_streams(source)
+        found = stream_counts(output)
+        for kind, count in expected.items():
+            if found[kind] != count:
+                problems.append(
+                    f"{found[kind]} {kind} streams instead of {count}")
+
+    duration = job["duration"] or (source or {}).get("duration")
+    if duration:
+        if not output["duration"]:
+            problems.append("output has no duration")
+        elif abs(output["duration"] - duration) > max_duration_diff:
+            problems.append(
+                f"output is {output['duration']:.1f}s long instead of "
+                f"{duration:.1f}s")
+    return problems
+
+
+def sample_starts(duration: float, samples: int, length: float) -> list:
+    """
+    Where each decoded sample starts, evenly spread from the start to the
+    end of the file.
+    """
+    if not duration or samples < 1:
+        return []
+    last = max(0.0, duration - length)
+    if samples == 1 or last == 0:
+        return [last]
+    return [round(last * no / (samples - 1), 3) for no in range(samples)]
+
+
+def decode_command(file_path: str, start: float, length: float) -> list:
+    """
+    ffmpeg command that decodes the video and audio of a piece of a file
+    and throws the result away. Errors are written to stderr.
+    """
+    return [
+        "ffmpeg", "-hide_banner", "-nostats",
+        "-v", "error",
+        "-ss", str(start), "-t", str(length),
+        "-i", file_path,
+        "-map", "0:v:0", "-map", "0:a?",
+        "-f", "null", "-"
+    ]
+
+
+def decode_errors(start: float, returncode: int, stderr: str) -> list:
+    """
+    The errors of one decoded sample.
+    """
+    errors = [
+        f"{start:.0f}s: {line}" for line in stderr.strip().splitlines()
+    ]
+    if returncode != 0 and not errors:
+        errors.append(f"{start:.0f}s: ffmpeg exited with code {returncode}")
+    return errors
+
+
+def new_result(output: dict | None) -> dict:
+    return {
+        "passed": False,
+        "duration": output["duration"] if output else None,
+        "streams": stream_counts(output) if output else None,
+        "samples": 0,
+        "problems": [],
+        "time": int(time.time()),
+    }
+
+
+def finish_verification(uid: str, job, result: dict, started: float):
+    """
+    Stores the result on the job and moves it on, or fails it.
+    """
+    result["problems"] = result["problems"][:MAX_ERRORS]
+    result["passed"] = not result["problems"]
+    result["seconds"] = round(time.monotonic() - started, 1)
+    job["verification"] = result
+    if result["passed"]:
+        print(f"Verified UID {uid} ({result['samples']} samples, "
+              f"{result['seconds']}s)")
+        job["status"] = next_status(job)
+    else:
+        job["status"] = "error"
+        job["error"] = f"Verification failed: {result['problems'][0]}"
+
+
+def verify_job(uid, data, data_lock):
+    """
+    Checks a job's encode. Steps of a verify job, see processes.py.
+    """
+    started = time.monotonic()
+    length = CONFIG.verify_sample_length
+    with data_lock:
+        file_path = encode_path(data[uid])
+        job = dict(data[uid])
+
+    try:
+        probe = yield Run(probe_command(file_path), "verify", PROBE_TIMEOUT,
+                          check=True)
+        output = summarize(json.loads(probe.stdout))
+    except subprocess.CalledProcessError as e:
+        output = None
+        error = f"ffprobe failed: {e.stderr.strip() or e}"
+    except subprocess.TimeoutExpired:
+        output = None
+        error = f"ffprobe timed out on {file_path}"
+    except (OSError, ValueError) as e:
+        output = None
+        error = f"ffprobe failed: {e}"
+
+    result = new_result(output)
+    if output is None:
+        result["problems"].append(error)
+    else:
+        result["problems"] = compare(
+            job, output, CONFIG.verify_max_duration_diff)
+
+    # A file that is too short or missing streams is not decoded
+    if not result["problems"]:
+        for start in sample_starts(
+                output["duration"], CONFIG.verify_samples, length):
+            try:
+                decode = yield Run(decode_command(file_path, start, length),
+                                   "verify", PROBE_TIMEOUT)
+                code, stderr = decode.returncode, decode.stderr
+            except subprocess.TimeoutExpired:
+                code, stderr = 1, f"decoding timed out after {PROBE_TIMEOUT}s"
+            result["samples"] += 1
+            result["problems"] += decode_errors(start, code, stderr)
+
+    with data_lock:
+        finish_verification(uid, data[uid], result, started)
@@ -0,0 +1,181 @@
+'''
+Wakes the daemon up when something happens instead of polling.
+Uses inotify on Linux to watch the project directory for input and flag files.
+Worker pipes can also be waited on so the daemon reacts straight away when a
+job reports back or finishes.
+If inotify is not available, the directory is polled instead.
+'''
+
+import ctypes
+import ctypes.util
+import fnmatch
+import os
+import select
+import struct
+from pathlib import Path
+
+# How often the directory is scanned when inotify is not available (seconds)
+POLL_INTERVAL = 1.0
+
+# inotify constants from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+)
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def _init_inotify(directory: Path) -> int | None:
+    '''
+    Sets up an inotify watch on a directory.
+    Returns the inotify file descriptor or None if inotify is unavailable.
+    '''
+    if not hasattr(os, "O_NONBLOCK"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+
+    wd = libc.inotify_add_watch(
+        fd, os.fsencode(str(directory)), WATCH_MASK)
+    if wd < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class Watcher:
+    '''
+    Waits for files matching patterns to change in a directory, or for
+    notify() to be called.
+    '''
+
+    def __init__(self, directory: Path, patterns: list[str]):
+        self.directory = Path(directory)
+        self.patterns = patterns
+
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+
+        self._inotify_fd = _init_inotify(self.directory)
+        self._snapshot = self._scan() if self._inotify_fd is None else {}
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._inotify_fd is not None
+
+    def _matches(self, name: str) -> bool:
+        return any(fnmatch.fnmatch(name, p) for p in self.patterns)
+
+    def _scan(self) -> dict:
+        '''
+        Returns the modification time of every matching file.
+        Only used when polling.
+        '''
+        snapshot = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if self._matches(entry.name):
+                    try:
+                        snapshot[entry.name] = entry.stat().st_mtime_ns
+                    except FileNotFoundError:
+                        pass
+        return snapshot
+
+    def _read_inotify(self) -> set | None:
+        '''
+        Reads all pending inotify events.
+        Returns None if events were lost and everything should be rechecked.
+        '''
+        changed = set()
+        while True:
+            try:
+                buffer = os.read(self._inotify_fd, 65536)
+            except BlockingIOError:
+                break
+            if not buffer:
+                break
+
+            offset = 0
+            while offset < len(buffer):
+                _, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+                offset += EVENT_HEADER.size
+                name = buffer[offset:offset + length].rstrip(b"\0")
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                name = os.fsdecode(name)
+                if self._matches(name):
+                    changed.add(name)
+        return changed
+
+    def _drain_wake_pipe(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def notify(self):
+        '''
+        Wakes up wait() from another thread.
+        '''
+        try:
+            os.write(self._wake_w, b"\0")
+        except BlockingIOError:
+            pass  # The pipe is already full so wait() will wake up anyway
+
+    def wait(self, timeout: float | None = None,
+             extra_fds: list = ()) -> set | None:
+        '''
+        Blocks until a watched file changes, notify() is called, one of
+        extra_fds becomes readable or the timeout (in seconds) runs out.
+        None waits forever.
+        Returns the names of the files that changed, which may be empty.
+        Returns None if changes may have been missed and every file should
+        be rechecked.
+        '''
+        readers = [self._wake_r, *extra_fds]
+        if self.uses_inotify:
+            readers.append(self._inotify_fd)
+        elif timeout is None or timeout > POLL_INTERVAL:
+            timeout = POLL_INTERVAL
+
+        ready, _, _ = select.select(readers, [], [], timeout)
+
+        if self._wake_r in ready:
+            self._drain_wake_pipe()
+
+        if self.uses_inotify:
+            if self._inotify_fd not in ready:
+                return set()
+            return self._read_inotify()
+
+        # Polling fallback
+        snapshot = self._scan()
+        changed = {
+            name for name in snapshot.keys() | self._snapshot.keys()
+            if snapshot.get(name) != self._snapshot.get(name)
+        }
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        for fd in (self._wake_r, self._wake_w, self._inotify_fd):
+            if fd is not None:
+                os.close(fd)
@@ -7,6 +7,9 @@ import time
 import json
 from functions.tmdb_client import get_media_info, get_episode_title
 from functions.config import load_config
+from functions.throughput import (
+    ThroughputModel, load_history, forecast, print_forecast, with_media_info
+)
 from pathlib import Path
 
 CONFIG = load_config()
@@ -19,6 +22,9 @@ OUTPUT_DIR = CONFIG.output_dir
 print(INPUT_DIR)
 
 qualities = tuple(CONFIG.quality_presets.keys())
+if CONFIG.preset_picker_enabled:
+    # The daemon encodes samples and picks a preset for each file
+    qualities += ("auto",)
 
 output = []
 defaultjob = {
@@ -28,19 +34,18 @@ defaultjob = {
     "quality": "",
     "type": "",
     "status": "not_started",
+    "priority": 0,
     "input_file": "",
     "encoded_file": "",
     "before_size": 0,
     "after_size": 0,
-    "percentage_encoded": 0,
     "percentage_copied": 0,
     "job_start_time": 0,
     "encode_start_time": 0,
     "encode_end_time": 0,
     "copy_start_time": 0,
     "copy_end_time": 0,
-    "job_end_time": 0,
-    "current_frames": 0
+    "job_end_time": 0
 }
 
 
@@ -132,6 +137,8 @@ defaultjob['year'] = survey.routines.numeric(
 print("WARNING: LOW QUALITY IS NOT CURRENTLY IMPLEMENTED!!!")
 defaultjob['quality'] = qualities[survey.routines.select(
     'Quality: ', options=qualities)]
+defaultjob['priority'] = survey.routines.numeric(
+    'Priority (higher runs first): ', value=0, decimal=False)
 
 files = []
 while not files:
@@ -219,5 +226,12 @@ else:
 for thingy in output:
     thingy["before_size"] = os.path.getsize(thingy['input_file'])
 
+# Forecast from earlier encodes, see plan.py for the whole queue
+print_forecast("This batch", forecast(
+    [with_media_info(thingy) for thingy in output],
+    ThroughputModel(load_history()),
+    CONFIG.max_encode_jobs
+))
+
 with open(f'input-{str(int(time.time()))}.json', 'w') as f:
     f.write(json.dumps(output))
@@ -0,0 +1,85 @@
+'''
+Forecasts how long the queue will take to encode and how big the output
+will be, from the encodes recorded in throughput.db.
+Run it without arguments for the current queue. Give it files or folders
+and a quality preset to see what a batch would add before submitting it:
+    python plan.py
+    python plan.py --quality high "/media/Show/Season 01"
+'''
+
+import argparse
+from pathlib import Path
+
+from functions.config import JOBS_DB_PATH, load_config
+from functions.eta import RUNNING_STATUSES, WAITING_STATUSES
+from functions.job_store import load_jobs
+from functions.throughput import (
+    ThroughputModel, load_history, forecast, print_forecast, with_media_info
+)
+
+CONFIG = load_config()
+
+VIDEO_EXTENSIONS = ('.mkv', '.mp4')
+
+
+def batch_files(paths: list) -> list:
+    '''
+    Returns every video file in the given files and folders.
+    '''
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(sorted(
+                p for p in path.rglob('*')
+                if p.suffix.lower() in VIDEO_EXTENSIONS))
+        elif path.suffix.lower() in VIDEO_EXTENSIONS:
+            files.append(path)
+        else:
+            print(f"Skipping {path}, not a video file or folder")
+    return files
+
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+parser.add_argument("paths", nargs="*",
+                    help="files or folders of a proposed batch")
+parser.add_argument("-q", "--quality", choices=CONFIG.quality_presets,
+                    help="quality preset of the proposed batch")
+parser.add_argument("-p", "--parallel", type=int,
+                    default=CONFIG.max_encode_jobs,
+                    help="encodes running at once (default: job_limits.encode)")
+args = parser.parse_args()
+if args.paths and not args.quality:
+    parser.error("a proposed batch needs --quality")
+
+model = ThroughputModel(load_history())
+summary = model.summary()
+if not summary:
+    print("No encodes recorded yet, forecasts need at least one finished "
+          "encode of a preset.")
+for (quality, resolution), prediction in sorted(summary.items()):
+    fps = f", {prediction['fps']:.1f} fps" if prediction["fps"] else ""
+    print(f"{quality} {resolution}: {prediction['speed']:.2f}x realtime"
+          f"{fps}, output {prediction['ratio']:.0%} of input "
+          f"({prediction['samples']} encodes)")
+print()
+
+queue = [
+    with_media_info(job) for job in load_jobs(JOBS_DB_PATH).values()
+    if job["status"] in WAITING_STATUSES + RUNNING_STATUSES
+]
+print_forecast("Queue", forecast(queue, model, args.parallel))
+
+if args.paths:
+    batch = [
+        with_media_info({
+            "input_file": str(file),
+            "quality": args.quality,
+            "before_size": file.stat().st_size,
+        })
+        for file in batch_files(args.paths)
+    ]
+    print()
+    print_forecast("Proposed batch", forecast(batch, model, args.parallel))
+    print()
+    print_forecast("Queue with batch",
+                   forecast(queue + batch, model, args.parallel))
@@ -0,0 +1,19 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The tests import the daemon's modules the same way the scripts do
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from functions.job_store import JobStore  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path):
+    '''
+    An empty job database.
+    '''
+    jobs = JobStore(tmp_path / "jobs.db")
+    yield jobs
+    jobs.close()
@@ -0,0 +1,53 @@
+from functions.audio import (
+    audio_args, audio_plan, describe_plan, kept_streams, parse_bitrate
+)
+
+
+def stream(index, codec, bit_rate=None, language="eng"):
+    return {"index": index, "codec": codec, "language": language,
+            "channels": 2, "bit_rate": bit_rate}
+
+
+def test_parse_bitrate():
+    assert parse_bitrate("160k") == 160000
+    assert parse_bitrate("1.5K") == 1500
+    assert parse_bitrate("96000") == 96000
+    assert parse_bitrate("") is None
+    assert parse_bitrate("fast") is None
+
+
+def test_kept_streams():
+    english = stream(2, "aac")
+    other = stream(1, "aac", language="jpn")
+    assert kept_streams([other, english]) == [english]
+    assert kept_streams([other, stream(3, "ac3", language="fra")]) == [other]
+    assert kept_streams([]) == []
+
+
+def test_audio_plan():
+    info = {"audio": [
+        stream(1, "eac3", 128000),
+        stream(2, "eac3", 640000),
+        stream(3, "dts", 96000),
+        stream(4, "ac3"),
+    ]}
+    plan = audio_plan(info, {"bitrate": "160k"})
+    # Too big, not a direct play codec, and an unknown bitrate
+    assert [s["action"] for s in plan] == ["copy", "aac", "aac", "aac"]
+    assert describe_plan(plan) == (
+        "eac3 (copy), eac3 -> aac, dts -> aac, ac3 -> aac")
+
+
+def test_audio_plan_copy_codecs_from_preset():
+    info = {"audio": [stream(1, "eac3", 128000)]}
+    assert audio_plan(info, {"bitrate": "160k", "audio_copy": []})[0][
+        "action"] == "aac"
+    assert audio_plan(info, {"bitrate": "none"})[0]["action"] == "aac"
+
+
+def test_audio_args():
+    plan = [{"action": "copy"}, {"action": "aac"}]
+    assert audio_args(plan, "160k") == [
+        "-c:a:0", "copy", "-c:a:1", "aac", "-b:a:1", "160k"]
+    assert audio_args(None, "160k") == ["-c:a", "aac", "-b:a", "160k"]
+    assert describe_plan([]) == "no audio"
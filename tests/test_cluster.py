@@ -0,0 +1,82 @@
+import pytest
+
+from functions.cluster import LeaseCoordinator, accepted_changes, send_request
+
+
+@pytest.fixture
+def coordinator():
+    coordinator = LeaseCoordinator("127.0.0.1", 0, "secret", 60)
+    yield coordinator
+    coordinator.close()
+
+
+def request(coordinator, message, secret="secret"):
+    host, port = coordinator._server.server_address
+    return send_request(host, port, {**message, "secret": secret})
+
+
+def test_accepted_changes():
+    assert accepted_changes({
+        "current_frame": 120,
+        "status": "encoding",
+        "error": "",
+        "progress": {"fps": 60.0},
+        "encoded_file": "/etc/passwd",
+        "input_file": "/",
+    }) == {
+        "current_frame": 120,
+        "status": "encoding",
+        "error": "",
+        "progress": {"fps": 60.0},
+    }
+    assert accepted_changes({
+        "status": "encoded", "current_frame": -1, "error": None}) == {}
+
+
+def test_needs_a_secret():
+    with pytest.raises(ValueError):
+        LeaseCoordinator("127.0.0.1", 0, "")
+
+
+def test_wrong_secret_is_refused(coordinator):
+    reply = request(coordinator, {"op": "lease", "worker": "w"}, "guess")
+    assert reply["ok"] is False
+
+
+def test_released_job_is_queued_again(coordinator, store, tmp_path):
+    output = tmp_path / "out.mkv"
+    output.write_bytes(b"partial")
+    other = tmp_path / "other.mkv"
+    other.write_bytes(b"keep")
+    store["1"] = {"status": "encoding", "encoded_file": str(output)}
+
+    coordinator.start("encode", "1", dict(store["1"]))
+    lease = request(coordinator, {"op": "lease", "worker": "w"})
+    assert lease["uid"] == "1"
+    assert request(coordinator, {
+        "op": "release", "uid": "1", "lease": lease["lease"],
+        "changes": {"current_frame": 50, "encoded_file": str(other)},
+    })["ok"]
+
+    assert coordinator.poll(store) == []
+    assert store["1"]["status"] == "ready_to_encode"
+    assert store["1"]["encoded_file"] == str(output)
+    # Only the daemon's own output path is removed
+    assert not output.exists()
+    assert other.exists()
+
+
+def test_finished_job(coordinator, store, tmp_path):
+    store["1"] = {"status": "encoding",
+                  "encoded_file": str(tmp_path / "out.mkv")}
+    coordinator.start("encode", "1", dict(store["1"]))
+    lease = request(coordinator, {"op": "lease", "worker": "w"})
+    assert request(coordinator, {
+        "op": "finish", "uid": "1", "lease": lease["lease"],
+        "changes": {"current_frame": 100},
+    })["ok"]
+    assert coordinator.poll(store) == [("encode", "1")]
+    assert store["1"]["current_frame"] == 100
+    # The lease is gone once the result was applied
+    assert request(coordinator, {
+        "op": "heartbeat", "uid": "1", "lease": lease["lease"]})["ok"] is False
@@ -0,0 +1,97 @@
+import errno
+import os
+
+import pytest
+
+from functions import copier
+from functions.copier import copy_chunks, move_to_library, partial_path
+
+DATA = bytes(range(256)) * 40  # 10 KiB
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    # Several chunks per file
+    monkeypatch.setattr(copier, "CHUNK_SIZE", 4096)
+    path = tmp_path / "source.mkv"
+    path.write_bytes(DATA)
+    return path
+
+
+def fail_with(error: int, calls: list, name: str):
+    def fail(*args):
+        calls.append(name)
+        raise OSError(error, os.strerror(error))
+    return fail
+
+
+def test_copy_falls_back_to_sendfile(tmp_path, source, monkeypatch):
+    calls = []
+    monkeypatch.setattr(os, "copy_file_range",
+                        fail_with(errno.EXDEV, calls, "copy_file_range"))
+    destination = tmp_path / "copy.mkv"
+
+    progress = list(copy_chunks(str(source), destination))
+    assert progress == [(4096, 10240), (8192, 10240), (10240, 10240)]
+    assert destination.read_bytes() == DATA
+    # The failing method is only tried once
+    assert calls == ["copy_file_range"]
+
+
+def test_copy_falls_back_to_pread(tmp_path, source, monkeypatch):
+    calls = []
+    monkeypatch.setattr(os, "copy_file_range",
+                        fail_with(errno.EXDEV, calls, "copy_file_range"))
+    monkeypatch.setattr(os, "sendfile",
+                        fail_with(errno.EINVAL, calls, "sendfile"))
+    destination = tmp_path / "copy.mkv"
+
+    list(copy_chunks(str(source), destination))
+    assert destination.read_bytes() == DATA
+    assert calls == ["copy_file_range", "sendfile"]
+
+
+def test_other_errors_are_not_retried(tmp_path, source, monkeypatch):
+    calls = []
+    monkeypatch.setattr(os, "copy_file_range",
+                        fail_with(errno.EIO, calls, "copy_file_range"))
+    with pytest.raises(OSError):
+        list(copy_chunks(str(source), tmp_path / "copy.mkv"))
+    assert calls == ["copy_file_range"]
+
+
+def test_failed_move_removes_the_part_file(tmp_path, source, monkeypatch):
+    monkeypatch.setattr(copier, "same_filesystem", lambda *paths: False)
+    monkeypatch.setattr(os, "copy_file_range",
+                        fail_with(errno.ENOSPC, [], "copy_file_range"))
+    destination = tmp_path / "library" / "movie.mkv"
+    destination.parent.mkdir()
+
+    with pytest.raises(OSError):
+        list(move_to_library(str(source), str(destination)))
+    assert not partial_path(destination).exists()
+    assert not destination.exists()
+    assert source.exists()
+
+
+def test_move_copies_to_another_filesystem(tmp_path, source, monkeypatch):
+    monkeypatch.setattr(copier, "same_filesystem", lambda *paths: False)
+    destination = tmp_path / "movie.mkv"
+
+    progress = list(move_to_library(str(source), str(destination)))
+    assert progress[-1] == (10240, 10240)
+    assert destination.read_bytes() == DATA
+    assert not partial_path(destination).exists()
+    assert not source.exists()
+
+
+def test_move_renames_on_the_same_filesystem(tmp_path, source, monkeypatch):
+    def no_copy(*args):
+        raise AssertionError("copied instead of renamed")
+    monkeypatch.setattr(copier, "copy_chunks", no_copy)
+    destination = tmp_path / "library" / "movie.mkv"
+    destination.parent.mkdir()
+
+    assert list(move_to_library(str(source), str(destination))) == []
+    assert destination.read_bytes() == DATA
+    assert not source.exists()
@@ -0,0 +1,78 @@
+from functions.eta import job_eta, queue_eta, smooth_progress
+from functions.throughput import ThroughputModel
+
+INFO = {"video": {"codec": "h264", "height": 1080}}
+
+# Encodes of "low" run at 2x realtime
+MODEL = ThroughputModel([{
+    "quality": "low", "codec": "h264", "resolution": "1080p",
+    "duration": 1800, "encode_seconds": 900, "frames": 0,
+    "before_size": 100, "after_size": 50,
+}] * 3)
+
+
+def encoding(current_frame, progress=None):
+    return {"status": "encoding", "quality": "low", "media_info": INFO,
+            "duration": 1000, "frames": 1000,
+            "current_frame": current_frame, "progress": progress}
+
+
+def test_smooth_progress_measures_speed():
+    job = encoding(100)
+    job["progress"] = smooth_progress(job, {"speed": 2.0}, now=1000)
+    assert job["progress"]["speed_avg"] == 2.0
+    assert job["progress"]["eta"] == 450
+
+    # 100 more seconds of video in 25 seconds is 4x
+    job["current_frame"] = 200
+    progress = smooth_progress(job, {"speed": 2.0}, now=1025)
+    assert progress["speed_avg"] == 4.0
+    assert job_eta({**job, "progress": progress}, now=1035) == 190
+
+
+def test_out_time_is_used_over_estimated_frames():
+    # The estimated frame count is too low, the encode is not done yet
+    job = encoding(1000)
+    progress = smooth_progress(
+        job, {"speed": 2.0, "out_time_us": 600 * 10**6}, now=1000)
+    assert progress["position"] == 600
+    assert progress["eta"] == 200
+
+
+def test_old_progress_is_not_measured_against():
+    job = encoding(100)
+    job["progress"] = smooth_progress(job, {"speed": 2.0}, now=1000)
+    job["current_frame"] = 900
+    progress = smooth_progress(job, {"speed": 3.0}, now=100000)
+    assert progress["since"] == 100000
+    assert progress["speed_avg"] == 3.0
+
+
+def test_queue_eta():
+    jobs = {
+        # Running at its own speed, 100 seconds left
+        "1": encoding(500, {"eta": 100, "updated": 1000}),
+        # Predicted from the model, half done at 2x
+        "2": encoding(500),
+        # Waiting, predicted at 2x
+        "3": {"status": "ready_to_encode", "quality": "low",
+              "media_info": INFO, "duration": 600},
+        # Nothing to predict from
+        "4": {"status": "ready_to_encode", "quality": "high",
+              "media_info": INFO, "duration": 600},
+        "5": {"status": "encoded", "quality": "low", "duration": 600},
+    }
+    assert queue_eta(jobs, MODEL, now=1000) == (100 + 250 + 300) / 2
+    # Never fewer than the encodes running now
+    assert queue_eta(jobs, MODEL, parallel=1, now=1000) == 650 / 2
+    assert queue_eta(jobs, MODEL, parallel=4, now=1000) == 650 / 4
+    assert queue_eta({"4": jobs["4"]}, MODEL) is None
+
+
+def test_idle_queue_is_shared_between_encode_slots():
+    jobs = {
+        str(uid): {"status": "ready_to_encode", "quality": "low",
+                   "media_info": INFO, "duration": 600}
+        for uid in range(4)
+    }
+    assert queue_eta(jobs, MODEL, parallel=2) == 4 * 300 / 2
@@ -0,0 +1,43 @@
+from functions.job import DROPPED_FIELDS, JOB_DEFAULTS, Job
+
+
+def test_to_dict_omits_defaults():
+    job = Job({"name": "a", "status": "not_started", "frames": 0,
+               "tmdb_id": 12})
+    assert job.to_dict() == {"name": "a", "tmdb_id": 12}
+
+
+def test_dropped_fields_are_discarded():
+    job = Job({field: 1 for field in DROPPED_FIELDS})
+    assert job.to_dict() == {}
+    for field in DROPPED_FIELDS:
+        assert field not in job
+        job[field] = 2
+    assert job.to_dict() == {}
+
+
+def test_removing_a_field_resets_it(store):
+    uid = store.add({"status": "encoding", "error": "boom", "extra": 1})
+    store.commit()
+    job = store[uid]
+
+    assert job.pop("error") == "boom"
+    assert job["error"] == JOB_DEFAULTS["error"]
+    del job["status"]
+    assert job["status"] == "not_started"
+    assert store.uids_with_status("not_started") == [uid]
+
+    # Unknown fields are really removed
+    del job["extra"]
+    assert "extra" not in job
+    assert job.pop("extra", None) is None
+    assert store.commit()
+    assert store[uid].to_dict() == {}
+
+
+def test_dict_round_trip():
+    job = Job({"name": "a", "quality": "high", "progress": {"eta": 5},
+               "tmdb_id": 12})
+    copy = dict(job)
+    assert set(copy) == set(JOB_DEFAULTS) | {"tmdb_id"}
+    assert Job(copy).to_dict() == job.to_dict()
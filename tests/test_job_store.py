@@ -0,0 +1,107 @@
+import json
+import sqlite3
+
+from functions.job_store import JobStore, JobStoreReader, load_jobs
+
+
+def saved_rows(db_path) -> dict:
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT uid, status, job FROM jobs")
+        return {
+            str(uid): (status, json.loads(job)) for uid, status, job in rows
+        }
+    finally:
+        conn.close()
+
+
+def test_migrate_json(tmp_path, store):
+    old = tmp_path / "data.json"
+    old.write_text(json.dumps({
+        "1": {"name": "a", "status": "encoded", "percentage_encoded": 50},
+        "4": {"name": "b", "status": "ready_to_encode"},
+    }))
+
+    assert store.migrate_json(old) == 2
+    assert not old.exists()
+    assert (tmp_path / "data.json.migrated").exists()
+    rows = saved_rows(store.db_path)
+    assert rows["1"] == ("encoded", {"name": "a", "status": "encoded"})
+    assert rows["4"][0] == "ready_to_encode"
+    assert store.add({"name": "c"}) == "5"
+
+
+def test_migrate_json_skips_a_database_with_jobs(tmp_path, store):
+    store.add({"name": "a"})
+    old = tmp_path / "data.json"
+    old.write_text(json.dumps({"7": {"name": "b"}}))
+
+    assert store.migrate_json(old) == 0
+    assert old.exists()
+    assert list(store) == ["1"]
+
+
+def test_status_index_follows_status_changes(store):
+    first = store.add({"status": "ready_to_encode"})
+    second = store.add({"status": "ready_to_encode"})
+    assert store.uids_with_status("ready_to_encode") == [first, second]
+
+    store[first]["status"] = "encoding"
+    assert store.uids_with_status("ready_to_encode") == [second]
+    assert store.uids_with_status("encoding") == [first]
+    assert store.uids_with_status("ready_to_encode", 0) == []
+
+    del store[second]
+    assert store.count_with_status("ready_to_encode") == 0
+    # Replacing a job moves it to the status of the new one
+    store[first] = {"status": "error"}
+    assert store.uids_with_status("encoding") == []
+    assert store.uids_with_status("error") == [first]
+
+
+def test_commit_only_writes_changes(store):
+    for name in ("a", "b", "c"):
+        store.add({"name": name})
+    assert store.commit()
+    assert not store.commit()
+
+    changes = store._conn.total_changes
+    store["2"]["name"] = "B"
+    del store["3"]
+    assert store.commit()
+    # One row replaced and one deleted
+    assert store._conn.total_changes - changes == 2
+
+    rows = saved_rows(store.db_path)
+    assert sorted(rows) == ["1", "2"]
+    assert rows["2"][1] == {"name": "B"}
+
+
+def test_next_uid_after_reopening(tmp_path):
+    db_path = tmp_path / "jobs.db"
+    store = JobStore(db_path)
+    store.add({"name": "a"})
+    store["9"] = {"name": "b"}
+    store.close()
+
+    store = JobStore(db_path)
+    try:
+        assert store["9"]["name"] == "b"
+        assert store.add({"name": "c"}) == "10"
+    finally:
+        store.close()
+    assert list(load_jobs(db_path)) == ["1", "9", "10"]
+
+
+def test_reader_sees_commits(store):
+    store.add({"name": "a"})
+    store.commit()
+    reader = JobStoreReader(store.db_path)
+    assert reader.has_changed()
+    assert not reader.has_changed()
+
+    store["1"]["status"] = "encoding"
+    assert not reader.has_changed()
+    store.commit()
+    assert reader.has_changed()
+    assert reader.load()["1"]["status"] == "encoding"
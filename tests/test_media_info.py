@@ -0,0 +1,58 @@
+from functions.media_info import stream_languages, summarize
+
+PROBE = {
+    "format": {
+        "format_name": "matroska,webm",
+        "duration": "1370.500000",
+        "size": "208322610",
+        "bit_rate": "1216054",
+    },
+    "streams": [
+        {"index": 0, "codec_type": "video", "codec_name": "h264",
+         "profile": "High", "width": 1920, "height": 1080,
+         "pix_fmt": "yuv420p", "avg_frame_rate": "24000/1001",
+         "tags": {"BPS-eng": "1080000"}},
+        {"index": 1, "codec_type": "video", "codec_name": "mjpeg",
+         "disposition": {"attached_pic": 1}},
+        {"index": 2, "codec_type": "audio", "codec_name": "eac3",
+         "channels": 6, "tags": {"language": "eng", "BPS": "640000"}},
+        {"index": 3, "codec_type": "audio", "codec_name": "aac",
+         "channels": 2, "bit_rate": "128000"},
+        {"index": 4, "codec_type": "subtitle", "codec_name": "subrip",
+         "tags": {"language": "eng"}},
+    ],
+}
+
+
+def test_summarize():
+    info = summarize(PROBE)
+    assert info["container"] == "matroska,webm"
+    assert info["duration"] == 1370.5
+    assert info["size"] == 208322610
+    assert info["video"]["codec"] == "h264"
+    assert round(info["video"]["frame_rate"], 3) == 23.976
+    assert info["video"]["frames"] is None
+    assert [s["index"] for s in info["audio"]] == [2, 3]
+    assert info["subtitles"] == [
+        {"index": 4, "codec": "subrip", "language": "eng"}]
+
+
+def test_bitrate_falls_back_to_the_bps_tag():
+    info = summarize(PROBE)
+    assert info["video"]["bit_rate"] == 1080000
+    assert [s["bit_rate"] for s in info["audio"]] == [640000, 128000]
+
+
+def test_cover_art_is_not_the_video():
+    probe = {"streams": [PROBE["streams"][1], PROBE["streams"][0]]}
+    assert summarize(probe)["video"]["index"] == 0
+
+
+def test_missing_values():
+    info = summarize({"streams": [
+        {"index": 0, "codec_type": "audio", "codec_name": "aac",
+         "bit_rate": "N/A"}]})
+    assert info["duration"] is None
+    assert info["video"] is None
+    assert info["audio"][0]["bit_rate"] is None
+    assert stream_languages(info, "a") == ["und"]
@@ -0,0 +1,40 @@
+from functions.config import Config
+from functions.prefetch import PrefetchCache
+
+
+def test_load_only_removes_copies(tmp_path):
+    stale = tmp_path / "3-0123abcd"
+    kept = tmp_path / "4-89abcdef"
+    encode = tmp_path / "5"  # a scratch_dir job folder
+    for folder in (stale, kept, encode):
+        folder.mkdir()
+    (kept / "a.mkv").write_bytes(b"x" * 10)
+    (encode / "b.mkv").write_bytes(b"y")
+
+    cache = PrefetchCache(tmp_path, 100)
+    data = {
+        "4": {"status": "ready_to_encode", "before_size": 10,
+              "cached_input": str(kept / "a.mkv")},
+    }
+    cache.load(data)
+
+    assert not stale.exists()
+    assert (kept / "a.mkv").exists()
+    assert (encode / "b.mkv").exists()
+    assert list(cache.entries) == ["4"]
+
+
+def prefetch_config(cache_dir, **folders) -> Config:
+    return Config({
+        "site": {},
+        "prefetch": {"enabled": True, "cache_dir": str(cache_dir)},
+        **{name: str(folder) for name, folder in folders.items()},
+    })
+
+
+def test_cache_dir_in_other_folders_is_refused(tmp_path):
+    cache = tmp_path / "cache"
+    assert not prefetch_config(cache, scratch_dir=cache).prefetch_enabled
+    assert not prefetch_config(cache, input_dir=tmp_path).prefetch_enabled
+    assert prefetch_config(
+        cache, scratch_dir=tmp_path / "scratch").prefetch_enabled
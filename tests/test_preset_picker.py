@@ -0,0 +1,65 @@
+import math
+
+from functions.preset_picker import (
+    choose_preset, parse_metric, sample_times, summarize_samples
+)
+
+MEASUREMENTS = {
+    "fast": {"speed": 4.0, "size_ratio": 0.7, "score": 0.95},
+    "medium": {"speed": 2.0, "size_ratio": 0.45, "score": 0.975},
+    "slow": {"speed": 0.5, "size_ratio": 0.4, "score": 0.99},
+}
+
+
+def test_fastest_preset_meeting_the_size_target():
+    assert choose_preset(MEASUREMENTS, "size", 0.5, 0) == "medium"
+    assert choose_preset(MEASUREMENTS, "size", 0.8, 0) == "fast"
+
+
+def test_fastest_preset_meeting_the_quality_target():
+    assert choose_preset(MEASUREMENTS, "quality", 0, 0.97) == "medium"
+    assert choose_preset(MEASUREMENTS, "quality", 0, 0.98) == "slow"
+
+
+def test_closest_preset_when_none_meets_the_target():
+    assert choose_preset(MEASUREMENTS, "size", 0.3, 0) == "slow"
+    assert choose_preset(MEASUREMENTS, "quality", 0, 0.999) == "slow"
+    # Presets that could not be measured are never closest
+    unmeasured = {
+        "a": {"speed": None, "size_ratio": None, "score": None},
+        "b": {"speed": 1.0, "size_ratio": 0.9, "score": None},
+    }
+    assert choose_preset(unmeasured, "size", 0.5, 0) == "b"
+
+
+def test_summarize_samples():
+    # Two 10 second samples of a 1000 second, 1 GB input, encoded at 2x
+    samples = [(10, 5, 2_000_000, 0.98), (10, 5, 3_000_000, None)]
+    summary = summarize_samples({"bitrate": "128k"}, samples, 1000,
+                                1_000_000_000)
+    assert summary["speed"] == 2.0
+    assert summary["score"] == 0.98
+    # 250 MB of video and 16 MB of audio
+    assert math.isclose(summary["size_ratio"], 0.266)
+
+    summary = summarize_samples({}, samples, 0, 0)
+    assert summary["size_ratio"] is None
+
+
+def test_sample_times():
+    assert sample_times(1000, 3, 10) == [245.0, 495.0, 745.0]
+    # Too short for the samples
+    assert sample_times(25, 3, 10) == [0]
+    assert sample_times(0, 3, 10) == [0]
+
+
+def test_parse_metric():
+    ssim = ("[Parsed_ssim_0 @ 0x5581] SSIM Y:0.991 (20.5) U:0.995 (23.1) "
+            "V:0.994 (22.4) All:0.989 (19.7)")
+    psnr = ("[Parsed_psnr_0 @ 0x5581] PSNR y:41.20 u:44.01 v:43.80 "
+            "average:42.03 min:38.11 max:48.20")
+    assert parse_metric(f"frame=  240\n{ssim}\n", "ssim") == 0.989
+    assert parse_metric(psnr, "psnr") == 42.03
+    # Identical frames
+    assert parse_metric(psnr.replace("42.03", "inf"), "psnr") == math.inf
+    assert parse_metric("Conversion failed!", "ssim") is None
@@ -0,0 +1,65 @@
+from functions.command_runner import ProgressParser, parse_progress_block
+
+BLOCK = """\
+frame=1200
+fps=59.94
+stream_0_0_q=28.0
+bitrate= 812.4kbits/s
+total_size=5242880
+out_time_us=50050000
+out_time=00:00:50.050000
+dup_frames=0
+drop_frames=0
+speed=2.5x
+"""
+
+
+def feed_block(parser, progress="continue"):
+    results = [parser.feed(line) for line in BLOCK.splitlines()]
+    assert results == [None] * len(results)
+    return parser.feed(f"progress={progress}\n")
+
+
+def test_parse_progress_block():
+    block = dict(line.split("=", 1) for line in BLOCK.splitlines())
+    assert parse_progress_block(block) == {
+        "frame": 1200,
+        "fps": 59.94,
+        "bitrate": 812.4,
+        "total_size": 5242880,
+        "out_time_us": 50050000,
+        "speed": 2.5,
+    }
+
+
+def test_unknown_values_are_none():
+    progress = parse_progress_block({
+        "frame": "0", "bitrate": "N/A", "speed": "N/A", "total_size": "N/A"
+    })
+    assert progress["frame"] == 0
+    assert progress["bitrate"] is None
+    assert progress["speed"] is None
+    assert progress["total_size"] is None
+    assert progress["out_time_us"] is None
+
+
+def test_parser_publishes_at_most_once_per_interval():
+    parser = ProgressParser(interval=3600)
+    first = feed_block(parser)
+    assert first["frame"] == 1200
+    # Parsed, but too soon after the first one to publish
+    assert feed_block(parser) is None
+    assert parser.latest == first
+
+
+def test_parser_always_publishes_the_end():
+    parser = ProgressParser(interval=3600)
+    feed_block(parser)
+    assert feed_block(parser, "end")["speed"] == 2.5
+
+
+def test_parser_ignores_other_output():
+    parser = ProgressParser(interval=0)
+    assert parser.feed("Press [q] to stop\n") is None
+    assert parser.feed("\n") is None
+    assert feed_block(parser)["fps"] == 59.94
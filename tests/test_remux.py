@@ -0,0 +1,61 @@
+from functions.remux import remux_reason, video_bitrate
+from functions.throughput import ThroughputModel
+
+PRESET = {"remux": {"codecs": ["hevc", "h264"], "max_bitrate": 2000,
+                    "min_saving": 0.2}}
+
+
+def job(codec="hevc", height=1080, bit_rate=None):
+    return {
+        "quality": "low",
+        "media_info": {
+            "bit_rate": None,
+            "video": {"codec": codec, "width": height * 16 // 9,
+                      "height": height, "bit_rate": bit_rate},
+        },
+    }
+
+
+def model(codec, ratio, samples=3):
+    return ThroughputModel([{
+        "quality": "low", "codec": codec, "resolution": "1080p",
+        "duration": 1800, "encode_seconds": 900, "frames": 0,
+        "before_size": 1000, "after_size": int(1000 * ratio),
+    }] * samples)
+
+
+def test_video_bitrate():
+    assert video_bitrate({"video": {"bit_rate": 1500000}}) == 1500
+    assert video_bitrate({"video": {"bit_rate": None},
+                          "bit_rate": 900000}) == 900
+    assert video_bitrate({"video": None, "bit_rate": None}) is None
+
+
+def test_low_bitrate_is_remuxed():
+    assert remux_reason(job(bit_rate=1500000), PRESET, model("hevc", 0.5))
+    assert not remux_reason(job(bit_rate=2500000), PRESET,
+                            model("hevc", 0.5))
+
+
+def test_max_bitrate_scales_with_resolution():
+    # 2000 kbit/s at 1080p is 8000 kbit/s at 2160p
+    assert remux_reason(job(height=2160, bit_rate=7000000), PRESET,
+                        model("hevc", 0.5))
+
+
+def test_small_saving_is_remuxed():
+    assert remux_reason(job(), PRESET, model("hevc", 0.9))
+    assert not remux_reason(job(), PRESET, model("hevc", 0.5))
+
+
+def test_saving_only_from_the_same_codec():
+    # H.264 encodes say nothing about how much HEVC inputs shrink
+    assert not remux_reason(job("hevc"), PRESET, model("h264", 0.9))
+    assert remux_reason(job("h264"), PRESET, model("h264", 0.9))
+
+
+def test_codec_and_preset_must_allow_it():
+    assert not remux_reason(job("mpeg2video"), PRESET, model("hevc", 0.9))
+    assert not remux_reason(job(bit_rate=1000), {}, model("hevc", 0.9))
+    assert not remux_reason({"quality": "low", "media_info": None}, PRESET,
+                            model("hevc", 0.9))
@@ -0,0 +1,99 @@
+from functions.job_creation import EncodeScheduler, job_cost
+
+GIB = 1024 ** 3
+
+
+def add(store, uid, show, size_gib, queued_time=1000, priority=0):
+    store[uid] = {
+        "id": show,
+        "status": "ready_to_encode",
+        "before_size": int(size_gib * GIB),
+        "queued_time": queued_time,
+        "priority": priority,
+    }
+
+
+def queue(store, **settings):
+    scheduler = EncodeScheduler(**settings)
+    scheduler.sync(store)
+    return scheduler
+
+
+def test_job_cost():
+    job = {"before_size": 2 * GIB, "duration": 1800}
+    assert job_cost(job, "size") == 2
+    assert job_cost(job, "duration") == 30
+    assert job_cost({"before_size": GIB}, "duration") == 1
+    assert job_cost(job, "fifo") == 1
+
+
+def test_shortest_job_first(store):
+    add(store, "1", "a", 5)
+    add(store, "2", "a", 1)
+    add(store, "3", "a", 3)
+    scheduler = queue(store, policy="size", fair_share=False)
+    assert scheduler.pop(store, 3) == ["2", "3", "1"]
+
+
+def test_fifo_keeps_uid_order(store):
+    for uid, size in (("3", 1), ("1", 5), ("2", 2)):
+        add(store, uid, "a", size)
+    scheduler = queue(store, policy="fifo", fair_share=False)
+    assert scheduler.pop(store, 3) == ["1", "2", "3"]
+
+
+def test_higher_priority_first(store):
+    add(store, "1", "a", 1)
+    add(store, "2", "a", 10, priority=5)
+    scheduler = queue(store, policy="size")
+    assert scheduler.pop(store, 2) == ["2", "1"]
+
+
+def test_aging_moves_old_big_jobs_forward(store):
+    # Queued ten hours earlier, which is worth 10 GiB at 1 GiB per hour
+    add(store, "1", "a", 8, queued_time=3600)
+    add(store, "2", "a", 1, queued_time=11 * 3600)
+    assert queue(store, policy="size", aging_per_hour=1,
+                 fair_share=False).pop(store, 2) == ["1", "2"]
+    assert queue(store, policy="size", aging_per_hour=0,
+                 fair_share=False).pop(store, 2) == ["2", "1"]
+
+
+def test_fair_share_takes_turns(store):
+    for uid in ("1", "2", "3", "4"):
+        add(store, uid, "season", 1)
+    add(store, "5", "movie", 2)
+    scheduler = queue(store, policy="size", fair_share=True)
+    # The movie runs once the season has been given as much as it costs
+    assert scheduler.pop(store, 5) == ["1", "2", "5", "3", "4"]
+
+
+def test_pop_skips_jobs_that_stopped_waiting(store):
+    add(store, "1", "a", 1)
+    add(store, "2", "a", 2)
+    scheduler = queue(store, policy="size")
+    store["1"]["status"] = "error"
+    assert scheduler.pop(store, 2) == ["2"]
+
+
+def test_peek_does_not_remove(store):
+    add(store, "1", "a", 1)
+    add(store, "2", "b", 2)
+    scheduler = queue(store, policy="size")
+    assert scheduler.peek(store, 2) == ["1", "2"]
+    assert scheduler.pop(store, 2) == ["1", "2"]
+    assert scheduler.pop(store, 2) == []
+
+
+def test_unpop_refunds_the_show(store):
+    add(store, "1", "a", 1)
+    add(store, "2", "a", 1)
+    add(store, "3", "b", 1.5)
+    scheduler = queue(store, policy="size", fair_share=True)
+    # Job 1 can not start (no space), it keeps its place and show a is not
+    # charged for it however often that happens
+    for _ in range(3):
+        scheduler.sync(store)
+        assert scheduler.pop(store, 1) == ["1"]
+        scheduler.unpop("1")
+    assert scheduler.pop(store, 3) == ["1", "3", "2"]
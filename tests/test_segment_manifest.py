@@ -0,0 +1,73 @@
+from functions.segment_encoder import (
+    encoded_segment, mark_segment_done, new_manifest, prepare_work_dir,
+    segment_settings, segment_times, use_segments
+)
+
+
+def split(work_dir, count=3):
+    for no in range(count):
+        (work_dir / f"source-{no:03}.mkv").write_bytes(b"source")
+
+
+def started(tmp_path):
+    source = tmp_path / "in.mkv"
+    source.write_bytes(b"input")
+    settings = segment_settings(str(source), {"crf": 24}, 300)
+    work_dir = tmp_path / ".out.segments"
+    assert prepare_work_dir(work_dir, settings, resume=True) is None
+    split(work_dir)
+    return work_dir, settings, new_manifest(work_dir, settings)
+
+
+def finish(work_dir, manifest, index, frames=100):
+    name = manifest["sources"][index]
+    encoded_segment(work_dir, name, partial=True).write_bytes(b"encoded")
+    mark_segment_done(work_dir, manifest, index, frames)
+
+
+def test_segment_times():
+    assert segment_times(1100, 300) == [300, 600, 900]
+    # A last piece shorter than half a segment joins the one before
+    assert segment_times(1000, 300) == [300, 600]
+    assert segment_times(200, 300) == []
+
+
+def test_use_segments():
+    assert use_segments(3600, True, 3600)
+    assert not use_segments(3599, True, 3600)
+    assert not use_segments(7200, False, 3600)
+    assert not use_segments(0, True, 0)
+
+
+def test_resume_keeps_finished_segments(tmp_path):
+    work_dir, settings, manifest = started(tmp_path)
+    finish(work_dir, manifest, 0)
+    # Interrupted while the second segment was being encoded
+    partial = encoded_segment(work_dir, manifest["sources"][1], partial=True)
+    partial.write_bytes(b"half")
+
+    resumed = prepare_work_dir(work_dir, settings, resume=True)
+    assert resumed["done"] == {"0": 100}
+    assert encoded_segment(work_dir, manifest["sources"][0]).exists()
+    assert not partial.exists()
+
+
+def test_changed_settings_start_over(tmp_path):
+    work_dir, settings, manifest = started(tmp_path)
+    finish(work_dir, manifest, 0)
+    changed = {**settings, "quality": {"crf": 20}}
+    assert prepare_work_dir(work_dir, changed, resume=True) is None
+    assert list(work_dir.iterdir()) == []
+
+
+def test_missing_source_starts_over(tmp_path):
+    work_dir, settings, manifest = started(tmp_path)
+    (work_dir / manifest["sources"][2]).unlink()
+    assert prepare_work_dir(work_dir, settings, resume=True) is None
+
+
+def test_no_resume_starts_over(tmp_path):
+    work_dir, settings, manifest = started(tmp_path)
+    finish(work_dir, manifest, 0)
+    assert prepare_work_dir(work_dir, settings, resume=False) is None
+    assert list(work_dir.iterdir()) == []
@@ -0,0 +1,115 @@
+import os
+
+from functions.space_ledger import RESERVE_MARGIN, SpaceLedger
+from functions.throughput import ThroughputModel
+
+GIB = 1024 ** 3
+
+
+class FixedFreeSpace:
+    '''
+    Reports the same free space for every path, like StorageMetrics.
+    '''
+
+    def __init__(self, free: int):
+        self.free_bytes = free
+
+    def free(self, path) -> int:
+        return self.free_bytes
+
+    def invalidate(self):
+        pass
+
+
+def encode(encoded_file, size_gib, status="ready_to_encode", **fields):
+    return {
+        "status": status,
+        "quality": "low",
+        "encoded_file": str(encoded_file),
+        "before_size": int(size_gib * GIB),
+        "duration": 1800,
+        "media_info": {"video": {"codec": "h264", "height": 1080}},
+        **fields,
+    }
+
+
+def ledger_with(free_gib, buffer_gib=1, ratio=None):
+    ledger = SpaceLedger(buffer_gib * GIB, FixedFreeSpace(free_gib * GIB))
+    history = [{
+        "quality": "low", "codec": "h264", "resolution": "1080p",
+        "duration": 1800, "encode_seconds": 900, "frames": 0,
+        "before_size": 100, "after_size": int(100 * ratio),
+    }] * 3 if ratio else []
+    ledger.model = ThroughputModel(history)
+    return ledger
+
+
+def test_projected_size(tmp_path):
+    job = encode(tmp_path / "out.mkv", 4, remux="")
+    assert ledger_with(100).projected_size(job) == 4 * GIB
+    assert ledger_with(100, ratio=0.5).projected_size(job) == int(
+        4 * GIB * 0.5 * RESERVE_MARGIN)
+    # Remuxes copy every stream
+    job["remux"] = "efficient already"
+    assert ledger_with(100, ratio=0.5).projected_size(job) == 4 * GIB
+
+
+def test_reserve_keeps_the_buffer(store, tmp_path):
+    store["1"] = encode(tmp_path / "one.mkv", 4)
+    ledger = ledger_with(5, buffer_gib=1)
+    assert ledger.reserve("1", store)
+    ledger = ledger_with(4.5, buffer_gib=1)
+    assert not ledger.reserve("1", store)
+    assert ledger.blocked == {"1"}
+
+
+def test_reservations_add_up_until_written(store, tmp_path):
+    store["1"] = encode(tmp_path / "one.mkv", 4)
+    store["2"] = encode(tmp_path / "two.mkv", 4)
+    ledger = ledger_with(7, buffer_gib=0)
+    assert ledger.reserve("1", store)
+    store["1"]["status"] = "encoding"
+    assert not ledger.reserve("2", store)
+
+    # What the first encode wrote is counted by the filesystem instead
+    store["1"]["progress"] = {"total_size": 3 * GIB}
+    ledger.metrics.free_bytes -= 3 * GIB
+    assert ledger.outstanding(ledger.reservations["1"][0], store) == GIB
+    assert not ledger.reserve("2", store)
+
+    # It finished smaller than reserved
+    store["1"]["status"] = "encoded"
+    ledger.sync(store)
+    assert ledger.reserve("2", store)
+
+
+def test_reserve_uses_the_planned_job(store, tmp_path):
+    store["1"] = encode(tmp_path / "one.mkv", 4, remux="")
+    ledger = ledger_with(3, buffer_gib=0, ratio=0.5)
+    planned = {**dict(store["1"]), "remux": "efficient already"}
+    assert ledger.reserve("1", store)
+    del ledger.reservations["1"]
+    assert not ledger.reserve("1", store, planned)
+
+
+def test_sync_releases_stopped_jobs(store, tmp_path):
+    store["1"] = encode(tmp_path / "one.mkv", 4)
+    ledger = ledger_with(100)
+    assert ledger.reserve("1", store)
+    store["1"]["status"] = "encoding"
+    ledger.sync(store)
+    assert "1" in ledger.reservations
+    store["1"]["status"] = "error"
+    ledger.sync(store)
+    assert ledger.reservations == {}
+
+
+def test_copy_within_one_filesystem_needs_nothing(store, tmp_path):
+    scratch = tmp_path / "scratch.mkv"
+    scratch.write_bytes(b"x")
+    store["1"] = encode(tmp_path / "out.mkv", 4, status="ready_to_copy",
+                        scratch_file=str(scratch), after_size=2 * GIB)
+    ledger = ledger_with(0, buffer_gib=0)
+    assert ledger.target(store["1"]) == (tmp_path, 0)
+    assert ledger.reserve("1", store)
+    assert os.stat(tmp_path).st_dev == ledger.reservations["1"][0]
@@ -0,0 +1,67 @@
+from functions.job import Job
+from functions.throughput import (
+    ThroughputModel, encode_stats, load_history, record_encode,
+    resolution_class
+)
+
+
+def finished(**fields):
+    return Job({
+        "quality": "low",
+        "duration": 1800,
+        "frames": 43200,
+        "before_size": 1000,
+        "after_size": 400,
+        "encode_start_time": 1000,
+        "encode_end_time": 1900,
+        "media_info": {"video": {"codec": "h264", "height": 1040}},
+        **fields,
+    }, "1")
+
+
+def history(codec, resolution, speed, ratio, count=3):
+    return [{
+        "quality": "low", "codec": codec, "resolution": resolution,
+        "duration": 100 * speed, "encode_seconds": 100, "frames": 0,
+        "before_size": 100, "after_size": 100 * ratio,
+    }] * count
+
+
+def test_resolution_class():
+    assert resolution_class(480) == "sd"
+    assert resolution_class(1040) == "1080p"
+    assert resolution_class(2160) == "2160p"
+    assert resolution_class(None) == ""
+
+
+def test_encode_stats():
+    stats = encode_stats(finished())
+    assert stats["codec"] == "h264"
+    assert stats["resolution"] == "1080p"
+    assert stats["encode_seconds"] == 900
+
+
+def test_encode_stats_leaves_out_what_would_mislead():
+    assert encode_stats(finished(remux="efficient already")) is None
+    # Only the segments left after a restart were timed
+    assert encode_stats(finished(resumed=True)) is None
+    assert encode_stats(finished(encode_start_time=0)) is None
+    assert encode_stats(finished(after_size=0)) is None
+
+
+def test_record_encode(tmp_path):
+    db_path = tmp_path / "throughput.db"
+    assert record_encode(finished(), db_path)
+    assert not record_encode(finished(resumed=True), db_path)
+    assert [row["after_size"] for row in load_history(db_path)] == [400]
+
+
+def test_predict_falls_back_to_wider_groups():
+    model = ThroughputModel(
+        history("h264", "1080p", 2, 0.5)
+        + history("hevc", "1080p", 4, 0.9, count=1))
+    assert model.predict("low", "hevc", "1080p")["samples"] == 4
+    assert model.predict("low", "hevc", "1080p", exact=True) == {
+        "speed": 4, "ratio": 0.9, "fps": None, "samples": 1}
+    assert model.predict("low", "av1", "2160p", exact=True) is None
+    assert model.predict("high") is None
@@ -0,0 +1,71 @@
+from functions.verifier import (
+    compare, decode_errors, expected_streams, next_status, sample_starts
+)
+
+
+def stream(language="eng"):
+    return {"language": language}
+
+
+SOURCE = {
+    "duration": 1370.5,
+    "video": {"codec": "h264"},
+    "audio": [stream(), stream("jpn")],
+    "subtitles": [stream("fra"), stream("spa")],
+}
+
+
+def output(duration=1370.6, audio=1, subtitles=1):
+    return {
+        "duration": duration,
+        "video": {"codec": "hevc"},
+        "audio": [stream()] * audio,
+        "subtitles": [stream()] * subtitles,
+    }
+
+
+def test_expected_streams():
+    # English audio only, the first subtitle stream if none is English
+    assert expected_streams(SOURCE) == {
+        "video": 1, "audio": 1, "subtitles": 1}
+
+
+def test_compare_passes():
+    job = {"media_info": SOURCE, "duration": 1370.5}
+    assert compare(job, output(), 2.0) == []
+
+
+def test_compare_finds_problems():
+    job = {"media_info": SOURCE, "duration": 1370.5}
+    assert compare(job, output(duration=600, audio=0), 2.0) == [
+        "0 audio streams instead of 1",
+        "output is 600.0s long instead of 1370.5s",
+    ]
+    assert compare(job, output(duration=None), 2.0) == [
+        "output has no duration"]
+
+
+def test_compare_without_media_info():
+    job = {"media_info": None, "duration": 0}
+    assert compare(job, output(audio=3), 2.0) == []
+
+
+def test_sample_starts():
+    assert sample_starts(100, 5, 10) == [0, 22.5, 45, 67.5, 90]
+    assert sample_starts(100, 1, 10) == [90]
+    assert sample_starts(5, 3, 10) == [0]
+    assert sample_starts(0, 3, 10) == []
+    assert sample_starts(100, 0, 10) == []
+
+
+def test_decode_errors():
+    assert decode_errors(90, 0, "") == []
+    assert decode_errors(90, 0, "bad packet\nmissing ref\n") == [
+        "90s: bad packet", "90s: missing ref"]
+    assert decode_errors(12.4, 1, "") == ["12s: ffmpeg exited with code 1"]
+
+
+def test_next_status():
+    assert next_status({"scratch_file": "/scratch/1/out.mkv"}) == (
+        "ready_to_copy")
+    assert next_status({"scratch_file": ""}) == "encoded"
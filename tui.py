@@ -3,7 +3,7 @@ from textual.containers import Horizontal, VerticalScroll
 from textual.widgets import Button, ContentSwitcher, Markdown, Label
 
 from functions.t_status import StatusTable, OverviewTable
-from functions.t_info import DiskSpaceBar
+from functions.t_info import DiskSpace
 
 MARKDOWN_EXAMPLE = """# Potential docs?"""
 
@@ -25,7 +25,7 @@ class ContentSwitcherApp(App[None]):
                 yield Markdown(MARKDOWN_EXAMPLE)
 
         yield Label("Disk Space")
-        yield DiskSpaceBar(id="disk-space-bar", show_eta=False)
+        yield DiskSpace(id="disk-space")
 
     def on_button_pressed(self, event: Button.Pressed) -> None:
         self.query_one(ContentSwitcher).current = event.button.id
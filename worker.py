@@ -0,0 +1,174 @@
+'''
+Encodes jobs for a daemon running on another machine.
+Asks the coordinator (cluster.coordinator in config.json) for ready_to_encode
+jobs, runs up to job_limits.encode of them at once and reports progress and
+results back. Media must be at the same paths as on the coordinator.
+Stop it with Ctrl+C, unfinished jobs are handed back to the coordinator.
+Press Ctrl+C again to quit without waiting for the coordinator.
+'''
+
+import os
+import select
+import signal
+import socket
+import time
+
+from functions.cluster import send_request
+from functions.config import load_config
+from functions.encoders import check_encoders
+from functions.job import Job
+from functions.priority import check_priorities
+from functions.supervisor import Supervisor
+import functions.logger  # Needed for logging
+
+# How long to wait before trying again when the coordinator is unreachable
+RETRY_INTERVAL = 10
+
+
+def main():
+    '''
+    Encodes leased jobs until it is stopped.
+    '''
+    CONFIG = load_config()
+    host = CONFIG.cluster_coordinator
+    port = CONFIG.cluster_port
+    max_jobs = CONFIG.max_encode_jobs
+    worker_name = f"{socket.gethostname()}-{os.getpid()}"
+
+    if not CONFIG.cluster_secret:
+        print("Set CLUSTER_SECRET in .env to the coordinator's secret.")
+        raise SystemExit(1)
+
+    # This machine's ffmpeg must have every preset's encoder too
+    if not check_encoders(CONFIG.quality_presets):
+        print("Fix quality_presets in config.json and start the worker again.")
+        raise SystemExit(1)
+    check_priorities(CONFIG.priority)
+
+    supervisor = Supervisor(CONFIG.worker_restarts)
+    # uid -> lease, job, fields last sent, next heartbeat time and whether the
+    # encode is done and only its result still has to be delivered
+    leases = {}
+    stopping = False
+
+
+    def signal_handler(sig, frame):
+        nonlocal stopping
+        if not leases or stopping:
+            # Nothing to hand back, do not wait for a lease request to return
+            print("\nWorker stopped.")
+            raise SystemExit(0)
+        stopping = True
+
+
+    signal.signal(signal.SIGINT, signal_handler)
+
+
+    def request(message: dict) -> dict | None:
+        try:
+            return send_request(host, port, {
+                **message,
+                "worker": worker_name,
+                "secret": CONFIG.cluster_secret
+            })
+        except (OSError, ValueError) as e:
+            print(f"Could not reach coordinator {host}:{port}: {e}")
+            return None
+
+
+    def report(op: str, uid: str) -> dict | None:
+        '''
+        Sends a heartbeat, the result or a release for a lease.
+        Returns the reply, or None if the coordinator could not be reached.
+        '''
+        lease = leases[uid]
+        current = dict(lease["job"].items())
+        reply = request({
+            "op": op,
+            "uid": uid,
+            "lease": lease["id"],
+            "changes": {
+                key: value for key, value in current.items()
+                if lease["sent"].get(key) != value
+            }
+        })
+        # Changes that did not arrive are sent again with the next report
+        if reply is not None:
+            lease["sent"] = current
+        lease["next_heartbeat"] = time.monotonic() + lease["heartbeat"]
+        return reply
+
+
+    print(f"Worker {worker_name} encoding for {host}:{port}")
+    next_lease_attempt = 0.0
+
+    while not stopping or leases:
+        # == Ask for work ==
+        if (not stopping and len(supervisor.workers) < max_jobs
+                and time.monotonic() >= next_lease_attempt):
+            # Long poll while idle, otherwise heartbeats must keep flowing
+            reply = request({"op": "lease", "wait": 0 if leases else 30})
+            if reply is None:
+                next_lease_attempt = time.monotonic() + RETRY_INTERVAL
+            elif reply["uid"] is not None:
+                uid = reply["uid"]
+                job = Job(reply["job"], uid)
+                leases[uid] = {
+                    "id": reply["lease"],
+                    "job": job,
+                    "sent": dict(job.items()),
+                    "heartbeat": reply["heartbeat"],
+                    "next_heartbeat": time.monotonic() + reply["heartbeat"],
+                    "done": False
+                }
+                print(f"Starting encoding for UID {uid}")
+                supervisor.start("encode", uid, dict(job))
+                continue
+            elif leases:
+                next_lease_attempt = time.monotonic() + RETRY_INTERVAL
+
+        # == Apply progress from the encodes ==
+        data = {uid: lease["job"] for uid, lease in leases.items()}
+        supervisor.poll(data)
+
+        for uid in list(leases):
+            lease = leases[uid]
+            if lease["done"] or uid not in supervisor.workers:
+                # Finished, or failed after all restarts (status is "error").
+                # The lease is kept until the coordinator has the result,
+                # otherwise it would expire and the encode be thrown away.
+                if not lease["done"]:
+                    lease["done"] = True
+                    lease["next_heartbeat"] = 0
+                    print(f"Finished UID {uid} ({lease['job']['status']})")
+                if time.monotonic() >= lease["next_heartbeat"]:
+                    if report("finish", uid) is not None:
+                        del leases[uid]
+            elif stopping:
+                supervisor.cancel(uid)
+                supervisor.workers.pop(uid).close()
+                report("release", uid)
+                del leases[uid]
+            elif time.monotonic() >= lease["next_heartbeat"]:
+                reply = report("heartbeat", uid)
+                # Keep going if the coordinator is unreachable, the lease may
+                # still be valid when it comes back.
+                if reply is not None and not reply["ok"]:
+                    # The lease expired and may already belong to another
+                    # worker, so the output file is left alone.
+                    print(f"Lease for UID {uid} was revoked, stopping encode")
+                    supervisor.cancel(uid)
+                    supervisor.workers.pop(uid).close()
+                    del leases[uid]
+
+        # == Wait for the encodes or the next heartbeat ==
+        if leases or stopping:
+            select.select(supervisor.fds(), [], [], 1.0)
+        elif time.monotonic() < next_lease_attempt:
+            time.sleep(next_lease_attempt - time.monotonic())
+
+    print("Worker stopped.")
+
+
+if __name__ == "__main__":
+    main()